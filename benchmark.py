@@ -0,0 +1,58 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+from tools.benchmark_tools import Benchmark_Suite
+import tools.general_tools as general_tool
+
+if __name__ == "__main__":
+
+    CONFIGURATION = general_tool.extract_json_data("config.json5")
+    BENCHMARK = CONFIGURATION['benchmark']
+
+    # BENCHMARK CONFIGURATION
+    baseline_file = BENCHMARK['baseline_file'] # JSON file the measurements are compared against (written if it does not exist yet)
+    tolerance = BENCHMARK['tolerance'] # Relative slowdown (or memory growth) reported as a regression
+    update_baseline = BENCHMARK['update_baseline'] # (bool) True to overwrite the baseline with the new measurements
+    repeats = BENCHMARK['repeats'] # Times each case is timed, the fastest one is kept
+    measure_memory = BENCHMARK['measure_memory'] # (bool) True to measure the peak memory of every case on an extra run
+    verify = BENCHMARK['verify'] # (bool) True to check the distances against networkx's shortest paths (timed apart, it is O(n^2))
+
+    # Simulation options shared with main.py
+    simulation_options = {
+        'best_response_mode': CONFIGURATION['best_response_mode'],
+        'use_facility_ranking': CONFIGURATION['facility_ranking'],
+        'recording_level': CONFIGURATION['recording_level'],
+        'recording_interval': CONFIGURATION['recording_interval'],
+        'distance_backend': CONFIGURATION['distance_backend'],
+        'graph_type': CONFIGURATION['graph_type'],
+        'edge_list_path': CONFIGURATION['edge_list_path'],
+        'scheduler': CONFIGURATION['scheduler'],
+        'convergence_threshold': CONFIGURATION['convergence_threshold'],
+        'capacitated_facilities': CONFIGURATION['capacitated_facilities'],
+        'facility_capacity': CONFIGURATION['facility_capacity'],
+        'profile_cache_size': CONFIGURATION['profile_cache_size'],
+        'cycle_revisits': CONFIGURATION['cycle_revisits'],
+    }
+
+    # BENCHMARK
+    suite = Benchmark_Suite(BENCHMARK, CONFIGURATION['max_iterations'], CONFIGURATION['demand_distribution'], CONFIGURATION['weight_distribution'], simulation_options, repeats, measure_memory, verify)
+    results = suite.run()
+
+    for key, measurements in results['cases'].items():
+        outcome = "converged" if measurements['converged'] else "did not converge"
+        print(f"{key}: {measurements['iterations']} iterations ({outcome}), BRD loop {measurements['brd_loop_time']:.4f}s ({1e3 * measurements['time_per_iteration']:.3f}ms per iteration), total {measurements['total_time']:.4f}s")
+
+    baseline = Benchmark_Suite.load(baseline_file)
+    if baseline is None or update_baseline:
+        Benchmark_Suite.save(results, baseline_file)
+        print(f"Baseline written to {baseline_file}")
+        sys.exit()
+
+    regressions = Benchmark_Suite.compare(results, baseline, tolerance)
+    if regressions:
+        print(f"{len(regressions)} regressions against {baseline_file}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"No regressions against {baseline_file}")
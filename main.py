@@ -3,7 +3,12 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 from src.Simulation import Simulation
+from src.Parameter_Sweep import Parameter_Sweep
+from tools.result_tools import Result_Sink
+from tools.cache_tools import Environment_Cache
+from tools.plot_tools import Plotter
 import tools.general_tools as general_tool
+import time
 
 if __name__ == "__main__":
 
@@ -11,6 +16,25 @@ if __name__ == "__main__":
 
     # CONFIGURATION
     capacitated_facilities = CONFIGURATION['capacitated_facilities'] # (bool) True if you want capacitated facilities
+    facility_capacity = CONFIGURATION['facility_capacity'] # Capacity of every facility when capacitated, or ['normal'|'uniform', a, b] to draw one per node (overflow demand goes to the next nearest facility with room)
+    best_response_mode = CONFIGURATION['best_response_mode'] # (str) 'sequential' evaluates candidates one by one, 'batched' scores all of them at once (capacitated facilities always use their own search)
+    scheduler = CONFIGURATION['scheduler'] # (str) Who plays next: 'random' (any player), 'random_dirty' (a player that may still improve), 'round_robin' or 'max_gain' (the largest improvement)
+    use_facility_ranking = CONFIGURATION['facility_ranking'] # (bool) True to look up nearest facilities in a precomputed per-node ranking (pays off with many players, uncapacitated facilities only)
+    cycle_revisits = CONFIGURATION['cycle_revisits'] # (int) Stop a run, reported as not converged, once the players returned this many times to the same occupied-facility profile (a better-response cycle, 0 never stops it)
+    profile_cache_size = CONFIGURATION['profile_cache_size'] # (int) Occupied-facility profiles whose assignment is memoized (LRU) by the 'sequential' best response of uncapacitated facilities, with per-profile tie-breaks (0 disables it, and is required in any other setting)
+    recording_level = CONFIGURATION['recording_level'] # (str) 'full', 'every_k', 'moves' (only iterations with a move) or 'final'
+    recording_interval = CONFIGURATION['recording_interval'] # (int) Record every recording_interval-th iteration when recording_level is 'every_k'
+    distance_backend = CONFIGURATION['distance_backend'] # (str) 'matrix' precomputes all n^2 distances, 'tree' answers them with LCA queries in O(n log n) memory, 'dijkstra' runs Dijkstra on the sparse graph (any graph type)
+    graph_type = CONFIGURATION['graph_type'] # (str) 'tree', 'grid' or 'edge_list' (non-tree graphs need the 'matrix' or 'dijkstra' backend)
+    edge_list_path = CONFIGURATION['edge_list_path'] # File with one 'u v [weight]' edge per line, used when graph_type is 'edge_list' (its nodes override n_nodes)
+    instrumentation = CONFIGURATION['instrumentation'] # (bool) True to count and time the hot path of every run (negligible cost when False)
+    trace_file = CONFIGURATION['trace_file'] # Chrome trace JSON timeline of a single instrumented run (null to skip it)
+    environment_cache_dir = CONFIGURATION['environment_cache_dir'] # Directory caching generated environments and distance matrices (null disables the cache)
+    environment_cache_max_bytes = int(CONFIGURATION['environment_cache_max_bytes']) # Size cap of the cache, least recently used environments are evicted first
+    plot_results = CONFIGURATION['plot_results'] # (bool) True to save plots of the results (a single run, or the mean potential of multiple runs)
+    plot_dir = CONFIGURATION['plot_dir'] # Directory where the plots are saved
+    plot_max_points = CONFIGURATION['plot_max_points'] # Points drawn at most per series, longer series are downsampled
+    plot_decimation = CONFIGURATION['plot_decimation'] # (str) Downsampling of long series: 'lttb', 'min_max' or 'none'
 
     # HYPERPARAMETERS
     # Basics
@@ -20,24 +44,70 @@ if __name__ == "__main__":
     max_iterations = CONFIGURATION['max_iterations'] # Max number of iterations before stopping an episode
     seed = CONFIGURATION['seed']
     n_simulations = CONFIGURATION['n_simulations'] # Number of simulations to run
-    convergence_threshold = CONFIGURATION['convergence_threshold'] # Threshold used to determine convergence of the potential function (Not used in this version of the code)
+    n_workers = CONFIGURATION['n_workers'] # Number of processes running the simulations (1 runs them serially, 0 uses one process per core)
+    lockstep_batch_size = CONFIGURATION['lockstep_batch_size'] # Number of simulations played at once as array operations on the same environment (0 runs them one by one)
+    fresh_environments = CONFIGURATION['fresh_environments'] # (bool) True to generate a new environment for every simulation
+    stream_results = CONFIGURATION['stream_results'] # (bool) True to write every finished simulation to disk instead of keeping them in memory
+    results_dir = CONFIGURATION['results_dir'] # Directory where streamed results are written (one subdirectory per execution)
+    convergence_threshold = CONFIGURATION['convergence_threshold'] # A player only moves if its utility improves by more than this, the BRD converges once no player can
     demand_distribution = tuple(CONFIGURATION['demand_distribution']) # The distribution of the graph's demand (node weights)
     cost_distribution = tuple(CONFIGURATION['weight_distribution']) # The distribution of the graph's costs (edge weights)
 
+    # Dynamic environment
+    n_epochs = CONFIGURATION['n_epochs'] # Number of epochs of a single simulation whose environment changes between epochs, the BRD continuing from the current positions (0 for a static environment)
+    edge_dynamics = CONFIGURATION['edge_dynamics'] # Random walk of the edge weights: fraction of the edges changing every epoch, standard deviation of a change and lowest weight (null for fixed weights, otherwise needs the 'tree' backend)
+    demand_dynamics = CONFIGURATION['demand_dynamics'] # Evolution of the node demand: mode ('random_walk' or 'resample'), fraction of the nodes changing every epoch, standard deviation of a step and lowest demand (null for fixed demand)
+
+    # Parameter sweep
+    run_sweep = CONFIGURATION['run_sweep'] # (bool) True to run every cell of the sweep grid instead of the single configuration above
+    sweep_spec = CONFIGURATION['sweep'] # Values of each swept parameter, the seeds of each cell and the checkpoint file
+
     # SIMULATION
+    environment_cache = Environment_Cache(environment_cache_dir, environment_cache_max_bytes) if environment_cache_dir else None
+    plotter = Plotter(plot_dir, plot_max_points, plot_decimation) if plot_results else None
+
+    if run_sweep:
+
+        # Run every pending cell of the grid, n_simulations repetitions per cell
+        simulation_options = {'best_response_mode': best_response_mode, 'use_facility_ranking': use_facility_ranking, 'recording_level': recording_level, 'recording_interval': recording_interval, 'distance_backend': distance_backend, 'graph_type': graph_type, 'edge_list_path': edge_list_path, 'scheduler': scheduler, 'convergence_threshold': convergence_threshold, 'capacitated_facilities': capacitated_facilities, 'facility_capacity': facility_capacity, 'profile_cache_size': profile_cache_size, 'cycle_revisits': cycle_revisits, 'environment_cache': environment_cache, 'instrumentation': instrumentation}
+        sweep = Parameter_Sweep(sweep_spec, max_iterations, n_simulations, sweep_spec['checkpoint_file'], n_workers or None, simulation_options)
+        for result in sweep.run():
+            print(f"Cell {result['key']}: {result['avg_iterations']} iterations on average, final potential {result['final_potential_mean']}")
+        sys.exit()
+
     # Setup simulation
-    simulation = Simulation(n_nodes, n_potential_facilities, n_brd_players, max_iterations, seed, demand_distribution, cost_distribution)
+    simulation = Simulation(n_nodes, n_potential_facilities, n_brd_players, max_iterations, seed, demand_distribution, cost_distribution, best_response_mode, use_facility_ranking, recording_level, recording_interval, distance_backend, graph_type, edge_list_path, scheduler, convergence_threshold, capacitated_facilities, facility_capacity, edge_dynamics, demand_dynamics, profile_cache_size, cycle_revisits, environment_cache=environment_cache, instrumentation=instrumentation, trace=bool(trace_file))
     
     # Run simulations
     if n_simulations == 1:
-        iterations, potential_function_development, players_development_over_time = simulation.run_FLG_BRD_simulation()
-        simulation.show_simulation_results(iterations, potential_function_development, players_development_over_time, True)
+        if n_epochs:
+            iterations, trajectory, epoch_iterations = simulation.run_dynamic_simulation(n_epochs)
+            print(f"Iterations of every epoch: {epoch_iterations}")
+        else:
+            iterations, trajectory = simulation.run_FLG_BRD_simulation()
+        simulation.show_simulation_results(iterations, trajectory, plotter)
+        if profile_cache_size:
+            print(f"Profile cache: {simulation.BRD_setup.profile_cache.statistics()}")
+        if instrumentation:
+            print(f"Instrumentation: {trajectory.profile}")
+            if trace_file:
+                simulation.instrumentation.export_chrome_trace(trace_file)
 
     else:
 
         assert (isinstance(n_simulations, int) and n_simulations > 1)
-        avg_iterations, potential_function_developments_per_iteration, players_development_per_iteration = simulation.run_simulations(n_simulations)
-        simulation.show_multiple_simulations_results(avg_iterations, potential_function_developments_per_iteration, players_development_per_iteration)
+        if n_epochs:
+            raise ValueError("Dynamic simulations (n_epochs) run a single simulation, set n_simulations to 1 or n_epochs to 0.")
+        if lockstep_batch_size and fresh_environments:
+            raise ValueError("Lockstep simulations share one environment, set lockstep_batch_size to 0 or fresh_environments to false.")
+        result_sink = Result_Sink(os.path.join(results_dir, time.strftime("%Y%m%d-%H%M%S")), n_brd_players) if stream_results else None
+        if lockstep_batch_size and not fresh_environments:
+            avg_iterations, results = simulation.run_simulations_lockstep(n_simulations, lockstep_batch_size, result_sink)
+        elif n_workers == 1:
+            avg_iterations, results = simulation.run_simulations(n_simulations, fresh_environments, result_sink)
+        else:
+            avg_iterations, results = simulation.run_simulations_parallel(n_simulations, n_workers or None, fresh_environments, result_sink)
+        simulation.show_multiple_simulations_results(avg_iterations, results, plotter)
         
 
 
@@ -1,18 +1,77 @@
+from tools.instrumentation_tools import NULL_INSTRUMENTATION
+from tools.capacity_tools import Capacitated_Assignment
+from tools.profile_cache_tools import Profile_Cache
+
 import numpy as np
 
 class BRD():
 
-    def __init__(self, n_players, distances, FLG_env, seed=42):
+    BATCH_ELEMENTS = 1 << 22 # Max number of (candidate, node) pairs scored at once in the batched best response
+    VISITED_PROFILES = 4096 # Profiles remembered to detect cycles when no profile cache is configured
+
+    def __init__(self, n_players, distances, FLG_env, seed=42, best_response_mode='sequential', facility_ranking=None, convergence_threshold=0.0, profile_cache_size=0, cycle_revisits=0, instrumentation=NULL_INSTRUMENTATION):
+
+        """
+        Best response dynamics of the facility location game. Utilities are exact, but the game is not an exact potential
+        game: a move also changes the cost of the nodes the other players keep, so the sum of the utilities can drop when
+        a player improves, and nodes at the same distance from several facilities are split at random anew every time a
+        profile is evaluated. Better responses can therefore cycle instead of reaching a pure Nash equilibrium, which is
+        detected as the game returning to an occupied-facility profile it was in before. Because of the random turns and
+        tie-breaks a game can still leave a profile it returned to once, so a cycle is only declared after cycle_revisits
+        returns to the same profile.
+
+        Args:
+            n_players (int): Number of players in the game
+            distances: Distance engine indexed by node id
+            FLG_env (FLG_environment): The environment the game is played on
+            seed: Seed of the generator used for the initial positions and the tie-breaking
+            best_response_mode (str): 'sequential' evaluates the free facilities one by one, 'batched' all of them at once.
+                                      Capacitated facilities always use their own search (find_capacitated_best_response),
+                                      whatever the mode
+            facility_ranking (Facility_Ranking): Optional per-node ranking of the potential facilities (uncapacitated only)
+            convergence_threshold (float): A player only moves if its utility improves by more than this
+            profile_cache_size (int): Occupied-facility profiles memoized by the sequential best response (0 disables it,
+                                      other modes and capacitated facilities need 0)
+            cycle_revisits (int): Returns to the same profile after which the play ends, see cycling (0 never ends it)
+            instrumentation (Instrumentation): Counters and timers of the run
+        """
+
+        if best_response_mode not in ('sequential', 'batched'):
+            raise ValueError("Unsupported best response mode.")
+        if FLG_env.node_capacity is not None and facility_ranking is not None:
+            raise ValueError("Capacitated facilities do not support the facility ranking.")
+        if profile_cache_size and (best_response_mode != 'sequential' or FLG_env.node_capacity is not None):
+            raise ValueError("The profile cache memoizes the uncapacitated 'sequential' best response, set profile_cache_size to 0 for other modes.")
 
         self.n_players = n_players
-        self.distances = distances
-        self.nodes_demand = FLG_env.node_demand
-        self.potential_facilities = FLG_env.potential_facilities_mask
+        self.distances = distances # Distance engine (e.g. Distance_Matrix) indexed by node id
+        self.facility_ranking = facility_ranking # Optional per-node ranking of the potential facilities (Facility_Ranking)
+        self.assignment_engine = facility_ranking if facility_ranking is not None else distances
+        self.nodes_demand = np.asarray(FLG_env.node_demand)
+        self.potential_facilities = np.asarray(FLG_env.potential_facilities_mask, dtype=bool)
+        self.node_capacity = FLG_env.node_capacity # Capacity of a facility at every node, None when uncapacitated
+        self.capacitated_assignment = None # Capacitated_Assignment of the demand when facilities are capacitated
         self.seed = seed
         self.rng = np.random.default_rng(seed=self.seed)
+        self.best_response_mode = best_response_mode
+        self.convergence_threshold = convergence_threshold # A player only moves if its utility improves by more than this
+        self.instrumentation = instrumentation # Counters and timers of the run (does nothing unless enabled)
+        self.response_margin = np.full(n_players, -np.inf) # How far below its utility every player's best other facility was when last evaluated
+        self.cycle_revisits = cycle_revisits
+        self.cycle_length = None # Moves between the last two visits of the profile that reached cycle_revisits returns, None while none did
 
         self.players = self.create_players()
 
+        # Optional memo of the assignment of the occupied-facility profiles already evaluated, which also detects cycles
+        self.profile_cache = None
+        self.memoize_profiles = bool(profile_cache_size)
+        if profile_cache_size:
+            self.profile_cache = Profile_Cache(profile_cache_size, seed=int(self.rng.integers(2**63)))
+        elif cycle_revisits:
+            self.profile_cache = Profile_Cache(self.VISITED_PROFILES) # Only its visited profiles are used
+        if self.profile_cache is not None:
+            self.profile_cache.clear(self.current_profile())
+
 
     def create_players(self):
 
@@ -24,7 +83,7 @@ class BRD():
         """
 
         # Check amount of players is less than the number of available facilities
-        if self.n_players > sum(self.potential_facilities):
+        if self.n_players > np.count_nonzero(self.potential_facilities):
             raise ValueError("More players than available facilities.")
 
         #print("Nodes demands: " + str(self.nodes_demand))
@@ -32,7 +91,7 @@ class BRD():
         # Create a dictionary of nodes where is possible to put a facility, the value is initialized to 0 to indicate that in that potential facility there is no player assigned
         # and the key is the index of the potential facility
         self.facility_options = {
-            i: 0 for i, is_potential in enumerate(self.potential_facilities) if is_potential == 1
+            i: 0 for i in np.flatnonzero(self.potential_facilities).tolist()
         }
 
         # Create players and assign them to random facilities
@@ -42,10 +101,8 @@ class BRD():
             players[i] = {'facility_position': selected_random_facility, 'Utility': None}
             self.facility_options[selected_random_facility] = 1  # Mark the facility as occupied by a player
 
-        # Update the utilities of all players
-        for player_data in players.values():
-            taken_facilities = [facility for facility, taken in self.facility_options.items() if taken == 1]
-            player_data['Utility'] = self.calculate_facility_utility(player_data['facility_position'], taken_facilities)
+        # Assign every node to its nearest player and update the utilities of all players
+        self.initialize_assignment(players)
 
         #print("Players created with their initial positions and utilities:" + str(players)) 
 
@@ -64,9 +121,62 @@ class BRD():
             bool: if a better facility was found
         """
 
+        best_option, gain = self.evaluate_best_response(player_id)
+
+        # Update if a better option was found
+        if gain > self.convergence_threshold:
+            self.move_player(player_id, best_option)
+            return True
+        return False
+
+
+    def evaluate_best_response(self, player_id):
+
+        """
+        Finds the best response of a player without moving it.
+
+        Args:
+            player_id (int): The player that will find its best response
+
+        Returns:
+            best_option (int): The facility with the highest utility (the current one if no better option exists)
+            gain (float): How much the player's utility improves by moving to best_option (0 if it stays)
+        """
+
+        current_facility = self.players[player_id]['facility_position']
+
+        with self.instrumentation.timer('find_best_response'):
+            if self.capacitated_assignment is not None:
+                best_option, best_utility, alternative_utility = self.find_capacitated_best_response(player_id)
+            elif self.best_response_mode == 'batched':
+                best_option, best_utility, alternative_utility = self.find_batched_best_response(player_id)
+            else:
+                best_option, best_utility, alternative_utility = self.find_sequential_best_response(player_id)
+        self.response_margin[player_id] = self.players[player_id]['Utility'] - alternative_utility
+
+        if best_option == current_facility:
+            return current_facility, 0.0
+        return best_option, best_utility - self.players[player_id]['Utility']
+
+
+    def find_sequential_best_response(self, player_id):
+
+        """
+        Evaluates every free facility one by one, recomputing the whole assignment for each of them.
+
+        Args:
+            player_id (int): The player that will find its best response
+
+        Returns:
+            best_option (int): The facility with the highest utility (the current one if no better option exists)
+            best_utility (float): The utility of best_option
+            alternative_utility (float): The highest utility among the other facilities
+        """
+
         current_facility = self.players[player_id]['facility_position']
         best_option = current_facility
         best_utility = self.players[player_id]['Utility']
+        alternative_utility = -np.inf
 
         # Temporarily free the current facility
         self.facility_options[current_facility] = 0
@@ -81,6 +191,9 @@ class BRD():
                 f for f, taken in self.facility_options.items() if taken == 1 or f == option  # Include the new facility
             ]
             utility = self.calculate_facility_utility(option, taken_facilities)
+            self.instrumentation.count('candidates_scanned')
+            if option != current_facility:
+                alternative_utility = max(alternative_utility, utility)
             
             # Take the option with the highest utility
             if utility > best_utility:
@@ -90,14 +203,336 @@ class BRD():
         # Restore the current facility’s state
         self.facility_options[current_facility] = 1
 
-        # Update if a better option was found
-        if best_option != current_facility:
-            self.facility_options[current_facility] = 0 # Leave current facility
-            self.facility_options[best_option] = 1 # Take better facility
-            self.players[player_id]['facility_position'] = best_option # Update player's facility
-            self.players[player_id]['Utility'] = best_utility #Update player's utility
-            return True
-        return False
+        return best_option, best_utility, alternative_utility
+
+
+    def find_batched_best_response(self, player_id):
+
+        """
+        Scores every candidate facility of the player in one pass. The other players stay fixed, so each candidate only
+        has to be compared against the distance from every node to its nearest other player.
+
+        Args:
+            player_id (int): The player that will find its best response
+
+        Returns:
+            best_option (int): The facility with the highest utility (the current one if no better option exists)
+            best_utility (float): The utility of best_option
+            alternative_utility (float): The highest utility among the other facilities
+        """
+
+        current_facility = self.players[player_id]['facility_position']
+
+        # Candidates are the free facilities plus the current one, in the same order the sequential search visits them
+        candidates = np.array([f for f, taken in self.facility_options.items() if taken == 0 or f == current_facility])
+        others = np.array([f for f, taken in self.facility_options.items() if taken == 1 and f != current_facility])
+
+        # Distance from every node to its nearest other player and how many other players are at that distance
+        if others.size:
+            other_distances = self.distances.columns(others)
+            nearest_other = other_distances.min(axis=0)
+            n_tied_others = (other_distances == nearest_other).sum(axis=0)
+        else:
+            nearest_other = np.full(self.distances.n_nodes, np.inf)
+            n_tied_others = np.zeros(self.distances.n_nodes, dtype=int)
+
+        self.instrumentation.count('candidates_scanned', candidates.size)
+        self.instrumentation.count('utility_evaluations', candidates.size)
+        utilities = np.empty(candidates.size)
+        chunk_size = max(1, self.BATCH_ELEMENTS // self.distances.n_nodes)
+        for start in range(0, candidates.size, chunk_size):
+
+            candidate_distances = self.distances.columns(candidates[start:start + chunk_size])
+            captured = candidate_distances < nearest_other
+
+            # A node tied with t other players is won with probability 1/(t+1), as under the random tie-breaking rule
+            tied_rows, tied_nodes = np.nonzero(candidate_distances == nearest_other)
+            if tied_rows.size:
+                self.instrumentation.count('random_tie_breaks', tied_rows.size)
+                captured[tied_rows, tied_nodes] = self.rng.random(tied_rows.size) * (n_tied_others[tied_nodes] + 1) < 1
+
+            # Utility is the captured demand minus the cost of serving it
+            utilities[start:start + chunk_size] = np.where(captured, self.nodes_demand - candidate_distances, 0).sum(axis=1)
+
+        # Keep the current facility unless some candidate strictly improves the player's utility
+        alternative_utility = utilities[candidates != current_facility].max(initial=-np.inf)
+        best_index = np.argmax(utilities)
+        if utilities[best_index] > self.players[player_id]['Utility']:
+            return candidates[best_index], utilities[best_index], alternative_utility
+        return current_facility, self.players[player_id]['Utility'], alternative_utility
+
+
+    def find_capacitated_best_response(self, player_id):
+
+        """
+        Evaluates every free facility when facilities are capacitated, solving again only the flow each move affects.
+
+        Args:
+            player_id (int): The player that will find its best response
+
+        Returns:
+            best_option (int): The facility with the highest utility (the current one if no better option exists)
+            best_utility (float): The utility of best_option
+            alternative_utility (float): The highest utility among the other facilities
+        """
+
+        best_option = self.players[player_id]['facility_position']
+        best_utility = self.players[player_id]['Utility']
+        alternative_utility = -np.inf
+
+        for option, taken in self.facility_options.items():
+            if taken == 1:
+                continue # Skip the current facility and the ones occupied by others
+
+            utility = self.capacitated_assignment.evaluate_move(player_id, option)
+            self.instrumentation.count('candidates_scanned')
+            self.instrumentation.count('utility_evaluations')
+            alternative_utility = max(alternative_utility, utility)
+
+            # Take the option with the highest utility
+            if utility > best_utility:
+                best_utility = utility
+                best_option = option
+
+        return best_option, best_utility, alternative_utility
+
+
+    def initialize_assignment(self, players):
+
+        """
+        Assigns every node to its nearest player and computes the demand and cost totals each player captures, from which
+        all utilities are derived.
+
+        Args:
+            players (dict): The players with their facility positions, their utilities are updated in place
+        """
+
+        # Player that owns each facility node (-1 if the node is not taken)
+        self.facility_player = np.full(self.distances.n_nodes, -1, dtype=np.intp)
+        for player_id, player_data in players.items():
+            self.facility_player[player_data['facility_position']] = player_id
+
+        taken_facilities = np.array([player_data['facility_position'] for player_data in players.values()])
+
+        if self.node_capacity is not None:
+            # Demand is split among the facilities with room instead of going to the nearest one, see Capacitated_Assignment
+            self.capacitated_assignment = Capacitated_Assignment(self.distances, self.nodes_demand, self.node_capacity, taken_facilities, self.rng, self.instrumentation)
+            self.player_demand, self.player_cost = self.capacitated_assignment.player_demand, self.capacitated_assignment.player_cost
+            for player_id, player_data in players.items():
+                player_data['Utility'] = self.player_demand[player_id] - self.player_cost[player_id]
+            return
+
+        self.node_assignment, self.node_distance = self.assignment_engine.assign_nearest_facilities(taken_facilities, self.rng, instrumentation=self.instrumentation)
+        self.instrumentation.count('nearest_node_computations')
+
+        node_players = self.facility_player[self.node_assignment]
+        self.player_demand = np.bincount(node_players, weights=self.nodes_demand, minlength=self.n_players)
+        self.player_cost = np.bincount(node_players, weights=self.node_distance, minlength=self.n_players)
+
+        for player_id, player_data in players.items():
+            player_data['Utility'] = self.player_demand[player_id] - self.player_cost[player_id]
+
+
+    def move_player(self, player_id, new_facility):
+
+        """
+        Moves a player to a new facility and updates the assignment incrementally: only the nodes that switch Voronoi
+        cells are reassigned (with capacitated facilities, only the affected flow), and the utilities of all players are
+        kept exact.
+
+        Args:
+            player_id (int): The player that moves
+            new_facility (int): The free facility the player moves to
+        """
+
+        current_facility = self.players[player_id]['facility_position']
+        self.response_margin[:] = -np.inf # The move changes the game every player faces
+
+        if self.capacitated_assignment is not None:
+            self.player_demand, self.player_cost = self.capacitated_assignment.move(player_id, new_facility)
+            self.facility_options[current_facility] = 0
+            self.facility_options[new_facility] = 1
+            self.players[player_id]['facility_position'] = new_facility
+            self.facility_player[current_facility] = -1
+            self.facility_player[new_facility] = player_id
+            for pid, player_data in self.players.items():
+                player_data['Utility'] = self.player_demand[pid] - self.player_cost[pid]
+            self.record_profile()
+            return
+
+        # Engines that can re-settle only the region that changes (e.g. Dijkstra_Distance) reassign the nodes themselves
+        incremental = hasattr(self.assignment_engine, 'reassign_after_move')
+        if incremental:
+            changed_nodes, new_assignment, new_distance = self.assignment_engine.reassign_after_move(self.node_assignment, self.node_distance, current_facility, new_facility, self.rng, self.instrumentation)
+            self.instrumentation.count('nearest_node_computations')
+        else:
+            # Nodes that lose their facility, plus nodes at least as close to the new facility as to their current one (ties are redrawn)
+            changed_nodes = np.flatnonzero((self.node_assignment == current_facility) | (self.distances.column(new_facility) <= self.node_distance))
+        old_players = self.facility_player[self.node_assignment[changed_nodes]]
+
+        self.facility_options[current_facility] = 0 # Leave current facility
+        self.facility_options[new_facility] = 1 # Take new facility
+        self.players[player_id]['facility_position'] = new_facility # Update player's facility
+        self.facility_player[current_facility] = -1
+        self.facility_player[new_facility] = player_id
+
+        if not incremental:
+            taken_facilities = np.array([player_data['facility_position'] for player_data in self.players.values()])
+            new_assignment, new_distance = self.assignment_engine.assign_nearest_facilities(taken_facilities, self.rng, nodes=changed_nodes, instrumentation=self.instrumentation)
+            self.instrumentation.count('nearest_node_computations')
+        self.reassign_nodes(changed_nodes, old_players, new_assignment, new_distance)
+        self.record_profile()
+
+
+    def current_profile(self):
+
+        # Canonical occupied-facility profile of the game
+        return Profile_Cache.key(player_data['facility_position'] for player_data in self.players.values())
+
+
+    def record_profile(self):
+
+        # Remember the profile the game moved to, counting a cycle if it was in it before
+        if self.profile_cache is not None:
+            cycle_length = self.profile_cache.record_visit(self.current_profile())
+            if cycle_length is not None:
+                self.instrumentation.count('profile_revisits')
+                if self.cycle_revisits and self.cycle_length is None and self.profile_cache.last_profile_revisits >= self.cycle_revisits:
+                    self.cycle_length = cycle_length
+
+
+    def cycling(self):
+
+        # True once the game returned cycle_revisits times to the same profile and the play should stop without having converged
+        return self.cycle_length is not None
+
+
+    def forget_profiles(self):
+
+        # The game changed (distances or demand), so the profiles seen so far neither hold their old totals nor form a cycle
+        self.cycle_length = None
+        if self.profile_cache is not None:
+            self.profile_cache.clear(self.current_profile())
+
+
+    def profile_totals(self, profile):
+
+        """
+        Assigns every node to its nearest facility of a profile, with the profile's own tie-breaks (see Profile_Cache).
+
+        Args:
+            profile (tuple): Sorted occupied facilities
+
+        Returns:
+            demand (np.ndarray): Demand every facility of the profile captures, in profile order
+            cost (np.ndarray): Cost of serving it
+        """
+
+        facilities = np.array(profile, dtype=np.intp)
+        assignment, nearest_distance = self.assignment_engine.assign_nearest_facilities(facilities, self.profile_cache.tie_break_rng(profile), instrumentation=self.instrumentation)
+        self.instrumentation.count('nearest_node_computations')
+        owner = np.searchsorted(facilities, assignment)
+        demand = np.bincount(owner, weights=self.nodes_demand, minlength=facilities.size)
+        cost = np.bincount(owner, weights=nearest_distance, minlength=facilities.size)
+        return demand, cost
+
+
+    def reassign_nodes(self, changed_nodes, old_players, new_assignment, new_distance):
+
+        """
+        Moves the demand and cost of some nodes from their old players to their new ones and updates the utilities.
+
+        Args:
+            changed_nodes (np.ndarray): The nodes whose assignment or distance changed
+            old_players (np.ndarray): The player every node was assigned to
+            new_assignment (np.ndarray): The facility every node is assigned to now
+            new_distance (np.ndarray): The distance from every node to its facility now
+        """
+
+        new_players = self.facility_player[new_assignment]
+        changed_demand = self.nodes_demand[changed_nodes]
+        self.player_demand += np.bincount(new_players, weights=changed_demand, minlength=self.n_players) - np.bincount(old_players, weights=changed_demand, minlength=self.n_players)
+        self.player_cost += np.bincount(new_players, weights=new_distance, minlength=self.n_players) - np.bincount(old_players, weights=self.node_distance[changed_nodes], minlength=self.n_players)
+
+        self.node_assignment[changed_nodes] = new_assignment
+        self.node_distance[changed_nodes] = new_distance
+
+        for pid, player_data in self.players.items():
+            player_data['Utility'] = self.player_demand[pid] - self.player_cost[pid]
+
+
+    def apply_edge_weight_changes(self, children, deltas):
+
+        """
+        Updates the assignment after the distance engine changed the weight of some edges of the tree (see
+        Tree_Distance.update_edge_weights). The players keep their facilities, only the nodes whose nearest facility may
+        have changed are reassigned, and the nodes that keep it get their new distance.
+
+        Args:
+            children (np.ndarray): The node below every changed edge
+            deltas (np.ndarray): Change of the weight of every edge
+        """
+
+        self.response_margin[:] = -np.inf
+        self.forget_profiles() # The stored profiles were assigned with the old distances
+        if self.capacitated_assignment is not None:
+            self.player_demand, self.player_cost = self.capacitated_assignment.solve()
+            for pid, player_data in self.players.items():
+                player_data['Utility'] = self.player_demand[pid] - self.player_cost[pid]
+            return
+
+        taken_facilities = np.array([player_data['facility_position'] for player_data in self.players.values()])
+        reassign, moved = self.distances.edge_change_regions(children, deltas, self.node_assignment, taken_facilities)
+        moved = np.setdiff1d(moved, reassign, assume_unique=True)
+
+        new_assignment, new_distance = self.distances.assign_nearest_facilities(taken_facilities, self.rng, nodes=reassign, instrumentation=self.instrumentation)
+        self.instrumentation.count('nearest_node_computations')
+        self.instrumentation.count('reassigned_nodes', reassign.size)
+
+        changed_nodes = np.concatenate((reassign, moved))
+        new_assignment = np.concatenate((new_assignment, self.node_assignment[moved]))
+        new_distance = np.concatenate((new_distance, self.distances.dist(moved, self.node_assignment[moved])))
+        self.reassign_nodes(changed_nodes, self.facility_player[self.node_assignment[changed_nodes]], new_assignment, new_distance)
+
+
+    def apply_demand_changes(self, nodes, demand):
+
+        """
+        Changes the demand of some nodes. The assignment only depends on the distances, so only the demand captured by
+        the players serving those nodes changes (with capacitated facilities the flow is solved again).
+
+        Args:
+            nodes (np.ndarray): The nodes whose demand changed
+            demand (np.ndarray): Their new demand
+
+        Returns:
+            recheck (np.ndarray): The players whose best response may have changed. Any other facility can gain at most
+                                  the added demand, so a player that serves none of the nodes only needs to be checked
+                                  again if its last best response was within that much of improving (up to the
+                                  random tie-breaking, which draws anew at every evaluation).
+        """
+
+        deltas = demand - self.nodes_demand[nodes]
+        self.nodes_demand = self.nodes_demand.copy() # The environment's array may be memory-mapped or shared
+        self.nodes_demand[nodes] = demand
+        self.forget_profiles() # The stored profiles hold the old demand
+
+        if self.capacitated_assignment is not None:
+            self.capacitated_assignment.nodes_demand[nodes] = demand
+            self.player_demand, self.player_cost = self.capacitated_assignment.solve()
+            for pid, player_data in self.players.items():
+                player_data['Utility'] = self.player_demand[pid] - self.player_cost[pid]
+            self.response_margin[:] = -np.inf
+            return np.ones(self.n_players, dtype=bool)
+
+        owners = self.facility_player[self.node_assignment[nodes]]
+        self.player_demand += np.bincount(owners, weights=deltas, minlength=self.n_players)
+        for pid in np.unique(owners).tolist():
+            self.players[pid]['Utility'] = self.player_demand[pid] - self.player_cost[pid]
+
+        self.response_margin -= np.clip(deltas, 0, None).sum()
+        self.response_margin[owners] = -np.inf
+        return self.response_margin < -self.convergence_threshold
 
 
     def calculate_facility_utility(self, target_facility, taken_facilities):
@@ -113,15 +548,30 @@ class BRD():
             utility: The utility of the target_facility
         """
 
+        if self.memoize_profiles:
+
+            # Profiles already evaluated, on earlier turns or by other players, are looked up
+            profile = Profile_Cache.key(taken_facilities)
+            entry = self.profile_cache.get(profile)
+            if entry is None:
+                entry = self.profile_totals(profile)
+                self.profile_cache.put(profile, *entry)
+            self.instrumentation.count('utility_evaluations')
+            demand, cost = entry
+            index = profile.index(int(target_facility))
+            return demand[index] - cost[index]
+
         # Utilities reward both demand capture and cost minimization
-        nearest_nodes = self.calculate_nearest_nodes(taken_facilities)
-        captured_clients = nearest_nodes.get(target_facility, [])
+        assignment, nearest_distance = self.assignment_engine.assign_nearest_facilities(taken_facilities, self.rng, instrumentation=self.instrumentation)
+        self.instrumentation.count('nearest_node_computations')
+        self.instrumentation.count('utility_evaluations')
+        captured_clients = assignment == target_facility
         
         # Calculate the total demand of captured clients (including the facility's own node)
-        sum_demands = sum(self.nodes_demand[c] for c in captured_clients)
+        sum_demands = self.nodes_demand[captured_clients].sum()
         
         # Calculate the total cost (distances) for all captured clients
-        sum_costs = sum(self.distances[c][target_facility] for c in captured_clients)
+        sum_costs = nearest_distance[captured_clients].sum()
         
         # Utility is the total demand minus total cost
         utility = sum_demands - sum_costs
@@ -140,27 +590,12 @@ class BRD():
             facilities_nearest_nodes (dict): Each taken facility with thier correspondent nearest nodes.
         """
 
-        # Create a dictionary where the keys are the taken facilities and the values will hold the nearest nodes to each facility
-        facilities_nearest_nodes = {facility: [] for facility in taken_facilities}
-
-        for node in self.distances:
-
-            if node in taken_facilities:
-                facilities_nearest_nodes[node].append(node)
-                continue
+        # Voronoi assignment of every node to its nearest taken facility, ties broken at random
+        assignment, _ = self.assignment_engine.assign_nearest_facilities(taken_facilities, self.rng, instrumentation=self.instrumentation)
+        self.instrumentation.count('nearest_node_computations')
 
-            node_distances = self.distances[node] # Access to the disrances of the analyzed node to all other nodes
-
-            min_distance = min(node_distances[facility] for facility in taken_facilities) # Calculate the minimum distance from the analyzed node to all taken facilities
-
-            closest_facilities = [
-                facility for facility in taken_facilities if node_distances[facility] == min_distance # Select all nodes that are at the minimum distance from the analyzed node
-            ]
-            
-            # Apply tie-breaking rule (random assignment)            
-            chosen_facility = self.rng.choice(closest_facilities) if len(closest_facilities) > 1 else closest_facilities[0]
-            
-            facilities_nearest_nodes[chosen_facility].append(node)
+        # Create a dictionary where the keys are the taken facilities and the values hold the nearest nodes to each facility
+        facilities_nearest_nodes = {facility: np.flatnonzero(assignment == facility).tolist() for facility in taken_facilities}
 
         return facilities_nearest_nodes
 
@@ -1,21 +1,159 @@
-import networkx as nx
+from tools.distance_tools import build_csr
+
+import random
 import numpy as np
 
 class FLG_environment:
 
-    def __init__(self, n_nodes, potential_facilities, seed=42, demand_distribution=('normal',20,5), weight_distribution=('normal',5,1)):
-        
+    GRAPH_TYPES = ('tree', 'grid', 'edge_list')
+
+    __slots__ = ('n_nodes', 'seed', 'demand_distribution', 'weight_distribution', 'potential_facilities', 'graph_type', 'edge_list_path', 'facility_capacity', 'rng',
+                 'edges', 'edge_weights', 'node_demand', 'potential_facilities_mask', 'node_capacity', 'loaded_edges', '_csr', '_graph')
+
+    def __init__(self, n_nodes, potential_facilities, seed=42, demand_distribution=('normal',20,5), weight_distribution=('normal',5,1), graph_type='tree', edge_list_path=None, facility_capacity=None):
+
+        """
+        Environment of the game stored as arrays: the edges with their weights, the demand of every node, the mask of the
+        potential facilities and, if facilities are capacitated, the capacity of a facility opened at every node. The
+        NetworkX graph and the CSR adjacency are only built when something asks for them.
+        """
+
         self.n_nodes = n_nodes
         self.seed = seed
         self.demand_distribution = demand_distribution
         self.weight_distribution = weight_distribution
         self.potential_facilities = potential_facilities
-        self.rng = np.random.default_rng(seed=self.seed)        
+        self.graph_type = graph_type # 'tree' (random labeled tree), 'grid' (2D grid) or 'edge_list' (loaded from edge_list_path)
+        self.edge_list_path = edge_list_path
+        self.facility_capacity = facility_capacity # None (uncapacitated), a capacity shared by every node, or a ('normal'|'uniform', a, b) distribution of per-node capacities
+        self.rng = np.random.default_rng(seed=self.seed)
+        self._csr = None
+        self._graph = None
+
+        if self.graph_type not in self.GRAPH_TYPES:
+            raise ValueError("Unsupported graph type.")
+
+        # A loaded graph defines the number of nodes
+        if self.graph_type == 'edge_list':
+            self.loaded_edges = self.load_edge_list()
 
         self.check_potential_facilities()
         self.generate_flg_env()
 
 
+    @classmethod
+    def from_arrays(cls, n_nodes, potential_facilities, arrays, seed=42, demand_distribution=('normal',20,5), weight_distribution=('normal',5,1), graph_type='tree', edge_list_path=None, facility_capacity=None):
+
+        """
+        Rebuilds an environment from the arrays returned by to_arrays instead of generating it.
+
+        Args:
+            arrays (dict): 'edges', 'edge_weights', 'node_demand', 'potential_facilities_mask' and, if capacitated,
+                           'node_capacity' of the environment
+        """
+
+        env = cls.__new__(cls)
+        env.n_nodes = arrays['node_demand'].shape[0]
+        env.seed = seed
+        env.demand_distribution = demand_distribution
+        env.weight_distribution = weight_distribution
+        env.potential_facilities = potential_facilities
+        env.graph_type = graph_type
+        env.edge_list_path = edge_list_path
+        env.facility_capacity = facility_capacity
+        env.rng = np.random.default_rng(seed=env.seed)
+        env._csr = None
+        env._graph = None
+
+        env.edges = arrays['edges']
+        env.edge_weights = arrays['edge_weights']
+        env.node_demand = arrays['node_demand']
+        env.potential_facilities_mask = arrays['potential_facilities_mask'].astype(bool, copy=False)
+        env.node_capacity = arrays.get('node_capacity')
+
+        return env
+
+
+    def to_arrays(self):
+
+        # Arrays that fully describe the environment, see from_arrays
+        arrays = {
+            'edges': self.edges,
+            'edge_weights': self.edge_weights,
+            'node_demand': self.node_demand,
+            'potential_facilities_mask': self.potential_facilities_mask,
+        }
+        if self.node_capacity is not None:
+            arrays['node_capacity'] = self.node_capacity
+        return arrays
+
+
+    @property
+    def csr(self):
+
+        # Symmetric CSR adjacency (indptr, indices, weights), built on first use
+        if self._csr is None:
+            self._csr = build_csr(self.n_nodes, self.edges, self.edge_weights)
+        return self._csr
+
+
+    @property
+    def graph(self):
+
+        # NetworkX graph with 'weight' edge attributes, built on first use
+        if self._graph is None:
+            import networkx as nx # Only imported when a NetworkX graph is needed
+            G = nx.Graph()
+            G.add_nodes_from(range(self.n_nodes))
+            G.add_weighted_edges_from(zip(self.edges[:, 0].tolist(), self.edges[:, 1].tolist(), self.edge_weights.tolist()))
+            self._graph = G
+        return self._graph
+
+
+    def set_edge_weights(self, edge_indices, weights):
+
+        """
+        Changes the weights of some edges, e.g. between the epochs of a dynamic simulation.
+
+        Args:
+            edge_indices (np.ndarray): Rows of the changed edges in edges
+            weights (np.ndarray): Their new weights
+
+        Returns:
+            deltas (np.ndarray): How much the weight of every edge changed
+        """
+
+        # A new array, the old one may be memory-mapped from the cache or shared with other processes
+        edge_weights = np.array(self.edge_weights)
+        deltas = weights - edge_weights[edge_indices]
+        edge_weights[edge_indices] = weights
+        self.edge_weights = edge_weights
+        self._csr = None
+        self._graph = None
+        return deltas
+
+
+    def set_node_demand(self, nodes, demand):
+
+        """
+        Changes the demand of some nodes, e.g. between the epochs of a dynamic simulation.
+
+        Args:
+            nodes (np.ndarray): The changed nodes
+            demand (np.ndarray): Their new demand
+
+        Returns:
+            deltas (np.ndarray): How much the demand of every node changed
+        """
+
+        # A new array, the old one may be memory-mapped from the cache or shared with other processes
+        node_demand = np.array(self.node_demand)
+        deltas = demand - node_demand[nodes]
+        node_demand[nodes] = demand
+        self.node_demand = node_demand
+        return deltas
+
+
     def check_potential_facilities(self):
 
         # Make sure that the number of potential facilities is a valid number
@@ -27,63 +165,240 @@ class FLG_environment:
         if self.potential_facilities < 1:
             raise ValueError("The number of potential facilities must be at least 1.")
         return 0
-    
+
 
     def generate_flg_env(self):
 
         # Generate the whole FLG environment
 
-        self.graph, self.adj_matrix = self.generate_tree()
+        self.edges, self.edge_weights = self.generate_graph()
         self.node_demand = self.generate_demand_distribution()
         self.potential_facilities_mask = self.select_potential_facilities()
+        self.node_capacity = self.generate_capacities()
+
+
+    def generate_graph(self):
+
+        """
+        Generates the edges of the graph of the chosen type and their weights.
+
+        Returns:
+            edges (np.ndarray): (n_edges, 2) node pairs
+            edge_weights (np.ndarray): Weight of every edge
+        """
+
+        if self.graph_type == 'tree':
+            edges = self.generate_tree()
+            edge_weights = self.sample_edge_weights(edges.shape[0])
+
+        elif self.graph_type == 'grid':
+            edges = self.generate_grid()
+            edge_weights = self.sample_edge_weights(edges.shape[0])
+
+        else:
+            # Only the edges without a weight in the file get one from the distribution
+            edges, edge_weights = self.loaded_edges
+            missing = edge_weights < 0
+            edge_weights[missing] = self.sample_edge_weights(np.count_nonzero(missing))
+
+        return edges, edge_weights
+
 
-    
     def generate_tree(self):
 
-        # Generate tree graph
-        G = nx.random_labeled_tree(n=self.n_nodes, seed=self.seed)
-        G = nx.convert_node_labels_to_integers(G)
+        """
+        Generates a uniformly random labeled tree by decoding a random Prüfer sequence. It produces the same tree, with the
+        edges in the same order, as nx.random_labeled_tree(n_nodes, seed=seed).
+
+        Returns:
+            edges (np.ndarray): (n_nodes - 1, 2) node pairs
+        """
+
+        n = self.n_nodes
+        if n <= 1:
+            return np.zeros((0, 2), dtype=np.int64)
+
+        # Draw the sequence like random.Random(seed).choice(range(n)) would, but from 32-bit words generated in bulk
+        generator = random.Random(self.seed)
+        bits = n.bit_length()
+        sequence = np.zeros(0, dtype=np.int64)
+        while sequence.size < n - 2:
+            n_words = max(1024, 2 * (n - 2 - sequence.size))
+            words = np.frombuffer(generator.getrandbits(32 * n_words).to_bytes(4 * n_words, 'little'), dtype='<u4')
+            draws = (words >> (32 - bits)).astype(np.int64)
+            sequence = np.concatenate((sequence, draws[draws < n]))
+        sequence = sequence[:n - 2].tolist()
+
+        # Linear time decoding: join every code entry with the smallest leaf
+        degree = (np.bincount(sequence, minlength=n) + 1).tolist()
+        sources = [0] * (n - 1)
+        targets = [0] * (n - 1)
+        index = u = degree.index(1)
+        for i, v in enumerate(sequence):
+            sources[i] = u
+            targets[i] = v
+            degree[v] -= 1
+            if v < index and degree[v] == 1:
+                u = v
+            else:
+                index += 1
+                while degree[index] != 1:
+                    index += 1
+                u = index
+        sources, targets = np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64)
+
+        # The two nodes left without a parent are joined by the last edge
+        has_parent = np.zeros(n, dtype=bool)
+        has_parent[sources[:n - 2]] = True
+        sources[n - 2], targets[n - 2] = np.flatnonzero(~has_parent)[:2]
+
+        # Order the edges as a NetworkX graph built from them lists them: by smaller endpoint, then by insertion
+        low, high = np.minimum(sources, targets), np.maximum(sources, targets)
+        order = np.lexsort((np.arange(n - 1), low))
+        return np.stack((low[order], high[order]), axis=1)
+
+
+    def generate_grid(self):
+
+        # Generate a 2D grid graph, nodes are numbered row by row so any number of nodes gives a connected graph
+        n_columns = int(np.ceil(np.sqrt(self.n_nodes)))
+        nodes = np.arange(self.n_nodes)
+        right = nodes[(nodes % n_columns != n_columns - 1) & (nodes + 1 < self.n_nodes)]
+        down = nodes[nodes + n_columns < self.n_nodes]
+        edges = np.concatenate((np.stack((right, right + 1), axis=1), np.stack((down, down + n_columns), axis=1)))
+        return edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+
+
+    def load_edge_list(self):
+
+        """
+        Loads a graph from a text file with one 'u v [weight]' edge per line ('#' starts a comment). Node labels are
+        integers, mapped to 0..n-1 in sorted order, and n_nodes is set to the number of nodes. Weights may be real
+        numbers (e.g. road lengths): they are kept as int64 when all of them are integers, as float64 otherwise.
+
+        Returns:
+            edges (np.ndarray): (n_edges, 2) node pairs
+            edge_weights (np.ndarray): Weight of every edge, -1 for the edges without one in the file
+        """
+
+        if self.edge_list_path is None:
+            raise ValueError("An edge list path is required for the 'edge_list' graph type.")
+
+        sources, targets, weights = [], [], []
+        with open(self.edge_list_path, 'r') as f:
+            for line_number, line in enumerate(f, start=1):
+                fields = line.split('#', 1)[0].split()
+                if not fields:
+                    continue
+                try:
+                    sources.append(int(fields[0]))
+                    targets.append(int(fields[1]))
+                    weights.append(float(fields[2]) if len(fields) == 3 else -1.0)
+                except (ValueError, IndexError):
+                    raise ValueError(f"Invalid edge on line {line_number} of {self.edge_list_path}: expected 'u v [weight]' with integer node labels.") from None
+
+        labels, nodes = np.unique(np.array(sources + targets, dtype=np.int64), return_inverse=True)
+        edges = np.sort(nodes.reshape(2, -1).T, axis=1)
+        weights = np.array(weights, dtype=np.float64)
+        if np.all(weights == np.round(weights)):
+            weights = weights.astype(np.int64)
+
+        # Drop self loops, and keep the last occurrence of repeated edges
+        keep = edges[:, 0] != edges[:, 1]
+        edges, weights = edges[keep][::-1], weights[keep][::-1]
+        _, first = np.unique(edges, axis=0, return_index=True)
+        first = np.sort(first)[::-1]
+        edges, weights = edges[first], weights[first]
 
-        # Assign edge weights according to the chosen distribution
-        for u, v in G.edges():
-            if self.weight_distribution[0] == 'normal':
-                weight = self.rng.normal(loc=self.weight_distribution[1], scale=self.weight_distribution[2])
+        self.n_nodes = labels.size
+        if self.n_nodes == 0 or not self.is_connected(edges):
+            raise ValueError("The loaded graph must be connected.")
+        return edges, weights
 
-            elif self.weight_distribution[0] == 'uniform':
-                weight = self.rng.uniform(low=self.weight_distribution[1], high=self.weight_distribution[2])
 
-            weight = np.abs(np.clip(np.round(weight).astype(int), 1, None))
-            G.edges[u, v]['weight'] = weight
+    def is_connected(self, edges):
 
-        # Create adjacency matrix
-        G_adj_matrix = nx.adjacency_matrix(G, weight='weight').todense()
+        # Breadth-first search from node 0 over the CSR adjacency, one level at a time
+        indptr, indices, _ = build_csr(self.n_nodes, edges, np.zeros(edges.shape[0], dtype=np.int64))
+        visited = np.zeros(self.n_nodes, dtype=bool)
+        visited[0] = True
+        frontier = np.array([0])
+        while frontier.size:
+            counts = indptr[frontier + 1] - indptr[frontier]
+            positions = np.repeat(indptr[frontier] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            neighbours = indices[positions]
+            frontier = np.unique(neighbours[~visited[neighbours]])
+            visited[frontier] = True
+        return bool(visited.all())
+
+
+    def sample_edge_weights(self, n_edges):
+
+        # Sample the weights of n_edges edges according to the chosen distribution
+        if self.weight_distribution[0] == 'normal':
+            weights = self.rng.normal(loc=self.weight_distribution[1], scale=self.weight_distribution[2], size=n_edges)
+
+        elif self.weight_distribution[0] == 'uniform':
+            weights = self.rng.uniform(low=self.weight_distribution[1], high=self.weight_distribution[2], size=n_edges)
+
+        else:
+            raise ValueError("Unsupported weight distribution type.")
+
+        return np.abs(np.clip(np.round(weights).astype(np.int64), 1, None))
 
-        return G, G_adj_matrix
-    
 
     def generate_demand_distribution(self):
 
         # Generate demand for each node according to the specified distribution
+        return self.sample_demand(self.n_nodes)
+
+
+    def sample_demand(self, n_nodes, rng=None):
 
+        # Sample the demand of n_nodes nodes according to the chosen distribution, with the environment's generator unless another one is given
+        rng = self.rng if rng is None else rng
         if self.demand_distribution[0] == 'normal':
-            demand = self.rng.normal(loc=self.demand_distribution[1], scale=self.demand_distribution[2], size=self.n_nodes)
+            demand = rng.normal(loc=self.demand_distribution[1], scale=self.demand_distribution[2], size=n_nodes)
 
         elif self.demand_distribution[0] == 'uniform':
-            demand = self.rng.uniform(low=self.demand_distribution[1], high=self.demand_distribution[2], size=self.n_nodes)
+            demand = rng.uniform(low=self.demand_distribution[1], high=self.demand_distribution[2], size=n_nodes)
 
         else:
             raise ValueError("Unsupported demand distribution type.")
-        
-        demand = np.round(np.abs(demand)).astype(int)
-        demand = np.clip(demand, 1, None) # Ensure demand >= 1
-        return {i: demand[i] for i in range(self.n_nodes)}
-    
+
+        demand = np.round(np.abs(demand)).astype(np.int64)
+        return np.clip(demand, 1, None) # Ensure demand >= 1
+
 
     def select_potential_facilities(self):
 
         # Select nodes to become potential facilities
 
-        facilities = self.rng.choice(self.n_nodes, size=self.potential_facilities, replace=False).tolist()
-        return [1 if i in facilities else 0 for i in range(self.n_nodes)]
-        
-        return selected_nodes
\ No newline at end of file
+        mask = np.zeros(self.n_nodes, dtype=bool)
+        mask[self.rng.choice(self.n_nodes, size=self.potential_facilities, replace=False)] = True
+        return mask
+
+
+    def generate_capacities(self):
+
+        # Capacity of a facility opened at each node, drawn after everything else so the rest of the environment does not
+        # depend on it (None when facilities are uncapacitated)
+
+        if self.facility_capacity is None:
+            return None
+
+        if isinstance(self.facility_capacity, (int, float)):
+            if self.facility_capacity <= 0:
+                raise ValueError("The facility capacity must be positive.")
+            return np.full(self.n_nodes, float(self.facility_capacity))
+
+        if self.facility_capacity[0] == 'normal':
+            capacity = self.rng.normal(loc=self.facility_capacity[1], scale=self.facility_capacity[2], size=self.n_nodes)
+
+        elif self.facility_capacity[0] == 'uniform':
+            capacity = self.rng.uniform(low=self.facility_capacity[1], high=self.facility_capacity[2], size=self.n_nodes)
+
+        else:
+            raise ValueError("Unsupported capacity distribution type.")
+
+        return np.clip(np.round(np.abs(capacity)), 1, None) # Ensure capacity >= 1
@@ -0,0 +1,262 @@
+from tools.trajectory_tools import Trajectory_Recorder
+from tools.scheduler_tools import SCHEDULERS
+
+import numpy as np
+
+class Lockstep_BRD():
+
+    BATCH_ELEMENTS = 1 << 22 # Max number of (game, candidate, node) triples scored at once
+
+    def __init__(self, n_games, n_players, distances, FLG_env, seed=42, scheduler='random_dirty', convergence_threshold=0.0, recording_level='full', recording_interval=1, cycle_revisits=0):
+
+        """
+        Plays n_games independent BRD games on the same environment in lockstep: every iteration each game that has not
+        converged plays one turn, and the Voronoi assignments, utilities and best responses of all of them are computed
+        as array operations over (games x candidates x nodes). Games follow the same rules as BRD with the batched best
+        response, but draw from one shared generator, so their random streams differ from serial runs.
+
+        Args:
+            n_games (int): Number of games played at once
+            n_players (int): Number of players in every game
+            distances: Distance engine indexed by node id
+            FLG_env (FLG_environment): The environment shared by all the games
+            seed: Seed of the generator used for the initial positions, the turns and the tie-breaking
+            scheduler (str): Name of the turn scheduler in SCHEDULERS
+            convergence_threshold (float): A player only moves if its utility improves by more than this
+            recording_level (str): Recording level of the trajectory of every game (see Trajectory_Recorder)
+            recording_interval (int): Interval used by the 'every_k' recording level
+            cycle_revisits (int): Returns to the same occupied-facility profile after which a game stops as not converged (0 never stops it)
+        """
+
+        if scheduler not in SCHEDULERS:
+            raise ValueError("Unsupported scheduler.")
+        if FLG_env.node_capacity is not None:
+            raise ValueError("Lockstep games do not support capacitated facilities.")
+
+        self.n_games = n_games
+        self.n_players = n_players
+        self.scheduler = scheduler
+        self.convergence_threshold = convergence_threshold
+        self.rng = np.random.default_rng(seed=seed)
+
+        # Distances from every potential facility to every node, games refer to facilities by their row
+        self.facilities = np.flatnonzero(np.asarray(FLG_env.potential_facilities_mask))
+        self.facility_distances = distances.columns(self.facilities)
+        self.nodes_demand = np.asarray(FLG_env.node_demand)
+        self.facility_values = self.nodes_demand - self.facility_distances # What a facility earns from each node it captures
+
+        if self.n_players > self.facilities.size:
+            raise ValueError("More players than available facilities.")
+
+        # Random distinct initial facilities for every game
+        self.positions = np.argsort(self.rng.random((n_games, self.facilities.size)), axis=1)[:, :n_players]
+        self.utilities = np.zeros((n_games, n_players))
+        self.update_utilities(np.arange(n_games))
+
+        self.dirty = np.ones((n_games, n_players), dtype=bool) # Players whose best response may have changed
+        self.next_player = np.zeros(n_games, dtype=np.intp) # Next turn of the round robin scheduler
+        self.iterations = np.zeros(n_games, dtype=np.int64)
+        self.trajectories = [Trajectory_Recorder(n_players, recording_level, recording_interval) for _ in range(n_games)]
+
+        # Profiles every game was in, with the move after which it was last in them and the times it returned to them, as BRD
+        self.cycle_revisits = cycle_revisits
+        self.moves = np.zeros(n_games, dtype=np.int64)
+        self.cycle_lengths = np.zeros(n_games, dtype=np.int64) # 0 while no profile of a game reached cycle_revisits returns
+        self.visits = [{self.profile(game): (0, 0)} for game in range(n_games)] if cycle_revisits else None
+
+
+    def profile(self, game):
+
+        # Canonical occupied-facility profile of a game, as Profile_Cache.key
+        return tuple(sorted(self.positions[game].tolist()))
+
+
+    def record_visits(self, games):
+
+        # Remember the profile every game that moved is in, stopping it once it returned cycle_revisits times to it
+        self.moves[games] += 1
+        for game in games.tolist():
+            profile = self.profile(game)
+            previous, revisits = self.visits[game].get(profile, (None, -1))
+            if revisits + 1 >= self.cycle_revisits and self.cycle_lengths[game] == 0:
+                self.cycle_lengths[game] = self.moves[game] - previous
+            self.visits[game][profile] = (self.moves[game], revisits + 1)
+
+
+    def update_utilities(self, games):
+
+        """
+        Assigns every node to its nearest player in the given games (ties broken at random) and recomputes the utilities
+        of their players.
+
+        Args:
+            games (np.ndarray): The games to update
+        """
+
+        player_distances = self.facility_distances[self.positions[games]] # (games, players, nodes)
+        owner = np.argmin(player_distances, axis=1)
+        nearest_distance = np.take_along_axis(player_distances, owner[:, None, :], axis=1)[:, 0, :]
+
+        # Nodes at the same minimum distance from several players are assigned at random among them
+        ties = player_distances == nearest_distance[:, None, :]
+        tied = ties.sum(axis=1) > 1
+        if tied.any():
+            keys = self.rng.random(player_distances.shape)
+            keys[~ties] = -1.0
+            owner = np.where(tied, np.argmax(keys, axis=1), owner)
+
+        # Utility is the captured demand minus the cost of serving it
+        owner_index = np.arange(games.size)[:, None] * self.n_players + owner
+        values = self.nodes_demand - nearest_distance
+        self.utilities[games] = np.bincount(owner_index.ravel(), weights=values.ravel(), minlength=games.size * self.n_players).reshape(games.size, self.n_players)
+
+
+    def evaluate_best_responses(self, games, players):
+
+        """
+        Scores every candidate facility of one player per row, as BRD.find_batched_best_response does for one player.
+
+        Args:
+            games (np.ndarray): The game of every row
+            players (np.ndarray): The player of every row
+
+        Returns:
+            best_options (np.ndarray): The best facility row of every player (its current one if no better option exists)
+            gains (np.ndarray): How much every player's utility improves by moving to its best option
+        """
+
+        best_options = self.positions[games, players].copy()
+        gains = np.zeros(games.size)
+        n_facilities, n_nodes = self.facility_distances.shape
+        chunk_size = max(1, self.BATCH_ELEMENTS // (n_facilities * n_nodes))
+
+        for start in range(0, games.size, chunk_size):
+
+            rows = slice(start, start + chunk_size)
+            positions = self.positions[games[rows]]
+            others = positions[np.arange(self.n_players) != players[rows, None]].reshape(positions.shape[0], self.n_players - 1)
+
+            # Distance from every node to its nearest other player and how many other players are at that distance
+            if self.n_players > 1:
+                other_distances = self.facility_distances[others]
+                nearest_other = other_distances.min(axis=1)
+                n_tied_others = (other_distances == nearest_other[:, None, :]).sum(axis=1)
+            else:
+                nearest_other = np.full((positions.shape[0], n_nodes), np.inf)
+                n_tied_others = np.zeros((positions.shape[0], n_nodes), dtype=int)
+
+            # A node tied with t other players is won with probability 1/(t+1), as under the random tie-breaking rule
+            captured = self.facility_distances[None, :, :] < nearest_other[:, None, :]
+            tied_rows, tied_candidates, tied_nodes = np.nonzero(self.facility_distances[None, :, :] == nearest_other[:, None, :])
+            if tied_rows.size:
+                captured[tied_rows, tied_candidates, tied_nodes] = self.rng.random(tied_rows.size) * (n_tied_others[tied_rows, tied_nodes] + 1) < 1
+
+            utilities = (captured * self.facility_values[None, :, :]).sum(axis=2, dtype=np.float64)
+            np.put_along_axis(utilities, others, -np.inf, axis=1) # Facilities taken by other players are not candidates
+
+            # Keep the current facility unless some candidate strictly improves the player's utility
+            best = np.argmax(utilities, axis=1)
+            gain = utilities[np.arange(best.size), best] - self.utilities[games[rows], players[rows]]
+            improves = (gain > 0) & (best != best_options[rows])
+            best_options[rows] = np.where(improves, best, best_options[rows])
+            gains[rows] = np.where(improves, gain, 0.0)
+
+        return best_options, gains
+
+
+    def pick_players(self, games):
+
+        # The player in turn of every game, following the scheduler
+        if self.scheduler == 'random':
+            return self.rng.integers(self.n_players, size=games.size)
+
+        if self.scheduler == 'round_robin':
+            # First dirty player at or after next_player, cyclically
+            rank = (np.arange(self.n_players)[None, :] - self.next_player[games, None]) % self.n_players
+            rank[~self.dirty[games]] = self.n_players
+            players = np.argmin(rank, axis=1)
+            self.next_player[games] = (players + 1) % self.n_players
+            return players
+
+        # A dirty player at random
+        keys = self.rng.random((games.size, self.n_players))
+        keys[~self.dirty[games]] = -1.0
+        return np.argmax(keys, axis=1)
+
+
+    def step(self, games):
+
+        """
+        Plays one iteration of every given game.
+
+        Args:
+            games (np.ndarray): The games that have not converged yet
+
+        Returns:
+            moved (np.ndarray): If a player moved in each game
+        """
+
+        if self.scheduler == 'max_gain':
+            # Every dirty player evaluates its best response and only the one with the largest improvement moves
+            rows, players = np.nonzero(self.dirty[games])
+            options, row_gains = self.evaluate_best_responses(games[rows], players)
+            gains = np.full((games.size, self.n_players), -np.inf)
+            gains[rows, players] = row_gains
+            best_options = np.zeros((games.size, self.n_players), dtype=self.positions.dtype)
+            best_options[rows, players] = options
+            players = np.argmax(gains, axis=1)
+            options, gains = best_options[np.arange(games.size), players], gains[np.arange(games.size), players]
+        else:
+            players = self.pick_players(games)
+            options, gains = self.evaluate_best_responses(games, players)
+
+        moved = gains > self.convergence_threshold
+        moved_games = games[moved]
+        self.positions[moved_games, players[moved]] = options[moved]
+        if moved_games.size:
+            self.update_utilities(moved_games)
+            if self.cycle_revisits:
+                self.record_visits(moved_games)
+
+        # Update the dirty flags as the schedulers of the serial simulation do
+        self.dirty[moved_games] = True
+        if self.scheduler == 'max_gain':
+            self.dirty[games[~moved]] = False
+            self.dirty[moved_games, players[moved]] = False
+        elif self.scheduler == 'random':
+            self.dirty[games[~moved], players[~moved]] = False
+        else:
+            self.dirty[games, players] = False
+
+        return moved
+
+
+    def run(self, max_iterations):
+
+        """
+        Plays all the games until every one of them has converged or reached max_iterations.
+
+        Returns:
+            results (list): (iterations, trajectory) of every game
+        """
+
+        active = np.arange(self.n_games if max_iterations > 0 else 0)
+        while active.size:
+
+            moved = self.step(active)
+            self.iterations[active] += 1
+
+            # Recording is the only per-game loop, and it is skipped entirely when only the final state is kept
+            if self.trajectories[0].recording_level != 'final':
+                for game, game_moved in zip(active.tolist(), moved.tolist()):
+                    if self.trajectories[game].keeps(self.iterations[game], game_moved):
+                        self.trajectories[game].record_state(self.iterations[game], self.facilities[self.positions[game]], self.utilities[game], self.utilities[game].sum())
+
+            # Converged games, and the ones that returned to an earlier profile, are masked out of the next iterations
+            active = active[self.dirty[active].any(axis=1) & (self.cycle_lengths[active] == 0) & (self.iterations[active] < max_iterations)]
+
+        for game, trajectory in enumerate(self.trajectories):
+            trajectory.finalize_state(self.iterations[game], self.facilities[self.positions[game]], self.utilities[game], self.utilities[game].sum())
+            trajectory.set_outcome(not self.dirty[game].any(), self.cycle_lengths[game] or None)
+
+        return [(int(self.iterations[game]), self.trajectories[game]) for game in range(self.n_games)]
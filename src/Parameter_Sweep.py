@@ -0,0 +1,178 @@
+from Simulation import Simulation
+from tools.cache_tools import Environment_Cache
+
+import itertools
+import json
+import os
+import time
+import statistics as stats
+
+class Parameter_Sweep():
+
+    GRID_PARAMETERS = ('n_nodes', 'n_potential_facilities', 'n_brd_players', 'demand_distribution', 'weight_distribution', 'seed')
+    ENVIRONMENT_PARAMETERS = ('n_nodes', 'n_potential_facilities', 'demand_distribution', 'weight_distribution', 'seed')
+    UNRECORDED_OPTIONS = ('environment_cache', 'instrumentation', 'trace') # Simulation options that do not change the results of a cell
+
+    def __init__(self, sweep_spec, max_iterations, n_simulations, checkpoint_file, n_workers=1, simulation_options=None):
+
+        """
+        Runs every cell of a parameter grid, resuming from a checkpoint of the completed cells. The checkpoint starts
+        with the settings shared by all the cells, and resuming with different settings is refused.
+
+        Args:
+            sweep_spec (dict): A list of values for every parameter in GRID_PARAMETERS ('seeds' holds the seeds)
+            max_iterations (int): Max number of iterations of each simulation
+            n_simulations (int): Number of repetitions run on each cell
+            checkpoint_file (str): JSON lines file where every completed cell is appended
+            n_workers (int): Number of processes running the repetitions of a cell (1 runs them serially, None one per core)
+            simulation_options (dict): Extra keyword arguments passed to every Simulation
+        """
+
+        self.sweep_spec = sweep_spec
+        self.max_iterations = max_iterations
+        self.n_simulations = n_simulations
+        self.checkpoint_file = checkpoint_file
+        self.n_workers = n_workers
+        self.simulation_options = simulation_options or {}
+
+        self.cells = self.build_cells()
+
+
+    def build_cells(self):
+
+        # Every combination of the grid values is a cell
+        values = []
+        for parameter in self.GRID_PARAMETERS:
+            spec_key = 'seeds' if parameter == 'seed' else parameter
+            if spec_key not in self.sweep_spec:
+                raise ValueError(f"The sweep specification is missing '{spec_key}'.")
+            parameter_values = self.sweep_spec[spec_key]
+            if parameter in ('demand_distribution', 'weight_distribution'):
+                parameter_values = [tuple(distribution) for distribution in parameter_values]
+            values.append(parameter_values)
+
+        return [dict(zip(self.GRID_PARAMETERS, combination)) for combination in itertools.product(*values)]
+
+
+    def cell_key(self, cell, parameters=GRID_PARAMETERS):
+
+        # Canonical string identifying a cell (or the environment of a cell)
+        return json.dumps([cell[parameter] for parameter in parameters])
+
+
+    def expected_cost(self, cell):
+
+        """
+        Rough cost estimate of a cell: the BRD turns scan every candidate against every node
+        """
+
+        return self.n_simulations * cell['n_brd_players'] * cell['n_potential_facilities'] * cell['n_nodes']
+
+
+    def schedule(self, cells):
+
+        """
+        Orders the cells so the most expensive ones start first, while keeping together the cells that share an
+        environment so it is generated only once.
+
+        Returns:
+            groups (list): Lists of cells sharing an environment, most expensive group first
+        """
+
+        groups = {}
+        for cell in cells:
+            groups.setdefault(self.cell_key(cell, self.ENVIRONMENT_PARAMETERS), []).append(cell)
+
+        for group in groups.values():
+            group.sort(key=self.expected_cost, reverse=True)
+
+        # Distances cost about n^2 per environment on top of the cells' own cost
+        return sorted(groups.values(), key=lambda group: group[0]['n_nodes'] ** 2 + sum(map(self.expected_cost, group)), reverse=True)
+
+
+    def settings(self):
+
+        """
+        Settings shared by all the cells that change their results, written at the top of the checkpoint.
+
+        Returns:
+            settings (dict): max_iterations, n_simulations and the simulation options (with the digest of the edge list
+                             file, whose contents may change under the same path), as they read back from JSON
+        """
+
+        simulation_options = {key: value for key, value in self.simulation_options.items() if key not in self.UNRECORDED_OPTIONS}
+        if simulation_options.get('graph_type') == 'edge_list':
+            simulation_options['edge_list_digest'] = Environment_Cache.file_digest(simulation_options['edge_list_path'])
+
+        settings = {'max_iterations': self.max_iterations, 'n_simulations': self.n_simulations, 'simulation_options': simulation_options}
+        return json.loads(json.dumps(settings, sort_keys=True))
+
+
+    def load_checkpoint(self):
+
+        # Results of the cells completed by previous executions, which must have used the same settings
+        completed = {}
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, 'r') as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+
+            if lines and lines[0].get('settings') != self.settings():
+                raise ValueError(f"The checkpoint {self.checkpoint_file} was written with other settings (max_iterations, n_simulations or simulation options), use another checkpoint file to run the sweep with these.")
+            for result in lines[1:]:
+                completed[result['key']] = result
+        return completed
+
+
+    def run(self):
+
+        """
+        Runs all the pending cells, appending each result to the checkpoint file as soon as its cell is completed.
+
+        Returns:
+            results (list): The results of every cell of the grid, including the ones loaded from the checkpoint
+        """
+
+        completed = self.load_checkpoint()
+        pending = [cell for cell in self.cells if self.cell_key(cell) not in completed]
+        print(f"{len(self.cells) - len(pending)}/{len(self.cells)} cells already completed")
+
+        checkpoint_dir = os.path.dirname(self.checkpoint_file)
+        if checkpoint_dir:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+
+        with open(self.checkpoint_file, 'a') as checkpoint:
+            if checkpoint.tell() == 0:
+                checkpoint.write(json.dumps({'settings': self.settings()}) + '\n')
+                checkpoint.flush()
+
+            for group in self.schedule(pending):
+
+                # The first cell generates the environment, the rest of the group reuses it
+                FLG_env = distances = None
+                for cell in group:
+
+                    print(f"Running cell {self.cell_key(cell)}...")
+                    start_time = time.perf_counter()
+                    simulation = Simulation(cell['n_nodes'], cell['n_potential_facilities'], cell['n_brd_players'], self.max_iterations, cell['seed'], cell['demand_distribution'], cell['weight_distribution'], FLG_env=FLG_env, distances=distances, **self.simulation_options)
+                    FLG_env, distances = simulation.FLG_env, simulation.distances
+
+                    if self.n_workers == 1:
+                        avg_iterations, trajectories = simulation.run_simulations(self.n_simulations)
+                    else:
+                        avg_iterations, trajectories = simulation.run_simulations_parallel(self.n_simulations, self.n_workers)
+                    final_potentials = [float(trajectory.final_potential()) for trajectory in trajectories]
+
+                    result = {
+                        'key': self.cell_key(cell),
+                        **cell,
+                        'avg_iterations': avg_iterations,
+                        'final_potential_mean': stats.mean(final_potentials),
+                        'final_potential_variance': stats.variance(final_potentials) if len(final_potentials) > 1 else 0.0,
+                        'converged_runs': sum(bool(trajectory.converged) for trajectory in trajectories),
+                        'elapsed_time': time.perf_counter() - start_time,
+                    }
+                    checkpoint.write(json.dumps(result) + '\n')
+                    checkpoint.flush()
+                    completed[result['key']] = result
+
+        return [completed[self.cell_key(cell)] for cell in self.cells]
@@ -1,15 +1,21 @@
 from Facility_Location_Game import FLG_environment
 from tools.algorithm_tools import Tools
+from tools.distance_tools import Distance_Matrix, Tree_Distance, Dijkstra_Distance, Facility_Ranking, DISTANCE_BACKENDS
+from tools.trajectory_tools import Trajectory_Recorder
+from tools.scheduler_tools import SCHEDULERS
+from tools.instrumentation_tools import Instrumentation, NULL_INSTRUMENTATION
+from tools.result_tools import Result_Sink, Result_Reader, Running_Statistics
+from tools.dynamics_tools import Edge_Weight_Dynamics, Demand_Dynamics
+import tools.parallel_tools as parallel_tool
 from Best_Response_Dynamics import BRD
+from Lockstep_BRD import Lockstep_BRD
 
-import copy
 import numpy as np
-import matplotlib.pyplot as plt
 import statistics as stats
 
 class Simulation():
 
-    def __init__(self, n_nodes, n_potential_facilities, n_brd_players, max_iterations, seed, demand_distribution, weight_distribution):
+    def __init__(self, n_nodes, n_potential_facilities, n_brd_players, max_iterations, seed, demand_distribution, weight_distribution, best_response_mode='sequential', use_facility_ranking=False, recording_level='full', recording_interval=1, distance_backend='matrix', graph_type='tree', edge_list_path=None, scheduler='random', convergence_threshold=0.0, capacitated_facilities=False, facility_capacity=None, edge_dynamics=None, demand_dynamics=None, profile_cache_size=0, cycle_revisits=0, FLG_env=None, distances=None, environment_cache=None, instrumentation=False, trace=False):
 
         self.n_nodes = n_nodes
         self.n_potential_facilities = n_potential_facilities
@@ -19,25 +25,165 @@ class Simulation():
         self.main_rng = np.random.default_rng(seed=self.seed)
         self.demand_distribution = demand_distribution
         self.weight_distribution = weight_distribution
+        self.best_response_mode = best_response_mode
+        self.use_facility_ranking = use_facility_ranking
+        self.recording_level = recording_level
+        self.recording_interval = recording_interval
+        self.distance_backend = distance_backend # 'matrix' stores all n^2 distances, 'tree' answers them through LCA queries, 'dijkstra' runs Dijkstra on a sparse adjacency
+        self.graph_type = graph_type # 'tree', 'grid' or 'edge_list'
+        self.edge_list_path = edge_list_path # File the graph is loaded from when graph_type is 'edge_list'
+        self.scheduler = scheduler # Name of the turn scheduler in SCHEDULERS
+        self.convergence_threshold = convergence_threshold # Improvements at or below this do not count as a better response
+        self.capacitated_facilities = capacitated_facilities # True to give every facility a limited capacity, the overflow going to the next nearest facility with room
+        self.facility_capacity = facility_capacity # Capacity of every facility, or a ('normal'|'uniform', a, b) distribution of per-node capacities
+        self.edge_dynamics = edge_dynamics # Parameters of the Edge_Weight_Dynamics of run_dynamic_simulation (e.g. {'edge_fraction': 0.01, 'step': 1}), None for fixed weights
+        self.demand_dynamics = demand_dynamics # Parameters of the Demand_Dynamics of run_dynamic_simulation (e.g. {'mode': 'random_walk', 'node_fraction': 0.01}), None for fixed demand
+        self.profile_cache_size = profile_cache_size # Occupied-facility profiles memoized by every BRD game (0 disables the memo), see Profile_Cache
+        self.cycle_revisits = cycle_revisits # Returns of the players to the same occupied-facility profile after which a run stops as not converged (0 never stops it)
+        self.environment_cache = environment_cache # Optional Environment_Cache where generated environments are reused from
+
+        self.instrument = instrumentation # True to collect counters and timers of every run (attached to its trajectory as 'profile')
+        self.trace = trace # True to also keep a Chrome trace timeline of the instrumented sections
+        self.hooks = [] # Callbacks called after every iteration, see add_hook
+
+        if self.scheduler not in SCHEDULERS:
+            raise ValueError("Unsupported scheduler.")
+
+        self.instrumentation = self.create_instrumentation()
+        with self.instrumentation.timer('setup_simulation'):
+            self.setup_simulation(FLG_env, distances)
+
+
+    def create_instrumentation(self):
+
+        # Fresh counters and timers for a run, or the do-nothing instrumentation when disabled
+        if not self.instrument:
+            return NULL_INSTRUMENTATION
+        instrumentation = Instrumentation(trace=self.trace)
+        for hook in self.hooks:
+            instrumentation.add_hook(hook)
+        return instrumentation
+
+
+    def add_hook(self, hook):
 
-        self.setup_simulation()
+        """
+        Attaches a callback called after every iteration of every run, requires instrumentation to be enabled.
+
+        Args:
+            hook (callable): Called as hook(iteration, BRD_setup, moved)
+        """
 
+        self.hooks.append(hook)
+        self.instrumentation.add_hook(hook)
 
-    def setup_simulation(self):
+
+    def setup_simulation(self, FLG_env=None, distances=None):
 
         """
         Initializes the whole simulation environment
+
+        Args:
+            FLG_env: An existing environment to reuse instead of generating one (requires distances)
+            distances: The distance engine of FLG_env
+        """
+
+        if FLG_env is None:
+            self.setup_environment(self.seed)
+        else:
+            self.FLG_env = FLG_env
+            self.distances = distances
+            self.setup_facility_ranking()
+
+        # Setup the BRD players
+        self.BRD_setup = self.create_BRD(self.seed)
+
+
+    def setup_environment(self, environment_seed):
+
+        """
+        Generates the FLG environment and everything precomputed from it
+        """
+
+        environment_parameters = {
+            'n_nodes': self.n_nodes,
+            'potential_facilities': self.n_potential_facilities,
+            'seed': environment_seed,
+            'demand_distribution': list(self.demand_distribution),
+            'weight_distribution': list(self.weight_distribution),
+            'distance_backend': self.distance_backend,
+            'graph_type': self.graph_type,
+            'edge_list_path': self.edge_list_path,
+            'facility_capacity': self.environment_capacity(),
+        }
+        if self.environment_cache is not None and self.graph_type == 'edge_list':
+            environment_parameters['edge_list_digest'] = self.environment_cache.file_digest(self.edge_list_path)
+        cached_arrays = self.environment_cache.load(environment_parameters) if self.environment_cache is not None else None
+
+        if cached_arrays is not None:
+
+            # Reuse the environment and distances generated by a previous run, the arrays are memory-mapped
+            self.FLG_env = FLG_environment.from_arrays(self.n_nodes, self.n_potential_facilities, cached_arrays, seed=environment_seed, demand_distribution=self.demand_distribution, weight_distribution=self.weight_distribution, graph_type=self.graph_type, edge_list_path=self.edge_list_path, facility_capacity=self.environment_capacity())
+            distance_arrays = {name[len('distance_'):]: array for name, array in cached_arrays.items() if name.startswith('distance_')}
+            self.distances = DISTANCE_BACKENDS[self.distance_backend].from_arrays(distance_arrays)
+
+        else:
+
+            # Generate the FLG environment
+            self.FLG_env = FLG_environment(self.n_nodes, self.n_potential_facilities, seed=environment_seed, demand_distribution=self.demand_distribution, weight_distribution=self.weight_distribution, graph_type=self.graph_type, edge_list_path=self.edge_list_path, facility_capacity=self.environment_capacity())
+            self.distances = self.calculate_distances(self.FLG_env, self.distance_backend)
+
+            if self.environment_cache is not None:
+                distance_arrays = {f"distance_{name}": array for name, array in self.distances.to_arrays().items()}
+                self.environment_cache.store(environment_parameters, {**self.FLG_env.to_arrays(), **distance_arrays})
+
+        self.setup_facility_ranking()
+
+
+    def environment_capacity(self):
+
+        # Facility capacity the environment is generated with, None when facilities are uncapacitated
+        if not self.capacitated_facilities:
+            return None
+        if self.facility_capacity is None:
+            raise ValueError("Capacitated facilities need a facility capacity.")
+        return self.facility_capacity if isinstance(self.facility_capacity, (int, float)) else list(self.facility_capacity)
+
+
+    @staticmethod
+    def calculate_distances(FLG_env, distance_backend):
+
         """
+        Builds the distance engine of an environment with the given backend
+        """
+
+        if distance_backend == 'matrix':
+            # Calculate all distances between nodes using Dijkstra's algorithm for computational efficiency
+            return Distance_Matrix(Tools().calculate_distance_array(FLG_env.graph))
+
+        if distance_backend == 'tree':
+            # The environment is a tree, distances are answered through lowest common ancestor queries
+            return Tree_Distance.from_edges(FLG_env.n_nodes, FLG_env.edges, FLG_env.edge_weights)
+
+        if distance_backend == 'dijkstra':
+            # Any connected graph, distances and assignments are computed on demand over a sparse adjacency
+            return Dijkstra_Distance(*FLG_env.csr)
+
+        raise ValueError("Unsupported distance backend.")
 
-        # Generate the FLG environment
-        self.FLG_env = FLG_environment(self.n_nodes, self.n_potential_facilities, seed=self.seed, demand_distribution=self.demand_distribution, weight_distribution=self.weight_distribution)
-        assert all(isinstance(node, int) for node in self.FLG_env.graph.nodes()) # Check that nodes were correctly generated (Just in case)
 
-        # Calculate all distances between nodes using Dijkstra's algorithm for computational efficiency
-        self.distances = Tools().calculate_distance_matrix(self.FLG_env.graph)
+    def setup_facility_ranking(self):
+
+        # Rank the potential facilities by distance from every node once, the ranking is shared by every run on this environment
+        self.facility_ranking = None
+        if self.use_facility_ranking:
+            self.facility_ranking = Facility_Ranking(self.distances, np.flatnonzero(self.FLG_env.potential_facilities_mask))
+
+
+    def create_BRD(self, seed):
 
         # Setup the BRD players
-        self.BRD_setup = BRD(self.n_brd_players, self.distances, self.FLG_env, seed=self.seed)
+        return BRD(self.n_brd_players, self.distances, self.FLG_env, seed=seed, best_response_mode=self.best_response_mode, facility_ranking=self.facility_ranking, convergence_threshold=self.convergence_threshold, profile_cache_size=self.profile_cache_size, cycle_revisits=self.cycle_revisits, instrumentation=self.instrumentation)
 
 
     def run_FLG_BRD_simulation(self):
@@ -47,132 +193,335 @@ class Simulation():
 
         Returns:
             iterations (int): Shows how many iterations the simulation took
-            potential_function_development (list): How the potential function changes for each iteration  
-            players_development_over_time (list): Players' facility assignments for each iteration
+            trajectory (Trajectory_Recorder): Players' facility assignments, utilities and the potential function over the recorded iterations
         """
 
-        # Best Response Dynamics process
-        players_find_best_response = [True] * self.n_brd_players
+        # Best Response Dynamics process, the scheduler picks whose turn it is and tracks which players may still improve
+        scheduler = SCHEDULERS[self.scheduler](self.n_brd_players, self.main_rng)
 
         # Variables for simulation study
-        iterations = 0
-        potential_function_development = [] # Track how the potential function changes over time        
-        players_development_over_time = [] # Track players' assignments over time
-        while any(players_find_best_response) and iterations < self.max_iterations:
+        trajectory = Trajectory_Recorder(self.n_brd_players, self.recording_level, self.recording_interval) # Track players and the potential function over time
+        iterations = self.play_until_converged(scheduler, trajectory, 0, self.max_iterations)
 
-            # Actual process
-            player_in_turn = self.main_rng.choice(tuple(range(self.n_brd_players))) # Randomly select a player to find their best response
-            updated = self.BRD_setup.find_best_response(player_in_turn)
-            if updated:
-                players_find_best_response = [True] * self.n_brd_players  # Force recheck all players
-            else:
-                players_find_best_response[player_in_turn] = False
+        # The Nash Equilibrium is reached only if the loop ended because no player was capable of finding a better response
+        trajectory.finalize(iterations, self.BRD_setup)
+        trajectory.set_outcome(scheduler.converged(), self.BRD_setup.cycle_length if self.BRD_setup.cycling() else None)
+        trajectory.profile = self.instrumentation.summary()
+
+        return iterations, trajectory
+
+
+    def play_until_converged(self, scheduler, trajectory, iterations, max_iterations):
+
+        """
+        Plays turns until no player can improve, max_iterations is reached or the game cycles (see cycle_revisits)
+
+        Args:
+            scheduler: The turn scheduler of the run
+            trajectory (Trajectory_Recorder): Where the iterations are recorded
+            iterations (int): Iterations played before
+            max_iterations (int): Iteration the play stops at
+
+        Returns:
+            iterations (int): Iterations played including the previous ones
+        """
 
-            ######### DEBUG #########
-            if iterations == 5:               
-                print(self.FLG_env.node_demand)
-                print(self.FLG_env.adj_matrix)
+        while not scheduler.converged() and not self.BRD_setup.cycling() and iterations < max_iterations:
+
+            # Actual process
+            updated = scheduler.step(self.BRD_setup)
+            self.instrumentation.count('moves' if updated else 'no_op_turns')
 
             # Simulation development study
             iterations += 1
-            potential_function_current_value = self.BRD_setup.calculate_potential_function()
-            potential_function_development.append(potential_function_current_value)
+            with self.instrumentation.timer('trajectory_recording'):
+                trajectory.record(iterations, self.BRD_setup, updated)
+            self.instrumentation.on_iteration(iterations, self.BRD_setup, updated)
+
+        return iterations
+
+
+    def run_dynamic_simulation(self, n_epochs):
+
+        """
+        Handle a simulation whose environment changes between epochs: in every epoch the BRD process runs until it
+        converges or max_iterations is reached, then the edge weights (see Edge_Weight_Dynamics) and/or the node demand
+        (see Demand_Dynamics) change and the next epoch continues from the current positions. Only what the change
+        affects is updated: the distances and the assignment of the affected nodes (so changing weights needs the 'tree'
+        distance backend), and the captured demand of the players serving the changed nodes, only the players whose best
+        response may have changed being checked again. The environment and the distances of this simulation change.
+
+        Args:
+            n_epochs (int): Number of epochs
+
+        Returns:
+            iterations (int): Iterations of all the epochs
+            trajectory (Trajectory_Recorder): Players' facility assignments, utilities and the potential function over the recorded iterations
+            epoch_iterations (list): Iterations of every epoch
+        """
+
+        if self.edge_dynamics is None and self.demand_dynamics is None:
+            raise ValueError("A dynamic simulation needs edge weight or demand dynamics.")
+        if self.edge_dynamics is not None and self.distance_backend != 'tree':
+            raise ValueError("Dynamic edge weights need the 'tree' distance backend.")
+        if self.edge_dynamics is not None and self.facility_ranking is not None:
+            raise ValueError("Dynamic edge weights do not support the facility ranking.")
+
+        edge_dynamics = Edge_Weight_Dynamics(**self.edge_dynamics) if self.edge_dynamics is not None else None
+        demand_dynamics = Demand_Dynamics(**self.demand_dynamics) if self.demand_dynamics is not None else None
+        scheduler = SCHEDULERS[self.scheduler](self.n_brd_players, self.main_rng)
+        trajectory = Trajectory_Recorder(self.n_brd_players, self.recording_level, self.recording_interval)
+
+        iterations = 0
+        epoch_iterations = []
+        for epoch in range(n_epochs):
+
+            if epoch > 0 and edge_dynamics is not None:
+                with self.instrumentation.timer('edge_weight_update'):
+                    self.apply_edge_weights(*edge_dynamics.sample(self.FLG_env.edge_weights, self.main_rng))
+                scheduler.dirty[:] = True # Any player may have a better response under the new weights
+
+            if epoch > 0 and demand_dynamics is not None:
+                with self.instrumentation.timer('demand_update'):
+                    scheduler.dirty |= self.apply_node_demand(*demand_dynamics.sample(self.FLG_env.node_demand, self.main_rng, self.FLG_env.sample_demand))
+
+            start = iterations
+            iterations = self.play_until_converged(scheduler, trajectory, iterations, iterations + self.max_iterations)
+            epoch_iterations.append(iterations - start)
+
+        trajectory.finalize(iterations, self.BRD_setup)
+        trajectory.set_outcome(scheduler.converged(), self.BRD_setup.cycle_length if self.BRD_setup.cycling() else None)
+        trajectory.profile = self.instrumentation.summary()
+
+        return iterations, trajectory, epoch_iterations
+
+
+    def apply_edge_weights(self, edge_indices, weights):
+
+        """
+        Changes the weights of some edges of the environment, its distances and the assignment of the current game
+
+        Args:
+            edge_indices (np.ndarray): Rows of the changed edges in the environment's edges
+            weights (np.ndarray): Their new weights
+        """
+
+        deltas = self.FLG_env.set_edge_weights(edge_indices, weights)
+        children = self.distances.update_edge_weights(self.FLG_env.edges[edge_indices], deltas)
+        self.BRD_setup.apply_edge_weight_changes(children, deltas)
+        self.instrumentation.count('changed_edges', edge_indices.size)
 
-            snapshot = {pid: copy.deepcopy(data) for pid, data in self.BRD_setup.players.items()}
-            players_development_over_time.append(snapshot)
 
-        # When the while loop ends it means that all player were not capable of finding a best response so the Nash Equilibrium is reached
+    def apply_node_demand(self, nodes, demand):
+
+        """
+        Changes the demand of some nodes of the environment and of the current game
+
+        Args:
+            nodes (np.ndarray): The changed nodes
+            demand (np.ndarray): Their new demand
+
+        Returns:
+            recheck (np.ndarray): The players whose best response may have changed
+        """
 
-        return iterations, potential_function_development, players_development_over_time
+        self.FLG_env.set_node_demand(nodes, demand)
+        recheck = self.BRD_setup.apply_demand_changes(nodes, demand)
+        self.instrumentation.count('changed_demands', nodes.size)
+        self.instrumentation.count('rechecked_players', int(np.count_nonzero(recheck)))
+        return recheck
 
     
-    def run_simulations(self, n_simulations):
+    def run_repetition(self, seed_sequence, fresh_environment=False):
 
         """
-        Handle multiple simulations
+        Runs one independent repetition of the simulation from fresh random player positions
+
+        Args:
+            seed_sequence (np.random.SeedSequence): The seed stream of this repetition
+            fresh_environment (bool): True to generate a new environment for this repetition
+
+        Returns:
+            iterations (int): Shows how many iterations the simulation took
+            trajectory (Trajectory_Recorder): Players' facility assignments, utilities and the potential function over the recorded iterations
         """
-        
-        # Variables for simulation study
-        avg_iterations = 0
-        potential_function_developments_per_iteration = []
-        players_developments_per_iteration = []
 
-        for i in range(n_simulations):
+        BRD_seed, turn_seed, environment_seed = seed_sequence.spawn(3)
+
+        self.instrumentation = self.create_instrumentation()
+        with self.instrumentation.timer('setup_simulation'):
+            if fresh_environment:
+                self.setup_environment(int(environment_seed.generate_state(1)[0]))
+
+            self.BRD_setup = self.create_BRD(BRD_seed)
+        self.main_rng = np.random.default_rng(seed=turn_seed)
+
+        return self.run_FLG_BRD_simulation()
+
+
+    def run_simulations(self, n_simulations, fresh_environments=False, result_sink=None):
+
+        """
+        Handle multiple simulations, each repetition gets an independent seed stream spawned from the simulation seed
+
+        Args:
+            n_simulations (int): Number of repetitions
+            fresh_environments (bool): True to generate a new environment for every repetition, False to share this one
+            result_sink (Result_Sink): If given, every finished run is streamed to disk instead of kept in memory
+
+        Returns:
+            avg_iterations (float): Average number of iterations per repetition
+            results: The list of trajectories of the repetitions, or result_sink if one was given
+        """
+
+        seed_sequences = np.random.SeedSequence(self.seed).spawn(n_simulations)
+        results = (self.run_repetition(seed_sequence, fresh_environments) for seed_sequence in seed_sequences)
+
+        return self.collect_results(results, n_simulations, result_sink)
+
+
+    def run_simulations_parallel(self, n_simulations, n_workers=None, fresh_environments=False, result_sink=None):
+
+        """
+        Handle multiple simulations spread over a process pool. Repetitions use the same seed streams as run_simulations,
+        so both give the same results.
+
+        Args:
+            n_simulations (int): Number of repetitions
+            n_workers (int): Number of worker processes (one per core if None)
+            fresh_environments (bool): True to generate a new environment for every repetition, False to share this one
+                                       with the workers through shared memory
+            result_sink (Result_Sink): If given, every finished run is streamed to disk instead of kept in memory
+
+        Returns:
+            avg_iterations (float): Average number of iterations per repetition
+            results: The list of trajectories of the repetitions, or result_sink if one was given
+        """
 
-            print(f"Running simulation {i+1}/{n_simulations}...")
-            iterations, potential_function_development, players_development_over_time = self.run_FLG_BRD_simulation()
+        seed_sequences = np.random.SeedSequence(self.seed).spawn(n_simulations)
+        results = parallel_tool.iterate_repetitions(self, seed_sequences, n_workers, fresh_environments)
 
+        return self.collect_results(results, n_simulations, result_sink)
+
+
+    def run_simulations_lockstep(self, n_simulations, batch_size, result_sink=None):
+
+        """
+        Handle multiple simulations on this environment by playing them in lockstep batches of batch_size games, each
+        batch advanced with array operations instead of one game at a time
+
+        Args:
+            n_simulations (int): Number of repetitions
+            batch_size (int): Number of games played at once
+            result_sink (Result_Sink): If given, every finished run is streamed to disk instead of kept in memory
+
+        Returns:
+            avg_iterations (float): Average number of iterations per repetition
+            results: The list of trajectories of the repetitions, or result_sink if one was given
+        """
+
+        batch_sizes = [min(batch_size, n_simulations - start) for start in range(0, n_simulations, batch_size)]
+        seed_sequences = np.random.SeedSequence(self.seed).spawn(len(batch_sizes))
+
+        def iterate_batches():
+            for n_games, seed_sequence in zip(batch_sizes, seed_sequences):
+                lockstep = Lockstep_BRD(n_games, self.n_brd_players, self.distances, self.FLG_env, seed=seed_sequence, scheduler=self.scheduler, convergence_threshold=self.convergence_threshold, recording_level=self.recording_level, recording_interval=self.recording_interval, cycle_revisits=self.cycle_revisits)
+                yield from lockstep.run(self.max_iterations)
+
+        return self.collect_results(iterate_batches(), n_simulations, result_sink)
+
+
+    def collect_results(self, results, n_simulations, result_sink=None):
+
+        # Gather the runs as they finish, either in memory or streamed to the result sink
+        avg_iterations = 0
+        trajectories = []
+
+        for i, (iterations, trajectory) in enumerate(results):
+
+            print(f"Finished simulation {i+1}/{n_simulations}")
             avg_iterations += iterations
-            potential_function_developments_per_iteration.append(potential_function_development)
-            players_developments_per_iteration.append(players_development_over_time)
+            if result_sink is None:
+                trajectories.append(trajectory)
+            else:
+                result_sink.add_run(iterations, trajectory)
 
         avg_iterations /= n_simulations
 
-        return avg_iterations, potential_function_developments_per_iteration, players_developments_per_iteration
+        if result_sink is not None:
+            result_sink.close()
+            return avg_iterations, result_sink
+        return avg_iterations, trajectories
     
 
-    def show_simulation_results(self, iterations, potential_function_development, players_development_over_time, plot_results=False):
+    def show_simulation_results(self, iterations, trajectory, plotter=None):
+
+        """
+        Shows the results of a simulation
+
+        Args:
+            iterations (int): How many iterations the simulation took
+            trajectory (Trajectory_Recorder): The recorded development of the simulation
+            plotter (Plotter): If given, the development of the simulation is plotted to its output directory
+        """
 
         # Show the results of the simulation
         print(f"Simulation completed in {iterations} iterations")
+        if trajectory.cycle_length is not None:
+            print(f"The players kept returning to the same profile every {trajectory.cycle_length} moves, the run did not converge")
+        elif trajectory.converged is False:
+            print("The run stopped at max_iterations without converging")
 
         print("Final players' positions:")
-        for player_id, player_data in players_development_over_time[-1].items():
+        for player_id, player_data in trajectory.final_players().items():
             print(f"Player {player_id}: Facility Position: {player_data['facility_position']}, Utility: {player_data['Utility']}")
 
-        print(f"Final Potential Function value: {potential_function_development[-1]}")
-
-        if plot_results:
-
-            # Plotting simulation development
-            plt.figure(figsize=(10, 12))
-
-            # Plot development of the Potential Function Over Time
-            plt.subplot(3, 1, 1)  # 3 rows, 1 column, position 1
-            plt.plot(potential_function_development, marker='o')
-            plt.title("Potential Function Over Time")
-            plt.xlabel("Iteration")
-            plt.ylabel("Potential Function Value")
-            plt.grid(True)
-
-            # Data for the other two plots
-            player_facility_positions = {pid: [] for pid in range(self.n_brd_players)}
-            player_utilities = {pid: [] for pid in range(self.n_brd_players)}
-
-            for snapshot in players_development_over_time:
-                for pid, data in snapshot.items():
-                    player_facility_positions[pid].append(data['facility_position'])
-                    player_utilities[pid].append(data['Utility'])
-
-            # Plot development of the Facility Positions Over Time
-            plt.subplot(3, 1, 2)  # Position 2
-            for pid, positions in player_facility_positions.items():
-                plt.plot(positions, label=f'Player {pid}', marker='o')
-            plt.title("Facility Positions Over Time")
-            plt.xlabel("Iteration")
-            plt.ylabel("Facility ID")
-            plt.legend()
-            plt.grid(True)
-
-            # Plot development of the Utility Over Time
-            plt.subplot(3, 1, 3)  # Position 3
-            for pid, utils in player_utilities.items():
-                plt.plot(utils, label=f'Player {pid}', marker='x')
-            plt.title("Utility Over Time")
-            plt.xlabel("Iteration")
-            plt.ylabel("Utility")
-            plt.legend()
-            plt.grid(True)
-
-
-            plt.tight_layout()
-            plt.show()
-            
-
-    def show_multiple_simulations_results(self, avg_iterations, potential_function_developments_per_iteration, players_development_per_iteration):
+        print(f"Final Potential Function value: {trajectory.final_potential()}")
+
+        if plotter is not None:
+            print(f"Plot saved to {plotter.plot_simulation(trajectory, f'simulation_{self.seed}.png')}")
+
+
+    def show_multiple_simulations_results(self, avg_iterations, results, plotter=None):
+
+        """
+        Shows the statistics of multiple simulations
+
+        Args:
+            avg_iterations (float): Average number of iterations per repetition
+            results: The list of trajectories of the repetitions, or the Result_Sink they were streamed to
+            plotter (Plotter): If given, the mean potential function over the iterations is plotted to its output directory
+        """
 
         # Show the results of the simulation
         print(f"The simulations took {avg_iterations} iterations on average to be completed")
+        converged = [entry.get('converged') for entry in Result_Reader(results.results_dir).index] if isinstance(results, Result_Sink) else [trajectory.converged for trajectory in results]
+        print(f"{converged.count(True)} of {len(converged)} simulations converged")
+
+        if isinstance(results, Result_Sink):
+
+            # Read the final potential of every run from the memory-mapped shards, one shard at a time
+            final_potential = Running_Statistics()
+            for entry, run_data in Result_Reader(results.results_dir).iterate_runs(fields=('potential',)):
+                final_potential.update(float(run_data['potential'][-1]))
 
-        print(f"The average final potential function value was: {stats.mean([pf[-1] for pf in potential_function_developments_per_iteration])}")
+            print(f"The average final potential function value was: {final_potential.mean}")
+            print(f"The variance of the final potential function value was: {final_potential.variance}")
+            print(f"The variance of the number of iterations was: {results.iterations_statistics.variance}")
+
+        else:
+            print(f"The average final potential function value was: {stats.mean([trajectory.final_potential() for trajectory in results])}")
+
+        if plotter is not None:
+
+            # The runs are streamed into the aggregate one at a time, from the shards or from memory
+            if isinstance(results, Result_Sink):
+                reader = Result_Reader(results.results_dir)
+                max_iteration = max(entry['iterations'] for entry in reader.index)
+                runs = ((run_data['iterations'], run_data['potential']) for _, run_data in reader.iterate_runs(fields=('iterations', 'potential')))
+            else:
+                max_iteration = max(int(trajectory.iterations[-1]) for trajectory in results)
+                runs = ((trajectory.iterations, trajectory.potential) for trajectory in results)
 
+            grid, statistics = plotter.aggregate_potential(runs, max_iteration)
+            print(f"Plot saved to {plotter.plot_aggregate(grid, statistics, f'aggregate_{self.seed}.png')}")
@@ -1,9 +1,26 @@
-import networkx as nx
+import numpy as np
 
 class Tools():
 
     def calculate_distance_matrix(self, G):
 
         # Calculate the distance matrix using Dijkstra's algorithm
+        import networkx as nx # Only imported when a NetworkX graph is used
         distance_matrix = dict(nx.all_pairs_dijkstra_path_length(G))
-        return distance_matrix
\ No newline at end of file
+        return distance_matrix
+
+
+    def calculate_distance_array(self, G):
+
+        # Calculate the distance matrix using Dijkstra's algorithm and store it as a contiguous array indexed by node id
+        # Integer edge weights give an int32 matrix, otherwise float32
+        integer_weights = all(isinstance(w, (int, np.integer)) for _, _, w in G.edges(data='weight', default=1))
+        dtype = np.int32 if integer_weights else np.float32
+
+        import networkx as nx # Only imported when a NetworkX graph is used
+        n_nodes = G.number_of_nodes()
+        distance_array = np.empty((n_nodes, n_nodes), dtype=dtype)
+        for source, lengths in nx.all_pairs_dijkstra_path_length(G):
+            distance_array[source, np.fromiter(lengths.keys(), dtype=np.intp, count=len(lengths))] = np.fromiter(lengths.values(), dtype=dtype, count=len(lengths))
+
+        return distance_array
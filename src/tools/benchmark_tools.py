@@ -0,0 +1,256 @@
+from Facility_Location_Game import FLG_environment
+from Simulation import Simulation
+from tools.algorithm_tools import Tools
+from tools.scheduler_tools import SCHEDULERS
+from tools.trajectory_tools import Trajectory_Recorder
+
+import itertools
+import json
+import os
+import platform
+import time
+import tracemalloc
+import numpy as np
+
+class Benchmark_Suite():
+
+    GRID_PARAMETERS = ('n_nodes', 'n_potential_facilities', 'n_brd_players', 'seed')
+    TIMED_METRICS = ('environment_time', 'distances_time', 'brd_setup_time', 'brd_loop_time', 'recording_time', 'time_per_iteration', 'nearest_nodes_time', 'total_time', 'verify_time')
+    PER_ITERATION_METRICS = ('time_per_iteration',) # Timed metrics divided by the iterations of the run
+
+    def __init__(self, benchmark_spec, max_iterations, demand_distribution, weight_distribution, simulation_options=None, repeats=3, measure_memory=True, verify=False):
+
+        """
+        Measures the phases of a simulation (environment generation, distances, BRD setup, BRD loop and recording) over
+        a grid of problem sizes with fixed seeds, and compares the measurements against a JSON baseline.
+
+        Args:
+            benchmark_spec (dict): A list of values for 'n_nodes', 'n_potential_facilities', 'n_brd_players' and 'seeds'
+                                   whose combinations are the cases, or 'cases', a list of [n_nodes,
+                                   n_potential_facilities, n_brd_players, seed] (e.g. seeds known to converge)
+            max_iterations (int): Max number of iterations of each BRD run
+            demand_distribution (tuple): The distribution of the nodes' demand
+            weight_distribution (tuple): The distribution of the edges' weights
+            simulation_options (dict): Extra keyword arguments passed to every Simulation
+            repeats (int): Times each case is timed, the fastest repetition is kept
+            measure_memory (bool): True to run each case once more under tracemalloc to record its peak memory
+            verify (bool): True to check the distances of the engine against networkx's shortest paths, timed apart
+        """
+
+        self.benchmark_spec = benchmark_spec
+        self.max_iterations = max_iterations
+        self.demand_distribution = tuple(demand_distribution)
+        self.weight_distribution = tuple(weight_distribution)
+        self.simulation_options = simulation_options or {}
+        self.repeats = repeats
+        self.measure_memory = measure_memory
+        self.verify = verify
+
+        if benchmark_spec.get('cases'):
+            combinations = [tuple(case) for case in benchmark_spec['cases']]
+        else:
+            combinations = itertools.product(*(benchmark_spec['seeds' if parameter == 'seed' else parameter] for parameter in self.GRID_PARAMETERS))
+        self.cases = [dict(zip(self.GRID_PARAMETERS, combination)) for combination in combinations]
+
+
+    def case_key(self, case):
+
+        # Canonical string identifying a case
+        return json.dumps([case[parameter] for parameter in self.GRID_PARAMETERS])
+
+
+    def run_case(self, case):
+
+        """
+        Runs one case through every phase of a simulation.
+
+        Returns:
+            measurements (dict): The time of every phase and the number of iterations the BRD took
+        """
+
+        measurements = {}
+        total_start = time.perf_counter()
+
+        start = time.perf_counter()
+        FLG_env = FLG_environment(case['n_nodes'], case['n_potential_facilities'], seed=case['seed'], demand_distribution=self.demand_distribution, weight_distribution=self.weight_distribution, graph_type=self.simulation_options.get('graph_type', 'tree'), edge_list_path=self.simulation_options.get('edge_list_path'), facility_capacity=self.simulation_options.get('facility_capacity') if self.simulation_options.get('capacitated_facilities') else None)
+        measurements['environment_time'] = time.perf_counter() - start
+
+        # Distances with the configured backend
+        start = time.perf_counter()
+        distances = Simulation.calculate_distances(FLG_env, self.simulation_options.get('distance_backend', 'matrix'))
+        measurements['distances_time'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        simulation = Simulation(case['n_nodes'], case['n_potential_facilities'], case['n_brd_players'], self.max_iterations, case['seed'], self.demand_distribution, self.weight_distribution, FLG_env=FLG_env, distances=distances, **self.simulation_options)
+        measurements['brd_setup_time'] = time.perf_counter() - start
+
+        # Same loop as Simulation.run_FLG_BRD_simulation, timing the turns and the recording separately
+        BRD_setup = simulation.BRD_setup
+        scheduler = SCHEDULERS[simulation.scheduler](simulation.n_brd_players, simulation.main_rng)
+        trajectory = Trajectory_Recorder(simulation.n_brd_players, simulation.recording_level, simulation.recording_interval)
+        iterations = 0
+        loop_time = recording_time = 0.0
+        while not scheduler.converged() and not BRD_setup.cycling() and iterations < self.max_iterations:
+            start = time.perf_counter()
+            updated = scheduler.step(BRD_setup)
+            iterations += 1
+            recording_start = time.perf_counter()
+            trajectory.record(iterations, BRD_setup, updated)
+            end = time.perf_counter()
+            loop_time += recording_start - start
+            recording_time += end - recording_start
+
+        start = time.perf_counter()
+        trajectory.finalize(iterations, BRD_setup)
+        recording_time += time.perf_counter() - start
+
+        measurements['brd_loop_time'] = loop_time
+        measurements['recording_time'] = recording_time
+        measurements['time_per_iteration'] = loop_time / max(iterations, 1)
+        measurements['iterations'] = iterations
+        measurements['converged'] = bool(scheduler.converged()) # False if the run stopped at max_iterations or in a cycle
+
+        # Voronoi assignment of the final positions
+        start = time.perf_counter()
+        BRD_setup.calculate_nearest_nodes([player_data['facility_position'] for player_data in BRD_setup.players.values()])
+        measurements['nearest_nodes_time'] = time.perf_counter() - start
+
+        measurements['total_time'] = time.perf_counter() - total_start
+
+        # The O(n^2) reference distances would dominate the cheaper backends, so they are built after the total is taken
+        if self.verify:
+            start = time.perf_counter()
+            self.verify_distances(FLG_env, distances)
+            measurements['verify_time'] = time.perf_counter() - start
+
+        return measurements
+
+
+    @staticmethod
+    def verify_distances(FLG_env, distances):
+
+        """
+        Checks the distances from every potential facility against the original dictionary of shortest paths.
+
+        Raises:
+            ValueError: If the engine disagrees with the reference
+        """
+
+        reference = Tools().calculate_distance_matrix(FLG_env.graph)
+        facilities = np.flatnonzero(FLG_env.potential_facilities_mask)
+        expected = np.array([[reference[facility][node] for node in range(FLG_env.n_nodes)] for facility in facilities.tolist()])
+        if not np.allclose(distances.columns(facilities), expected):
+            raise ValueError("The distance engine disagrees with the reference shortest paths.")
+
+
+    def run(self):
+
+        """
+        Runs every case, keeping the fastest of the repeated timings and, if enabled, the peak traced memory.
+
+        Returns:
+            results (dict): Metadata of the machine and the measurements of every case by case key
+        """
+
+        cases = {}
+        for case in self.cases:
+
+            print(f"Benchmarking {self.case_key(case)}...")
+            repetitions = [self.run_case(case) for _ in range(self.repeats)]
+            measurements = {metric: min(repetition[metric] for repetition in repetitions) for metric in self.TIMED_METRICS if metric in repetitions[0]}
+            measurements['iterations'] = repetitions[0]['iterations']
+            measurements['converged'] = repetitions[0]['converged']
+
+            # tracemalloc slows the interpreter down, so memory is measured on a separate untimed run
+            if self.measure_memory:
+                tracemalloc.start()
+                self.run_case(case)
+                measurements['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            cases[self.case_key(case)] = {**case, **measurements}
+
+        return {
+            'metadata': {
+                'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.platform(),
+                'max_iterations': self.max_iterations,
+                'simulation_options': {key: value for key, value in self.simulation_options.items() if key != 'environment_cache'},
+                'converged_cases': sum(measurements['converged'] for measurements in cases.values()),
+            },
+            'cases': cases,
+        }
+
+
+    @staticmethod
+    def compare(results, baseline, tolerance=0.25, min_seconds=1e-3):
+
+        """
+        Compares measurements against a baseline.
+
+        Args:
+            results (dict): The output of run
+            baseline (dict): A previous output of run
+            tolerance (float): Relative increase of a time or of the peak memory reported as a regression
+            min_seconds (float): Times below this in both runs are too noisy to compare, per-iteration times are
+                                 multiplied by their iterations first
+
+        Returns:
+            regressions (list): Description of every metric that got worse by more than the tolerance, or whose number
+                                of iterations to equilibrium changed (the cases use fixed seeds, so iterations are
+                                deterministic), or of a case that no longer converges
+        """
+
+        regressions = []
+        for key, measurements in results['cases'].items():
+
+            if key not in baseline['cases']:
+                continue
+            reference = baseline['cases'][key]
+
+            # Runs stopped at max_iterations or in a cycle did not reach an equilibrium, their iterations are not compared
+            if reference.get('converged', True) and not measurements['converged']:
+                regressions.append(f"{key} no longer converges ({measurements['iterations']} iterations)")
+            elif reference.get('converged', True) and measurements['iterations'] != reference['iterations']:
+                regressions.append(f"{key} iterations: {reference['iterations']} -> {measurements['iterations']}")
+
+            for metric in Benchmark_Suite.TIMED_METRICS + ('peak_memory_bytes',):
+                if metric not in measurements or metric not in reference:
+                    continue
+                if metric in Benchmark_Suite.TIMED_METRICS and max(Benchmark_Suite.run_seconds(measurements, metric), Benchmark_Suite.run_seconds(reference, metric)) < min_seconds:
+                    continue
+                if measurements[metric] > reference[metric] * (1 + tolerance):
+                    regressions.append(f"{key} {metric}: {reference[metric]:.6g} -> {measurements[metric]:.6g} (+{100 * (measurements[metric] / reference[metric] - 1):.0f}%)")
+
+        return regressions
+
+
+    @staticmethod
+    def run_seconds(measurements, metric):
+
+        # Seconds a timed metric covers over the whole run, the noise floor of compare applies to these
+        if metric in Benchmark_Suite.PER_ITERATION_METRICS:
+            return measurements[metric] * max(measurements['iterations'], 1)
+        return measurements[metric]
+
+
+    @staticmethod
+    def save(results, file_path):
+
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(file_path, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+    @staticmethod
+    def load(file_path):
+
+        # A previously saved baseline, None if there is none
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, 'r') as f:
+            return json.load(f)
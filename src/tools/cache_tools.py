@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+class Environment_Cache():
+
+    CACHE_VERSION = 4 # Bump when the way environments are generated changes, so stale entries are never reused
+
+    def __init__(self, cache_dir, max_bytes=4 * 1024 ** 3):
+
+        """
+        Content-addressed on-disk cache of generated environments and their distance matrices. Entries are directories
+        of .npy files keyed on a hash of the generation parameters, loaded memory-mapped and evicted least recently
+        used first once the cache grows over max_bytes.
+
+        Args:
+            cache_dir (str): Directory holding the cache entries
+            max_bytes (int): Size cap of the whole cache
+        """
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+    def key(self, parameters):
+
+        # Hash of the canonical JSON of the generation parameters
+        canonical = json.dumps({'cache_version': self.CACHE_VERSION, **parameters}, sort_keys=True)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+    @staticmethod
+    def file_digest(path, chunk_size=1024 ** 2):
+
+        # Hash of the contents of an input file, so editing it in place invalidates the entries generated from it
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+    def load(self, parameters):
+
+        """
+        Looks up an environment.
+
+        Args:
+            parameters (dict): The parameters the environment was generated from
+
+        Returns:
+            arrays (dict): The memory-mapped arrays of the entry, None if it is not cached
+        """
+
+        entry_dir = os.path.join(self.cache_dir, self.key(parameters))
+        if not os.path.isdir(entry_dir):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        os.utime(entry_dir) # The modification time of an entry is its last access, used for LRU eviction
+        return {
+            file_name[:-len('.npy')]: np.load(os.path.join(entry_dir, file_name), mmap_mode='r')
+            for file_name in os.listdir(entry_dir) if file_name.endswith('.npy')
+        }
+
+
+    def store(self, parameters, arrays):
+
+        """
+        Stores an environment, then evicts the least recently used entries if the cache is over its size cap.
+
+        Args:
+            parameters (dict): The parameters the environment was generated from
+            arrays (dict): Name and array of everything that makes up the environment
+        """
+
+        entry_dir = os.path.join(self.cache_dir, self.key(parameters))
+
+        # Write into a temporary directory first so readers never see half-written entries
+        temporary_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        for name, array in arrays.items():
+            np.save(os.path.join(temporary_dir, f"{name}.npy"), np.asarray(array))
+        try:
+            os.rename(temporary_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(temporary_dir) # Another process stored the same entry meanwhile
+
+        self.evict(keep=os.path.basename(entry_dir))
+
+
+    def entry_size(self, entry_dir):
+        return sum(os.path.getsize(os.path.join(entry_dir, file_name)) for file_name in os.listdir(entry_dir))
+
+
+    def evict(self, keep=None):
+
+        # Remove the least recently used entries until the cache fits in max_bytes (the entry just stored is always kept)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if os.path.isdir(entry_dir) and not name.startswith('.'):
+                entries.append((os.path.getmtime(entry_dir), name, self.entry_size(entry_dir)))
+
+        total_bytes = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+            total_bytes -= size
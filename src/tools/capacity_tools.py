@@ -0,0 +1,347 @@
+from tools.instrumentation_tools import NULL_INSTRUMENTATION
+
+import numpy as np
+
+def deferred_acceptance(facility_distances, demand, capacity, priority, facility_ids):
+
+    """
+    Splits the demand of some nodes among facilities of limited capacity. Every node sends its demand to its nearest
+    facility, a full facility keeps its nearest clients and turns the rest away, and the overflow moves on to the next
+    nearest facility with room. The result is the same as serving the (node, facility) pairs greedily by increasing
+    distance, ties broken by node priority and then by facility id, so it does not depend on the order nodes are given in.
+
+    Args:
+        facility_distances (np.ndarray): (n_facilities, n_nodes) distance from every facility to every node
+        demand (np.ndarray): Demand of every node
+        capacity (np.ndarray): Capacity available in every facility
+        priority (np.ndarray): Tie-breaking rank of every node, lower is served first
+        facility_ids (np.ndarray): Tie-breaking rank of every facility, lower is preferred first
+
+    Returns:
+        flow_nodes (np.ndarray): Node of every flow, as an index into demand
+        flow_facilities (np.ndarray): Facility of every flow, as an index into capacity
+        flow_amounts (np.ndarray): Demand sent by every flow (a node and facility pair can have more than one flow)
+        unmet (np.ndarray): Demand of every node that no facility had room for
+    """
+
+    n_facilities, n_nodes = facility_distances.shape
+
+    # Facilities in order of preference of every node, preference[r, v] is the r-th nearest facility of node v
+    preference = np.lexsort((np.broadcast_to(facility_ids[:, None], facility_distances.shape), facility_distances), axis=0)
+    rank = np.zeros(n_nodes, dtype=np.intp)
+    remaining = np.asarray(demand, dtype=np.float64).copy()
+
+    flow_nodes = np.zeros(0, dtype=np.intp)
+    flow_facilities = np.zeros(0, dtype=np.intp)
+    flow_amounts = np.zeros(0, dtype=np.float64)
+
+    while True:
+
+        # Nodes with demand left propose it to the nearest facility that has not turned them away yet
+        proposers = np.flatnonzero((remaining > 0) & (rank < n_facilities))
+        if proposers.size == 0:
+            break
+        nodes = np.concatenate((flow_nodes, proposers))
+        facilities = np.concatenate((flow_facilities, preference[rank[proposers], proposers]))
+        amounts = np.concatenate((flow_amounts, remaining[proposers]))
+        remaining[proposers] = 0
+
+        # Every facility keeps the nearest demand it holds or is offered, up to its capacity
+        order = np.lexsort((priority[nodes], facility_distances[facilities, nodes], facilities))
+        nodes, facilities, amounts = nodes[order], facilities[order], amounts[order]
+        served_before = np.cumsum(amounts) - amounts
+        served_before -= served_before[np.searchsorted(facilities, facilities)]
+        accepted = np.clip(capacity[facilities] - served_before, 0, amounts)
+        rejected = amounts - accepted
+
+        # A facility that turns demand away is full for good, so the node moves on from it
+        remaining += np.bincount(nodes, weights=rejected, minlength=n_nodes)
+        turned_away = np.flatnonzero(rejected > 0)
+        turned_away = turned_away[rank[nodes[turned_away]] < n_facilities]
+        proposing_to = preference[rank[nodes[turned_away]], nodes[turned_away]]
+        rank[nodes[turned_away][facilities[turned_away] == proposing_to]] += 1
+
+        kept = accepted > 0
+        flow_nodes, flow_facilities, flow_amounts = nodes[kept], facilities[kept], accepted[kept]
+
+    return flow_nodes, flow_facilities, flow_amounts, remaining
+
+
+def greedy_pairs(facility_distances, demand, capacity, priority, facility_ids):
+
+    """
+    Same allocation as deferred_acceptance, computed by serving the (node, facility) pairs one by one in increasing
+    distance. Faster for the small regions solved when a player moves, where the rounds of deferred_acceptance cost
+    more than the pairs themselves.
+    """
+
+    n_facilities, n_nodes = facility_distances.shape
+    pair_facilities, pair_nodes = np.divmod(np.arange(n_facilities * n_nodes), n_nodes)
+    order = np.lexsort((facility_ids[pair_facilities], priority[pair_nodes], facility_distances.ravel()))
+
+    remaining = np.asarray(demand, dtype=np.float64).tolist()
+    room = np.asarray(capacity, dtype=np.float64).tolist()
+    n_waiting = sum(amount > 0 for amount in remaining) # Nodes with demand left
+    n_open = sum(amount > 0 for amount in room) # Facilities with room left
+
+    flow_nodes, flow_facilities, flow_amounts = [], [], []
+    for facility, node in zip(pair_facilities[order].tolist(), pair_nodes[order].tolist()):
+        if remaining[node] <= 0 or room[facility] <= 0:
+            continue
+        amount = min(remaining[node], room[facility])
+        flow_nodes.append(node)
+        flow_facilities.append(facility)
+        flow_amounts.append(amount)
+        remaining[node] -= amount
+        room[facility] -= amount
+        n_waiting -= remaining[node] <= 0
+        n_open -= room[facility] <= 0
+        if n_waiting == 0 or n_open == 0:
+            break
+
+    return np.array(flow_nodes, dtype=np.intp), np.array(flow_facilities, dtype=np.intp), np.array(flow_amounts, dtype=np.float64), np.array(remaining, dtype=np.float64)
+
+
+def solve_flow(facility_distances, demand, capacity, priority, facility_ids, max_greedy_pairs=1 << 14):
+
+    # Allocation of the demand to capacitated facilities, see deferred_acceptance, serving the pairs one by one when there are few
+    if facility_distances.size <= max_greedy_pairs:
+        return greedy_pairs(facility_distances, demand, capacity, priority, facility_ids)
+    return deferred_acceptance(facility_distances, demand, capacity, priority, facility_ids)
+
+
+def lexicographic_max(groups, primary, secondary, n_groups):
+
+    # Largest (primary, secondary) pair of every group, (-inf, -inf) for empty groups
+    primary_max = np.full(n_groups, -np.inf)
+    np.maximum.at(primary_max, groups, primary)
+    at_max = primary == primary_max[groups]
+    secondary_max = np.full(n_groups, -np.inf)
+    np.maximum.at(secondary_max, groups[at_max], secondary[at_max])
+    return primary_max, secondary_max
+
+
+class Capacitated_Assignment():
+
+    TOLERANCE = 1e-9 # Flows that differ by less than this are considered equal
+
+    def __init__(self, distances, nodes_demand, node_capacity, facilities, rng, instrumentation=NULL_INSTRUMENTATION):
+
+        """
+        Assignment of the demand to the facilities of the players when every facility has a limited capacity, see
+        deferred_acceptance. A node whose demand is split among several facilities costs each of them its distance
+        times the fraction of the demand it serves. When one player changes facility only the flow that can change is
+        solved again, see solve_region.
+
+        Args:
+            distances: Distance engine indexed by node id
+            nodes_demand (np.ndarray): Demand of every node
+            node_capacity (np.ndarray): Capacity of a facility opened at every node
+            facilities (np.ndarray): The facility of every player, indexed by player id
+            rng (np.random.Generator): Generator used to draw the tie-breaking priority of the nodes
+            instrumentation (Instrumentation): Counters and timers of the run
+        """
+
+        self.distances = distances
+        self.nodes_demand = np.asarray(nodes_demand, dtype=np.float64)
+        self.node_capacity = np.asarray(node_capacity, dtype=np.float64)
+        self.n_nodes = self.nodes_demand.shape[0]
+        self.priority = rng.permutation(self.n_nodes) # Nodes served first when they are as near to a full facility as others
+        self.instrumentation = instrumentation
+
+        self.facilities = np.array(facilities, dtype=np.intp)
+        self.capacity = self.node_capacity[self.facilities]
+        self.solve()
+
+
+    def solve(self):
+
+        """
+        Solves the whole flow again, e.g. after the distances changed.
+
+        Returns:
+            player_demand (np.ndarray): Demand every player serves
+            player_cost (np.ndarray): Cost of every player
+        """
+
+        self.facility_distances = np.asarray(self.distances.columns(self.facilities), dtype=np.float64)
+        with self.instrumentation.timer('capacitated_assignment'):
+            self.flow_nodes, self.flow_players, self.flow_amounts, self.unmet = solve_flow(self.facility_distances, self.nodes_demand, self.capacity, self.priority, self.facilities)
+        self.update_totals()
+        return self.player_demand, self.player_cost
+
+
+    def update_totals(self):
+
+        # Demand served by every player, and its cost: the distance to every node times the fraction of its demand served
+        n_players = self.facilities.shape[0]
+        flow_distances = self.facility_distances[self.flow_players, self.flow_nodes]
+        self.player_demand = np.bincount(self.flow_players, weights=self.flow_amounts, minlength=n_players)
+        self.player_cost = np.bincount(self.flow_players, weights=flow_distances * self.flow_amounts / self.nodes_demand[self.flow_nodes], minlength=n_players)
+
+        # Farthest facility serving every node (infinitely far while part of its demand is unmet)
+        self.node_worst = lexicographic_max(self.flow_nodes, flow_distances, self.facilities[self.flow_players], self.n_nodes)
+        self.node_worst[0][self.unmet > self.TOLERANCE] = np.inf
+
+
+    def solve_region(self, changed_players, facility_distances, capacity, facility_ids):
+
+        """
+        Solves again the flow of the region of nodes that a change of the facilities of some players affects, the flow
+        of every other node stays as it is. The region starts with the clients of the changed facilities and grows with
+        the nodes of every blocking pair (a node and a facility that would both rather serve each other than some of
+        their current flow) until there is none left. The stable allocation is unique, so the result is the same as
+        solving every node again.
+
+        Args:
+            changed_players (np.ndarray): The players whose facility changed
+            facility_distances (np.ndarray): (n_players, n_nodes) distances with the changed facilities
+            capacity (np.ndarray): Capacity of the facility of every player with the changed facilities
+            facility_ids (np.ndarray): Facility of every player with the changed facilities
+
+        Returns:
+            region (np.ndarray): Mask of the nodes whose flow was solved again
+            flow (tuple): (nodes, players, amounts) of the new flow of the region, nodes as indices into the region
+            unmet (np.ndarray): Unmet demand of every node of the region
+        """
+
+        n_players = facility_ids.shape[0]
+        changed = np.zeros(n_players, dtype=bool)
+        changed[changed_players] = True
+        # Start with the clients of the changed facilities, and the nearest nodes that would rather be served by each of
+        # them, as many as its capacity can take
+        region = np.zeros(self.n_nodes, dtype=bool)
+        region[self.flow_nodes[changed[self.flow_players]]] = True
+        for player in np.flatnonzero(changed):
+            distances = facility_distances[player]
+            candidates = np.flatnonzero((distances < self.node_worst[0]) | ((distances == self.node_worst[0]) & (facility_ids[player] < self.node_worst[1])))
+            candidates = candidates[np.lexsort((self.priority[candidates], distances[candidates]))]
+            taken = np.cumsum(self.nodes_demand[candidates]) - self.nodes_demand[candidates] < capacity[player]
+            region[candidates[taken]] = True
+
+        while True:
+
+            nodes = np.flatnonzero(region)
+            inside = region[self.flow_nodes]
+            outside_nodes, outside_players, outside_amounts = self.flow_nodes[~inside], self.flow_players[~inside], self.flow_amounts[~inside]
+            outside_load = np.bincount(outside_players, weights=outside_amounts, minlength=n_players)
+            flow_nodes, flow_players, flow_amounts, unmet = solve_flow(facility_distances[:, nodes], self.nodes_demand[nodes], capacity - outside_load, self.priority[nodes], facility_ids)
+            self.instrumentation.count('capacitated_region_solves')
+            self.instrumentation.count('capacitated_region_nodes', nodes.size)
+
+            # The whole allocation: the flow outside of the region as it was, and the new flow of the region
+            all_nodes = np.concatenate((outside_nodes, nodes[flow_nodes]))
+            all_players = np.concatenate((outside_players, flow_players))
+            all_distances = facility_distances[all_players, all_nodes]
+            spare = np.bincount(all_players, weights=np.concatenate((outside_amounts, flow_amounts)), minlength=n_players) < capacity - self.TOLERANCE
+            facility_worst = lexicographic_max(all_players, all_distances, self.priority[all_nodes], n_players) # Farthest client of every facility
+            node_worst = lexicographic_max(all_nodes, all_distances, facility_ids[all_players], self.n_nodes) # Farthest facility of every node
+            node_worst[0][(self.unmet > self.TOLERANCE) & ~region] = np.inf
+            node_worst[0][nodes[unmet > self.TOLERANCE]] = np.inf
+
+            # Only the facilities whose flow changed can form new blocking pairs with the nodes outside of the region
+            keys = np.concatenate((self.flow_nodes[inside] * n_players + self.flow_players[inside], nodes[flow_nodes] * n_players + flow_players))
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            difference = np.bincount(inverse, weights=np.concatenate((-self.flow_amounts[inside], flow_amounts)))
+            affected = changed.copy()
+            affected[unique_keys[np.abs(difference) > self.TOLERANCE] % n_players] = True
+            rows = np.flatnonzero(affected)
+            blocking = self.blocking_pairs(rows, np.arange(self.n_nodes), facility_distances, facility_ids, spare, facility_worst, node_worst)
+            new_nodes = blocking.any(axis=0) & ~region
+
+            # The region was solved with the capacity taken outside of it, so a node of the region can block a facility
+            # with a farther client outside, who may lose its flow
+            blocking = self.blocking_pairs(np.arange(n_players), nodes, facility_distances, facility_ids, spare, facility_worst, node_worst)
+            nearest_blocking = np.where(blocking, facility_distances[:, nodes], np.inf).min(axis=1, initial=np.inf)
+            new_nodes[outside_nodes[facility_distances[outside_players, outside_nodes] >= nearest_blocking[outside_players]]] = True
+
+            if not new_nodes.any():
+                break
+            region |= new_nodes
+
+        return region, (flow_nodes, flow_players, flow_amounts), unmet
+
+
+    def blocking_pairs(self, rows, columns, facility_distances, facility_ids, spare, facility_worst, node_worst):
+
+        """
+        Finds the blocking pairs between some players' facilities and some nodes: the node would rather be served by the
+        facility than by its farthest one (or has unmet demand), and the facility has room or would rather serve the node
+        than its farthest client.
+
+        Returns:
+            blocking (np.ndarray): (rows, columns) mask of the blocking pairs
+        """
+
+        distances = facility_distances[rows][:, columns]
+        node_distance, node_facility = node_worst[0][columns], node_worst[1][columns]
+        node_prefers = (distances < node_distance) | ((distances == node_distance) & (facility_ids[rows, None] < node_facility))
+        facility_distance, facility_priority = facility_worst[0][rows, None], facility_worst[1][rows, None]
+        facility_prefers = spare[rows, None] | (distances < facility_distance) | ((distances == facility_distance) & (self.priority[columns] < facility_priority))
+        return node_prefers & facility_prefers
+
+
+    def evaluate_move(self, player_id, new_facility):
+
+        """
+        Computes the utility a player would get at another facility, without moving it.
+
+        Args:
+            player_id (int): The player that would move
+            new_facility (int): The free facility it would move to
+
+        Returns:
+            utility (float): Demand the player would serve minus its cost
+        """
+
+        facility_distances, capacity, facility_ids = self.with_facility(player_id, new_facility)
+        with self.instrumentation.timer('capacitated_evaluation'):
+            region, (flow_nodes, flow_players, flow_amounts), _ = self.solve_region(np.array([player_id]), facility_distances, capacity, facility_ids)
+
+        # The player's clients are all in the region, since the region holds every node its old facility served
+        nodes = np.flatnonzero(region)[flow_nodes[flow_players == player_id]]
+        amounts = flow_amounts[flow_players == player_id]
+        return amounts.sum() - (facility_distances[player_id, nodes] * amounts / self.nodes_demand[nodes]).sum()
+
+
+    def move(self, player_id, new_facility):
+
+        """
+        Moves a player to another facility and updates the flow of the affected region.
+
+        Args:
+            player_id (int): The player that moves
+            new_facility (int): The free facility it moves to
+
+        Returns:
+            player_demand (np.ndarray): Demand every player serves
+            player_cost (np.ndarray): Cost of every player
+        """
+
+        facility_distances, capacity, facility_ids = self.with_facility(player_id, new_facility)
+        with self.instrumentation.timer('capacitated_move'):
+            region, (flow_nodes, flow_players, flow_amounts), unmet = self.solve_region(np.array([player_id]), facility_distances, capacity, facility_ids)
+
+        # Replace the flow of the region
+        outside = ~region[self.flow_nodes]
+        nodes = np.flatnonzero(region)
+        self.flow_nodes = np.concatenate((self.flow_nodes[outside], nodes[flow_nodes]))
+        self.flow_players = np.concatenate((self.flow_players[outside], flow_players))
+        self.flow_amounts = np.concatenate((self.flow_amounts[outside], flow_amounts))
+        self.unmet[nodes] = unmet
+
+        self.facility_distances, self.capacity, self.facilities = facility_distances, capacity, facility_ids
+        self.update_totals()
+        return self.player_demand, self.player_cost
+
+
+    def with_facility(self, player_id, new_facility):
+
+        # Distances, capacities and facilities of the players if player_id were at new_facility
+        facility_distances = self.facility_distances.copy()
+        facility_distances[player_id] = self.distances.column(new_facility)
+        capacity = self.capacity.copy()
+        capacity[player_id] = self.node_capacity[new_facility]
+        facility_ids = self.facilities.copy()
+        facility_ids[player_id] = new_facility
+        return facility_distances, capacity, facility_ids
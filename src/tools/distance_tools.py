@@ -0,0 +1,921 @@
+import heapq
+from collections import OrderedDict
+from tools.instrumentation_tools import NULL_INSTRUMENTATION
+import numpy as np
+
+class Distance_Matrix():
+
+    def __init__(self, matrix):
+
+        # Contiguous (n_nodes x n_nodes) array indexed by node id, the graph is undirected so the matrix is symmetric
+        self.matrix = np.ascontiguousarray(matrix)
+        self.n_nodes = self.matrix.shape[0]
+
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['matrix'])
+
+
+    def to_arrays(self):
+
+        # Arrays that fully describe the engine, see from_arrays
+        return {'matrix': self.matrix}
+
+
+    def dist(self, u, v):
+
+        # Distance between two nodes
+        return self.matrix[u, v]
+
+
+    def column(self, facility):
+
+        """
+        Distances from every node to a single facility.
+
+        Args:
+            facility (int): The facility node
+
+        Returns:
+            np.ndarray: (n_nodes,) distances
+        """
+
+        # Rows and columns are interchangeable because the matrix is symmetric, rows are contiguous in memory
+        return self.matrix[facility]
+
+
+    def columns(self, facilities):
+
+        """
+        Distances from the given facilities to every node.
+
+        Args:
+            facilities (array-like): The facility nodes
+
+        Returns:
+            np.ndarray: (len(facilities), n_nodes) distances, one row per facility
+        """
+
+        return self.matrix[np.asarray(facilities, dtype=np.intp)]
+
+
+    def assign_nearest_facilities(self, taken_facilities, rng, nodes=None, instrumentation=NULL_INSTRUMENTATION):
+
+        """
+        Computes the Voronoi assignment of the nodes to the taken facilities in one vectorized pass.
+
+        Args:
+            taken_facilities (array-like): The facilities taken by the players
+            rng (np.random.Generator): Generator used for the random tie-breaking rule
+            nodes (array-like): Only assign these nodes (all nodes if None)
+            instrumentation (Instrumentation): Counts the random tie-breaks
+
+        Returns:
+            assignment (np.ndarray): The facility each node is assigned to
+            nearest_distance (np.ndarray): The distance from each node to its assigned facility
+        """
+
+        taken_facilities = np.asarray(taken_facilities, dtype=np.intp)
+        if nodes is None:
+            facility_distances = self.columns(taken_facilities)
+        else:
+            facility_distances = self.matrix[np.ix_(taken_facilities, np.asarray(nodes, dtype=np.intp))]
+
+        return resolve_nearest_facilities(facility_distances, taken_facilities, rng, instrumentation)
+
+
+def resolve_nearest_facilities(facility_distances, facilities, rng, instrumentation=NULL_INSTRUMENTATION):
+
+    """
+    Picks, for every node, the nearest facility applying the random tie-breaking rule.
+
+    Args:
+        facility_distances (np.ndarray): (n_facilities, n_nodes) distances from each facility to each node
+        facilities (np.ndarray): The facility ids of the rows of facility_distances
+        rng (np.random.Generator): Generator used for the random tie-breaking rule
+        instrumentation (Instrumentation): Counts the random tie-breaks
+
+    Returns:
+        assignment (np.ndarray): The facility each node is assigned to
+        nearest_distance (np.ndarray): The distance from each node to its assigned facility
+    """
+
+    nearest_row = np.argmin(facility_distances, axis=0)
+    nearest_distance = facility_distances[nearest_row, np.arange(facility_distances.shape[1])]
+
+    # Nodes at the same minimum distance from several facilities are assigned at random among them
+    ties = facility_distances == nearest_distance
+    tied_nodes = np.flatnonzero(ties.sum(axis=0) > 1)
+    if tied_nodes.size:
+        instrumentation.count('random_tie_breaks', tied_nodes.size)
+        keys = rng.random((facility_distances.shape[0], tied_nodes.size))
+        keys[~ties[:, tied_nodes]] = -1.0
+        nearest_row[tied_nodes] = np.argmax(keys, axis=0)
+
+    return facilities[nearest_row], nearest_distance
+
+
+def build_csr(n_nodes, edges, weights):
+
+    """
+    Builds the symmetric CSR adjacency of an undirected weighted graph.
+
+    Args:
+        n_nodes (int): Number of nodes of the graph
+        edges (np.ndarray): (n_edges, 2) node pairs
+        weights (np.ndarray): Weight of every edge
+
+    Returns:
+        indptr (np.ndarray): The neighbours of node v are targets[indptr[v]:indptr[v + 1]]
+        targets (np.ndarray): Neighbour of every adjacency entry
+        edge_weights (np.ndarray): Weight of every adjacency entry
+    """
+
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    weights = np.asarray(weights)
+    sources = np.concatenate((edges[:, 0], edges[:, 1]))
+    targets = np.concatenate((edges[:, 1], edges[:, 0]))
+    edge_weights = np.concatenate((weights, weights))
+    by_source = np.argsort(sources, kind='stable')
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n_nodes), out=indptr[1:])
+    return indptr, targets[by_source], edge_weights[by_source]
+
+
+class Facility_Ranking():
+
+    def __init__(self, distances, potential_facilities, chunk_size=4096):
+
+        """
+        Precomputes, for every node, the potential facilities sorted by ascending distance.
+
+        Args:
+            distances: Distance engine indexed by node id
+            potential_facilities (array-like): The node ids of the potential facilities
+            chunk_size (int): Number of nodes ranked at once while building the index
+        """
+
+        self.distances = distances
+        self.facilities = np.asarray(potential_facilities, dtype=np.intp)
+        self.n_facilities = self.facilities.size
+
+        # Position of every potential facility inside self.facilities (-1 for the other nodes)
+        self.facility_index = np.full(distances.n_nodes, -1, dtype=np.intp)
+        self.facility_index[self.facilities] = np.arange(self.n_facilities)
+
+        # order[n, r] is the index of the r-th nearest potential facility to node n
+        # group_end[n, r] is the rank of the last facility tied in distance with order[n, r]
+        index_dtype = np.min_scalar_type(max(self.n_facilities - 1, 0))
+        self.order = np.empty((distances.n_nodes, self.n_facilities), dtype=index_dtype)
+        self.group_end = np.empty((distances.n_nodes, self.n_facilities), dtype=index_dtype)
+
+        facility_distances = distances.columns(self.facilities)
+        ranks = np.arange(self.n_facilities)
+        for start in range(0, distances.n_nodes, chunk_size):
+
+            chunk_distances = facility_distances[:, start:start + chunk_size].T
+            chunk_order = np.argsort(chunk_distances, axis=1, kind='stable')
+            sorted_distances = np.take_along_axis(chunk_distances, chunk_order, axis=1)
+
+            # The last rank of every tie group is where the next distance differs, propagated backwards
+            is_group_end = np.ones(sorted_distances.shape, dtype=bool)
+            is_group_end[:, :-1] = sorted_distances[:, 1:] != sorted_distances[:, :-1]
+            chunk_group_end = np.where(is_group_end, ranks, self.n_facilities)
+            chunk_group_end = np.minimum.accumulate(chunk_group_end[:, ::-1], axis=1)[:, ::-1]
+
+            self.order[start:start + chunk_size] = chunk_order
+            self.group_end[start:start + chunk_size] = chunk_group_end
+
+
+    def assign_nearest_facilities(self, taken_facilities, rng, nodes=None, instrumentation=NULL_INSTRUMENTATION):
+
+        """
+        Computes the Voronoi assignment of the nodes to the taken facilities by scanning each node's ranking for the
+        first occupied facility.
+
+        Args:
+            taken_facilities (array-like): The facilities taken by the players, all of them potential facilities
+            rng (np.random.Generator): Generator used for the random tie-breaking rule
+            nodes (array-like): Only assign these nodes (all nodes if None)
+            instrumentation (Instrumentation): Counts the random tie-breaks
+
+        Returns:
+            assignment (np.ndarray): The facility each node is assigned to
+            nearest_distance (np.ndarray): The distance from each node to its assigned facility
+        """
+
+        if len(taken_facilities) == 0:
+            raise ValueError("At least one facility must be taken.")
+
+        all_nodes = nodes is None
+        nodes = np.arange(self.distances.n_nodes) if all_nodes else np.asarray(nodes, dtype=np.intp)
+        occupied = np.zeros(self.n_facilities, dtype=bool)
+        occupied[self.facility_index[np.asarray(taken_facilities, dtype=np.intp)]] = True
+
+        # Scan the rankings in blocks, widening the block only for the nodes that have not found an occupied facility yet
+        # The first block is about as wide as the expected rank of the nearest occupied facility
+        first_rank = np.empty(nodes.size, dtype=np.intp)
+        pending = np.arange(nodes.size)
+        start, width = 0, -(-self.n_facilities // occupied.sum())
+        while pending.size:
+            rankings = self.order[:, start:start + width] if all_nodes and start == 0 else self.order[nodes[pending], start:start + width]
+            block = occupied[rankings]
+            found = block.any(axis=1)
+            first_rank[pending[found]] = start + np.argmax(block[found], axis=1)
+            pending = pending[~found]
+            start, width = start + width, 2 * width
+
+        # Nodes whose first occupied facility is tied with other facilities choose at random among the occupied ones
+        group_end = self.group_end[nodes, first_rank].astype(np.intp)
+        tied = np.flatnonzero(group_end > first_rank)
+        if tied.size:
+            instrumentation.count('random_tie_breaks', tied.size)
+            span = np.arange((group_end[tied] - first_rank[tied]).max() + 1)
+            window = np.minimum(first_rank[tied, None] + span, group_end[tied, None])
+            candidates = occupied[self.order[nodes[tied, None], window]] & (first_rank[tied, None] + span <= group_end[tied, None])
+            keys = rng.random(candidates.shape)
+            keys[~candidates] = -1.0
+            first_rank[tied] = first_rank[tied] + np.argmax(keys, axis=1)
+
+        assignment = self.facilities[self.order[nodes, first_rank]]
+        return assignment, self.distances.dist(nodes, assignment)
+
+
+class Tree_Distance():
+
+    def __init__(self, parent, depth, weighted_depth, tin, subtree_size, sparse_table):
+
+        """
+        Distances on a weighted tree answered through lowest common ancestor queries, using O(n log n) memory instead of
+        the n^2 of a distance matrix. Use from_edges or from_graph to build it. Edge weights can change afterwards
+        (see update_edge_weights), the shape of the tree and so the LCA structure stay the same.
+
+        Args:
+            parent (np.ndarray): Parent of every node in the tree rooted at node 0 (the root is its own parent)
+            depth (np.ndarray): Number of edges between every node and the root
+            weighted_depth (np.ndarray): Distance between every node and the root
+            tin (np.ndarray): Position of every node in the depth-first preorder
+            subtree_size (np.ndarray): Number of nodes in the subtree of every node, which spans the preorder positions
+                                       tin .. tin + subtree_size - 1
+            sparse_table (np.ndarray): sparse_table[k, i] is the shallowest node among preorder positions i .. i + 2^k - 1
+        """
+
+        self.parent = parent
+        self.depth = depth
+        self.weighted_depth = weighted_depth
+        self.tin = tin
+        self.subtree_size = subtree_size
+        self.sparse_table = sparse_table
+        self.n_nodes = parent.shape[0]
+        self._order = None
+        self._children = None
+
+
+    @classmethod
+    def from_graph(cls, G):
+
+        # Build the structure from a NetworkX tree with 'weight' edge attributes
+        edges = np.array(list(G.edges()), dtype=np.int64).reshape(-1, 2)
+        weights = np.array([G.edges[u, v].get('weight', 1) for u, v in edges])
+        return cls.from_edges(G.number_of_nodes(), edges, weights)
+
+
+    @classmethod
+    def from_edges(cls, n_nodes, edges, weights):
+
+        """
+        Roots the tree at node 0 and builds the depth arrays and the LCA sparse table, level by level with vectorized
+        operations.
+
+        Args:
+            n_nodes (int): Number of nodes of the tree
+            edges (np.ndarray): (n_nodes - 1, 2) node pairs
+            weights (np.ndarray): Weight of every edge
+        """
+
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        weights = np.asarray(weights)
+        if edges.shape[0] != n_nodes - 1:
+            raise ValueError("The graph is not a tree.")
+
+        # Symmetric CSR adjacency
+        indptr, targets, edge_weights = build_csr(n_nodes, edges, weights)
+
+        # Breadth-first search from the root, one level at a time (children stay grouped by parent)
+        parent = np.zeros(n_nodes, dtype=np.int64)
+        depth = np.zeros(n_nodes, dtype=np.int64)
+        weighted_depth = np.zeros(n_nodes, dtype=weights.dtype if weights.size else np.int64)
+        visited = np.zeros(n_nodes, dtype=bool)
+        visited[0] = True
+        levels = [np.array([0])]
+        while True:
+            frontier = levels[-1]
+            counts = indptr[frontier + 1] - indptr[frontier]
+            if counts.sum() == 0:
+                break
+            positions = np.repeat(indptr[frontier] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            neighbours = targets[positions]
+            new = ~visited[neighbours]
+            if not new.any():
+                break
+            children = neighbours[new]
+            children_parent = np.repeat(frontier, counts)[new]
+            parent[children] = children_parent
+            depth[children] = depth[children_parent] + 1
+            weighted_depth[children] = weighted_depth[children_parent] + edge_weights[positions][new]
+            visited[children] = True
+            levels.append(children)
+
+        if not visited.all():
+            raise ValueError("The graph is not connected.")
+
+        # Subtree sizes, bottom-up
+        subtree_size = np.ones(n_nodes, dtype=np.int64)
+        for level in reversed(levels[1:]):
+            np.add.at(subtree_size, parent[level], subtree_size[level])
+
+        # Preorder positions, top-down: a child starts right after its parent plus the subtrees of its earlier siblings
+        tin = np.zeros(n_nodes, dtype=np.int64)
+        for level in levels[1:]:
+            level_parent = parent[level]
+            inclusive = np.cumsum(subtree_size[level])
+            exclusive = inclusive - subtree_size[level]
+            group_start = np.flatnonzero(np.r_[True, level_parent[1:] != level_parent[:-1]])
+            group_of = np.repeat(group_start, np.diff(np.r_[group_start, level.size]))
+            tin[level] = tin[level_parent] + 1 + exclusive - exclusive[group_of]
+
+        # Sparse table of the shallowest node over ranges of the preorder
+        order = np.empty(n_nodes, dtype=np.int64)
+        order[tin] = np.arange(n_nodes)
+        n_levels = max(1, int(n_nodes).bit_length())
+        index_dtype = np.min_scalar_type(max(n_nodes - 1, 0))
+        sparse_table = np.zeros((n_levels, n_nodes), dtype=index_dtype)
+        sparse_table[0] = order
+        for k in range(1, n_levels):
+            half = 1 << (k - 1)
+            left, right = sparse_table[k - 1, :n_nodes - half], sparse_table[k - 1, half:]
+            sparse_table[k, :n_nodes - half] = np.where(depth[left] <= depth[right], left, right)
+
+        return cls(parent, depth, weighted_depth, tin, subtree_size, sparse_table)
+
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['parent'], arrays['depth'], arrays['weighted_depth'], arrays['tin'], arrays['subtree_size'], arrays['sparse_table'])
+
+
+    def to_arrays(self):
+
+        # Arrays that fully describe the engine, see from_arrays
+        return {'parent': self.parent, 'depth': self.depth, 'weighted_depth': self.weighted_depth, 'tin': self.tin, 'subtree_size': self.subtree_size, 'sparse_table': self.sparse_table}
+
+
+    @property
+    def order(self):
+
+        # Node at every preorder position, built on first use
+        if self._order is None:
+            self._order = np.empty(self.n_nodes, dtype=np.int64)
+            self._order[self.tin] = np.arange(self.n_nodes)
+        return self._order
+
+
+    @property
+    def children(self):
+
+        # Children of every node as a CSR (indptr, children), built on first use
+        if self._children is None:
+            children = np.flatnonzero(self.parent != np.arange(self.n_nodes))
+            children = children[np.argsort(self.parent[children], kind='stable')]
+            indptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.parent[children], minlength=self.n_nodes), out=indptr[1:])
+            self._children = (indptr, children)
+        return self._children
+
+
+    def subtree_sums(self, roots, values):
+
+        """
+        Adds values[i] to every node of the subtree of roots[i], with one pass over the preorder.
+
+        Returns:
+            sums (np.ndarray): What every node received
+        """
+
+        shift = np.zeros(self.n_nodes + 1, dtype=np.result_type(values, np.int64))
+        np.add.at(shift, self.tin[roots], values)
+        np.add.at(shift, self.tin[roots] + self.subtree_size[roots], -np.asarray(values))
+        sums = np.empty(self.n_nodes, dtype=shift.dtype)
+        sums[self.order] = np.cumsum(shift[:-1])
+        return sums
+
+
+    def update_edge_weights(self, edges, deltas):
+
+        """
+        Changes the weight of some edges. An edge separates the subtree below it from the rest of the tree, so only the
+        weighted depths in that subtree change, and with them exactly the distances between the two sides.
+
+        Args:
+            edges (np.ndarray): (n_changed, 2) node pairs of the changed edges
+            deltas (np.ndarray): Change of the weight of every edge
+
+        Returns:
+            children (np.ndarray): The node below every changed edge
+        """
+
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        children = np.where(self.parent[edges[:, 0]] == edges[:, 1], edges[:, 0], edges[:, 1])
+
+        # A new array, the old one may be memory-mapped from the cache or shared with other processes
+        self.weighted_depth = self.weighted_depth + self.subtree_sums(children, deltas).astype(self.weighted_depth.dtype)
+        return children
+
+
+    def components(self, children):
+
+        """
+        Labels the components the tree splits into when the edges above the given nodes are removed, with one pass over
+        the preorder: every node gets the innermost removed child above it (or itself), the root component gets -1.
+
+        Args:
+            children (np.ndarray): The node below every removed edge
+
+        Returns:
+            labels (np.ndarray): The component of every node
+        """
+
+        children = np.unique(children)
+        children = children[np.argsort(self.tin[children])]
+        ends = self.tin[children] + self.subtree_size[children]
+
+        # The removed child enclosing every removed child, the subtrees are nested in preorder
+        enclosing = np.empty(children.size, dtype=np.int64)
+        stack = []
+        for i, (position, end) in enumerate(zip(self.tin[children].tolist(), ends.tolist())):
+            while stack and stack[-1][1] <= position:
+                stack.pop()
+            enclosing[i] = stack[-1][0] if stack else -1
+            stack.append((children[i], end))
+
+        return self.subtree_sums(children, children - enclosing) - 1
+
+
+    def edge_change_regions(self, children, deltas, assignment, facilities):
+
+        """
+        Finds the nodes a change of edge weights can affect, after update_edge_weights. A node keeps its facility unless
+        the path to it got longer, or a shortened edge brings another facility nearer. Those are found with a search
+        from both ends of every shortened edge that stops at the nodes already nearer to their facility than to any
+        facility across the edge (the nodes behind them are as well).
+
+        Args:
+            children (np.ndarray): The node below every changed edge
+            deltas (np.ndarray): Change of the weight of every edge
+            assignment (np.ndarray): The facility every node was assigned to before the change
+            facilities (np.ndarray): The taken facilities
+
+        Returns:
+            reassign (np.ndarray): The nodes whose nearest facility may have changed
+            moved (np.ndarray): The nodes whose distance to their assigned facility changed
+        """
+
+        # The path from a node to its facility crosses a changed edge when they end up in different components without it
+        labels = self.components(children)
+        moved = np.flatnonzero(labels != labels[assignment])
+        reassign = np.zeros(self.n_nodes, dtype=bool)
+        if (deltas > 0).any():
+            labels = self.components(children[deltas > 0])
+            reassign[moved[labels[moved] != labels[assignment[moved]]]] = True
+
+        decreased = np.unique(children[deltas < 0])
+        if decreased.size:
+
+            # Distance from both ends of every shortened edge to the nearest facility across it (infinite if none)
+            facilities = np.asarray(facilities, dtype=np.int64)
+            parents = self.parent[decreased]
+            below = (self.tin[facilities] >= self.tin[decreased, None]) & (self.tin[facilities] < self.tin[decreased, None] + self.subtree_size[decreased, None])
+            weight = self.weighted_depth[decreased] - self.weighted_depth[parents]
+            from_parent = weight + np.where(below, self.dist(decreased[:, None], facilities[None, :]), np.inf).min(axis=1, initial=np.inf)
+            from_child = weight + np.where(below, np.inf, self.dist(parents[:, None], facilities[None, :])).min(axis=1, initial=np.inf)
+
+            offsets = np.concatenate((from_parent, from_child))
+            searched = np.isfinite(offsets)
+            starts, blocked = np.concatenate((parents, decreased))[searched], np.concatenate((decreased, parents))[searched]
+            reassign[self.pruned_search(starts, blocked, offsets[searched], assignment)] = True
+
+        return np.flatnonzero(reassign), moved
+
+
+    def pruned_search(self, starts, blocked, offsets, assignment):
+
+        """
+        Collects the nodes v reachable from some start without going through its blocked node that are at least as near
+        to a facility offset away from that start as to their assigned one: distance(start, v) + offset <= distance(v,
+        assignment[v]). All the searches go one level at a time together and do not expand a node that fails the
+        condition, the nodes behind it fail it too.
+
+        Args:
+            starts (np.ndarray): The node every search starts from
+            blocked (np.ndarray): The neighbour of the start every search does not go through
+            offsets (np.ndarray): The offset of every search
+            assignment (np.ndarray): The facility every node is assigned to
+
+        Returns:
+            region (np.ndarray): The nodes found
+        """
+
+        indptr, children = self.children
+        frontier, came_from, distance = starts, blocked, offsets
+        keep = distance <= self.dist(frontier, assignment[frontier])
+        frontier, came_from, distance = frontier[keep], came_from[keep], distance[keep]
+        region = [frontier]
+
+        while frontier.size:
+
+            # Neighbours are the children and the parent of every node, except the node the search came from
+            counts = indptr[frontier + 1] - indptr[frontier]
+            positions = np.repeat(indptr[frontier] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            down = children[positions]
+            has_parent = self.parent[frontier] != frontier
+            up = self.parent[frontier[has_parent]]
+            neighbours = np.concatenate((down, up))
+            sources = np.concatenate((np.repeat(frontier, counts), frontier[has_parent]))
+            neighbour_distance = np.concatenate((np.repeat(distance, counts) + self.weighted_depth[down] - self.weighted_depth[np.repeat(frontier, counts)],
+                                                 distance[has_parent] + self.weighted_depth[frontier[has_parent]] - self.weighted_depth[up]))
+            previous = np.concatenate((np.repeat(came_from, counts), came_from[has_parent]))
+
+            keep = neighbours != previous
+            neighbours, sources, neighbour_distance = neighbours[keep], sources[keep], neighbour_distance[keep]
+            keep = neighbour_distance <= self.dist(neighbours, assignment[neighbours])
+            frontier, came_from, distance = neighbours[keep], sources[keep], neighbour_distance[keep]
+            region.append(frontier)
+
+        return np.unique(np.concatenate(region))
+
+
+    def lowest_common_ancestor(self, u, v):
+
+        """
+        Vectorized LCA: the shallowest node in the preorder range (tin[u], tin[v]] is a child of the LCA.
+
+        Args:
+            u, v (array-like): Node ids (broadcast against each other)
+
+        Returns:
+            np.ndarray: The lowest common ancestor of every pair
+        """
+
+        u, v = np.broadcast_arrays(np.asarray(u, dtype=np.int64), np.asarray(v, dtype=np.int64))
+        first = np.minimum(self.tin[u], self.tin[v]) + 1
+        last = np.maximum(self.tin[u], self.tin[v])
+        same = first > last
+        first = np.where(same, last, first)
+
+        k = np.log2(last - first + 1).astype(np.int64)
+        left = self.sparse_table[k, first]
+        right = self.sparse_table[k, last - (1 << k) + 1]
+        shallowest = np.where(self.depth[left] <= self.depth[right], left, right)
+
+        return np.where(same, u, self.parent[shallowest])
+
+
+    def dist(self, u, v):
+
+        # Distance between nodes (vectorized)
+        return self.weighted_depth[u] + self.weighted_depth[v] - 2 * self.weighted_depth[self.lowest_common_ancestor(u, v)]
+
+
+    def column(self, facility):
+
+        """
+        Distances from every node to a single facility.
+
+        Args:
+            facility (int): The facility node
+
+        Returns:
+            np.ndarray: (n_nodes,) distances
+        """
+
+        return self.dist(facility, np.arange(self.n_nodes))
+
+
+    def columns(self, facilities, nodes=None):
+
+        """
+        Distances from the given facilities to every node (or to the given nodes).
+
+        Args:
+            facilities (array-like): The facility nodes
+            nodes (array-like): The nodes (all nodes if None)
+
+        Returns:
+            np.ndarray: (len(facilities), n_nodes) distances, one row per facility
+        """
+
+        nodes = np.arange(self.n_nodes) if nodes is None else np.asarray(nodes, dtype=np.int64)
+        return self.dist(np.asarray(facilities, dtype=np.int64)[:, None], nodes[None, :])
+
+
+    def assign_nearest_facilities(self, taken_facilities, rng, nodes=None, instrumentation=NULL_INSTRUMENTATION):
+
+        """
+        Computes the Voronoi assignment of the nodes to the taken facilities in one vectorized pass.
+
+        Args:
+            taken_facilities (array-like): The facilities taken by the players
+            rng (np.random.Generator): Generator used for the random tie-breaking rule
+            nodes (array-like): Only assign these nodes (all nodes if None)
+            instrumentation (Instrumentation): Counts the random tie-breaks
+
+        Returns:
+            assignment (np.ndarray): The facility each node is assigned to
+            nearest_distance (np.ndarray): The distance from each node to its assigned facility
+        """
+
+        taken_facilities = np.asarray(taken_facilities, dtype=np.intp)
+        return resolve_nearest_facilities(self.columns(taken_facilities, nodes), taken_facilities, rng, instrumentation)
+
+
+class Dijkstra_Distance():
+
+    def __init__(self, indptr, indices, weights, column_cache_size=256):
+
+        """
+        Distances on a general weighted graph computed on demand with Dijkstra over a CSR adjacency, using O(n + m)
+        memory. The Voronoi assignment is a single multi-source Dijkstra from the taken facilities, and after a move
+        only the region that changes owner is settled again. Use from_edges or from_graph to build it.
+
+        Args:
+            indptr (np.ndarray): The neighbours of node v are indices[indptr[v]:indptr[v + 1]]
+            indices (np.ndarray): Neighbour of every adjacency entry
+            weights (np.ndarray): Weight of every adjacency entry (non negative)
+            column_cache_size (int): Number of single-source distance columns kept, least recently used dropped first
+        """
+
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.n_nodes = indptr.shape[0] - 1
+        self.column_cache_size = column_cache_size
+        self.column_cache = OrderedDict()
+        self.adjacency = None # Python lists of the CSR arrays, built on first use because the Dijkstra loops run in Python
+
+
+    @classmethod
+    def from_graph(cls, G):
+
+        # Build the structure from a NetworkX graph with 'weight' edge attributes
+        edges = np.array(list(G.edges()), dtype=np.int64).reshape(-1, 2)
+        weights = np.array([G.edges[u, v].get('weight', 1) for u, v in edges])
+        return cls.from_edges(G.number_of_nodes(), edges, weights)
+
+
+    @classmethod
+    def from_edges(cls, n_nodes, edges, weights):
+        return cls(*build_csr(n_nodes, edges, weights))
+
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['indptr'], arrays['indices'], arrays['weights'])
+
+
+    def to_arrays(self):
+
+        # Arrays that fully describe the engine, see from_arrays
+        return {'indptr': self.indptr, 'indices': self.indices, 'weights': self.weights}
+
+
+    def adjacency_lists(self):
+        if self.adjacency is None:
+            self.adjacency = (self.indptr.tolist(), self.indices.tolist(), self.weights.tolist())
+        return self.adjacency
+
+
+    def column(self, facility):
+
+        """
+        Distances from every node to a single facility (single-source Dijkstra, cached).
+
+        Args:
+            facility (int): The facility node
+
+        Returns:
+            np.ndarray: (n_nodes,) distances
+        """
+
+        facility = int(facility)
+        if facility in self.column_cache:
+            self.column_cache.move_to_end(facility)
+            return self.column_cache[facility]
+
+        indptr, indices, weights = self.adjacency_lists()
+        best = [np.inf] * self.n_nodes
+        best[facility] = 0
+        heap = [(0, facility)]
+        while heap:
+            d, v = heapq.heappop(heap)
+            if d > best[v]:
+                continue
+            for position in range(indptr[v], indptr[v + 1]):
+                u, nd = indices[position], d + weights[position]
+                if nd < best[u]:
+                    best[u] = nd
+                    heapq.heappush(heap, (nd, u))
+
+        distances = np.array(best, dtype=self.weights.dtype)
+        distances.flags.writeable = False # Shared by every caller through the cache
+        self.column_cache[facility] = distances
+        if len(self.column_cache) > self.column_cache_size:
+            self.column_cache.popitem(last=False)
+        return distances
+
+
+    def columns(self, facilities):
+
+        """
+        Distances from the given facilities to every node.
+
+        Args:
+            facilities (array-like): The facility nodes
+
+        Returns:
+            np.ndarray: (len(facilities), n_nodes) distances, one row per facility
+        """
+
+        facilities = np.asarray(facilities, dtype=np.intp).reshape(-1)
+        result = np.empty((facilities.size, self.n_nodes), dtype=self.weights.dtype)
+        for row, facility in enumerate(facilities):
+            result[row] = self.column(facility)
+        return result
+
+
+    def dist(self, u, v):
+
+        # Distance between nodes (vectorized), one Dijkstra per distinct source on the side with fewer distinct nodes
+        u, v = np.broadcast_arrays(np.asarray(u, dtype=np.intp), np.asarray(v, dtype=np.intp))
+        if np.unique(v).size < np.unique(u).size:
+            u, v = v, u
+        result = np.empty(u.shape, dtype=self.weights.dtype)
+        for source in np.unique(u):
+            same_source = u == source
+            result[same_source] = self.column(source)[v[same_source]]
+        return result
+
+
+    def settle(self, heap, best, fixed=None, new_facility=None):
+
+        """
+        Runs Dijkstra from the (distance, node, facility) entries of heap, carrying to every node each facility that
+        reaches it at its shortest distance so ties can be broken afterwards.
+
+        Args:
+            heap (list): Initial entries, turned into a heap in place
+            best (list): Best distance known to every node, updated in place (entries above it are ignored)
+            fixed (list): Nodes flagged True keep their assignment unless new_facility reaches them
+            new_facility (int): The only facility allowed into the fixed nodes
+
+        Returns:
+            nearest (dict): The facilities at shortest distance of every node settled in this pass
+        """
+
+        indptr, indices, weights = self.adjacency_lists()
+        heapq.heapify(heap)
+        nearest = {}
+        while heap:
+            d, v, facility = heapq.heappop(heap)
+            if d > best[v]:
+                continue
+            facilities = nearest.get(v)
+            if facilities is None:
+                nearest[v] = [facility]
+            elif facility in facilities:
+                continue
+            else:
+                facilities.append(facility) # Another facility at exactly the same distance, it is propagated too
+            for position in range(indptr[v], indptr[v + 1]):
+                u, nd = indices[position], d + weights[position]
+                if nd <= best[u] and (fixed is None or not fixed[u] or facility == new_facility):
+                    best[u] = nd
+                    heapq.heappush(heap, (nd, u, facility))
+        return nearest
+
+
+    def resolve_ties(self, nearest, rng, instrumentation=NULL_INSTRUMENTATION):
+
+        # Nodes with several facilities at shortest distance are assigned at random among them
+        nodes = np.fromiter(nearest.keys(), dtype=np.intp, count=len(nearest))
+        assignment = np.fromiter((facilities[0] for facilities in nearest.values()), dtype=np.intp, count=len(nearest))
+        tied = [(i, facilities) for i, facilities in enumerate(nearest.values()) if len(facilities) > 1]
+        if tied:
+            instrumentation.count('random_tie_breaks', len(tied))
+            picks = rng.random(len(tied))
+            for (i, facilities), pick in zip(tied, picks):
+                assignment[i] = facilities[int(pick * len(facilities))]
+        return nodes, assignment
+
+
+    def assign_nearest_facilities(self, taken_facilities, rng, nodes=None, instrumentation=NULL_INSTRUMENTATION):
+
+        """
+        Computes the Voronoi assignment of the nodes to the taken facilities with one multi-source Dijkstra, in
+        O(m log n) time.
+
+        Args:
+            taken_facilities (array-like): The facilities taken by the players
+            rng (np.random.Generator): Generator used for the random tie-breaking rule
+            nodes (array-like): Only return these nodes (all nodes if None)
+            instrumentation (Instrumentation): Counts the random tie-breaks
+
+        Returns:
+            assignment (np.ndarray): The facility each node is assigned to
+            nearest_distance (np.ndarray): The distance from each node to its assigned facility
+        """
+
+        if len(taken_facilities) == 0:
+            raise ValueError("At least one facility must be taken.")
+
+        best = [np.inf] * self.n_nodes
+        heap = []
+        for facility in np.asarray(taken_facilities, dtype=np.intp).tolist():
+            best[facility] = 0
+            heap.append((0, facility, facility))
+        settled_nodes, settled_assignment = self.resolve_ties(self.settle(heap, best), rng, instrumentation)
+
+        assignment = np.empty(self.n_nodes, dtype=np.intp)
+        assignment[settled_nodes] = settled_assignment
+        nearest_distance = np.array(best, dtype=self.weights.dtype)
+        if nodes is None:
+            return assignment, nearest_distance
+        nodes = np.asarray(nodes, dtype=np.intp)
+        return assignment[nodes], nearest_distance[nodes]
+
+
+    def reassign_after_move(self, assignment, nearest_distance, old_facility, new_facility, rng, instrumentation=NULL_INSTRUMENTATION):
+
+        """
+        Updates a Voronoi assignment after one facility moves, settling again only the region that changes: the nodes of
+        the old facility, seeded from the distances of their neighbours outside it, and the nodes the new facility
+        reaches at most as far as their current facility.
+
+        Ties are broken among the facilities this pass sees: nodes outside the old facility's region only compare their
+        current facility with the new one, and a neighbour seeding the region only contributes the facility it is
+        assigned to even if it was tied.
+
+        Args:
+            assignment (np.ndarray): The facility each node is assigned to before the move
+            nearest_distance (np.ndarray): The distance from each node to its assigned facility before the move
+            old_facility (int): The facility that is left
+            new_facility (int): The facility that is taken
+            rng (np.random.Generator): Generator used for the random tie-breaking rule
+            instrumentation (Instrumentation): Counts the random tie-breaks
+
+        Returns:
+            changed_nodes (np.ndarray): The nodes that are settled again
+            new_assignment (np.ndarray): The facility each changed node is assigned to
+            new_distance (np.ndarray): The distance from each changed node to its assigned facility
+        """
+
+        lost = assignment == old_facility
+        lost_nodes = np.flatnonzero(lost)
+
+        # Nodes of the old facility start unreached, every other node keeps its distance as the bound to beat
+        best = np.where(lost, np.inf, nearest_distance.astype(np.float64)).tolist()
+        best[new_facility] = 0
+        heap = [(0, int(new_facility), int(new_facility))]
+
+        # Seed the lost region from its neighbours outside it, which keep their facility
+        counts = self.indptr[lost_nodes + 1] - self.indptr[lost_nodes]
+        positions = np.repeat(self.indptr[lost_nodes] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        neighbours = self.indices[positions]
+        outside = ~lost[neighbours]
+        seed_nodes = np.repeat(lost_nodes, counts)[outside]
+        seed_distances = nearest_distance[neighbours[outside]] + self.weights[positions][outside]
+        seed_facilities = assignment[neighbours[outside]]
+        heap.extend(zip(seed_distances.tolist(), seed_nodes.tolist(), seed_facilities.tolist()))
+        for node, d in zip(seed_nodes.tolist(), seed_distances.tolist()):
+            best[node] = min(best[node], d)
+
+        nearest = self.settle(heap, best, fixed=(~lost).tolist(), new_facility=int(new_facility))
+
+        # A node outside the lost region reached by the new facility at exactly its distance is tied with its facility
+        for node, facilities in nearest.items():
+            if not lost[node] and best[node] == nearest_distance[node] and assignment[node] not in facilities:
+                facilities.append(int(assignment[node]))
+
+        changed_nodes, new_assignment = self.resolve_ties(nearest, rng, instrumentation)
+        order = np.argsort(changed_nodes)
+        changed_nodes, new_assignment = changed_nodes[order], new_assignment[order]
+        new_distance = np.array([best[node] for node in changed_nodes.tolist()], dtype=nearest_distance.dtype)
+        return changed_nodes, new_assignment, new_distance
+
+
+# Distance engines by the name used in the configuration
+DISTANCE_BACKENDS = {
+    'matrix': Distance_Matrix,
+    'tree': Tree_Distance,
+    'dijkstra': Dijkstra_Distance,
+}
@@ -0,0 +1,105 @@
+import numpy as np
+
+class Edge_Weight_Dynamics():
+
+    def __init__(self, edge_fraction=0.01, step=1.0, min_weight=1):
+
+        """
+        Random walk of the edge weights between the epochs of a dynamic simulation (e.g. changing congestion): every
+        epoch a random fraction of the edges changes its weight by a normal step rounded to an integer, without going
+        below min_weight.
+
+        Args:
+            edge_fraction (float): Fraction of the edges that change every epoch (at least one)
+            step (float): Standard deviation of the change of a weight
+            min_weight (int): Lowest weight an edge can take
+        """
+
+        if not 0 < edge_fraction <= 1:
+            raise ValueError("The fraction of changing edges must be in (0, 1].")
+
+        self.edge_fraction = edge_fraction
+        self.step = step
+        self.min_weight = min_weight
+
+
+    def sample(self, edge_weights, rng):
+
+        """
+        Draws the edge weights of the next epoch.
+
+        Args:
+            edge_weights (np.ndarray): The current weight of every edge
+            rng (np.random.Generator): Generator the changes are drawn from
+
+        Returns:
+            edge_indices (np.ndarray): The edges whose weight changed
+            weights (np.ndarray): Their new weights
+        """
+
+        n_edges = edge_weights.shape[0]
+        if n_edges == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        edge_indices = rng.choice(n_edges, max(1, round(self.edge_fraction * n_edges)), replace=False)
+        steps = np.round(rng.normal(scale=self.step, size=edge_indices.size)).astype(np.int64)
+        weights = np.maximum(edge_weights[edge_indices] + steps, self.min_weight)
+
+        changed = weights != edge_weights[edge_indices]
+        return edge_indices[changed], weights[changed]
+
+
+class Demand_Dynamics():
+
+    MODES = ('random_walk', 'resample')
+
+    def __init__(self, mode='random_walk', node_fraction=0.01, step=1.0, min_demand=1):
+
+        """
+        Stochastic evolution of the node demand between the epochs of a dynamic simulation: every epoch a random fraction
+        of the nodes either changes its demand by a normal step rounded to an integer ('random_walk', never going below
+        min_demand) or draws a new demand from the environment's demand distribution ('resample').
+
+        Args:
+            mode (str): 'random_walk' or 'resample'
+            node_fraction (float): Fraction of the nodes that change every epoch (at least one)
+            step (float): Standard deviation of the change of a demand in the 'random_walk' mode
+            min_demand (int): Lowest demand a node can take in the 'random_walk' mode
+        """
+
+        if mode not in self.MODES:
+            raise ValueError("Unsupported demand dynamics mode.")
+        if not 0 < node_fraction <= 1:
+            raise ValueError("The fraction of changing nodes must be in (0, 1].")
+
+        self.mode = mode
+        self.node_fraction = node_fraction
+        self.step = step
+        self.min_demand = min_demand
+
+
+    def sample(self, node_demand, rng, sample_demand):
+
+        """
+        Draws the node demand of the next epoch.
+
+        Args:
+            node_demand (np.ndarray): The current demand of every node
+            rng (np.random.Generator): Generator the changes are drawn from
+            sample_demand (callable): Draws sample_demand(n, rng) demands from the environment's distribution
+
+        Returns:
+            nodes (np.ndarray): The nodes whose demand changed
+            demand (np.ndarray): Their new demand
+        """
+
+        n_nodes = node_demand.shape[0]
+        nodes = rng.choice(n_nodes, max(1, round(self.node_fraction * n_nodes)), replace=False)
+        if self.mode == 'random_walk':
+            steps = np.round(rng.normal(scale=self.step, size=nodes.size)).astype(np.int64)
+            demand = np.maximum(node_demand[nodes] + steps, self.min_demand)
+        else:
+            demand = sample_demand(nodes.size, rng)
+
+        changed = demand != node_demand[nodes]
+        return nodes[changed], demand[changed]
@@ -0,0 +1,126 @@
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+class Instrumentation():
+
+    enabled = True
+
+    def __init__(self, trace=False, max_trace_events=1_000_000):
+
+        """
+        Collects counters, timers and an optional timeline of a run, and calls the attached hooks after every iteration.
+        Use NULL_INSTRUMENTATION (same interface, does nothing) when instrumentation is disabled.
+
+        Args:
+            trace (bool): True to keep every timed section as an event of a Chrome trace timeline
+            max_trace_events (int): Events kept at most, later ones are dropped
+        """
+
+        self.counters = defaultdict(int)
+        self.timer_totals = defaultdict(float)
+        self.timer_counts = defaultdict(int)
+        self.hooks = []
+        self.trace = trace
+        self.max_trace_events = max_trace_events
+        self.trace_events = []
+        self.start_time = time.perf_counter()
+
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+
+    @contextmanager
+    def timer(self, name):
+
+        # Time a section of code, adding it to the timeline if tracing
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.timer_totals[name] += end - start
+            self.timer_counts[name] += 1
+            if self.trace and len(self.trace_events) < self.max_trace_events:
+                self.trace_events.append({'name': name, 'ph': 'X', 'ts': 1e6 * (start - self.start_time), 'dur': 1e6 * (end - start), 'pid': os.getpid(), 'tid': 0})
+
+
+    def add_hook(self, hook):
+
+        """
+        Attaches a callback called after every iteration of the BRD process.
+
+        Args:
+            hook (callable): Called as hook(iteration, BRD_setup, moved)
+        """
+
+        self.hooks.append(hook)
+
+
+    def on_iteration(self, iteration, BRD_setup, moved):
+        for hook in self.hooks:
+            hook(iteration, BRD_setup, moved)
+
+
+    def summary(self):
+
+        """
+        Returns:
+            summary (dict): The counters, and the calls, total and mean time of every timer
+        """
+
+        return {
+            'counters': dict(self.counters),
+            'timers': {
+                name: {'calls': self.timer_counts[name], 'total_time': total, 'mean_time': total / self.timer_counts[name]}
+                for name, total in self.timer_totals.items()
+            },
+        }
+
+
+    def export_chrome_trace(self, file_path):
+
+        # Write the timeline in the Chrome trace event format (chrome://tracing, Perfetto), with the final counters
+        events = list(self.trace_events)
+        events.append({'name': 'counters', 'ph': 'C', 'ts': 1e6 * (time.perf_counter() - self.start_time), 'pid': os.getpid(), 'args': dict(self.counters)})
+
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(file_path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+class Null_Instrumentation():
+
+    enabled = False
+
+    class Null_Timer():
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc_info):
+            return False
+
+    NULL_TIMER = Null_Timer()
+
+    # Same interface as Instrumentation, every call does nothing
+    def count(self, name, amount=1):
+        pass
+
+    def timer(self, name):
+        return self.NULL_TIMER
+
+    def add_hook(self, hook):
+        raise ValueError("Hooks need an enabled Instrumentation.")
+
+    def on_iteration(self, iteration, BRD_setup, moved):
+        pass
+
+    def summary(self):
+        return None
+
+
+NULL_INSTRUMENTATION = Null_Instrumentation()
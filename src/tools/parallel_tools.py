@@ -0,0 +1,148 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from tools.distance_tools import DISTANCE_BACKENDS
+
+# State of each worker process, set once by initialize_worker
+_worker_simulation = None
+_worker_shared_memory = []
+
+
+class Shared_FLG_environment():
+
+    def __init__(self, node_demand, potential_facilities_mask, node_capacity=None):
+
+        # Environment arrays attached from shared memory, exposing what BRD reads from an FLG_environment
+        self.n_nodes = node_demand.shape[0]
+        self.node_demand = node_demand
+        self.potential_facilities_mask = potential_facilities_mask
+        self.node_capacity = node_capacity
+
+
+def share_array(array):
+
+    """
+    Copies an array into a new shared memory block.
+
+    Args:
+        array (np.ndarray): The array to share
+
+    Returns:
+        block (SharedMemory): The shared memory block, the caller is responsible for closing and unlinking it
+        spec (tuple): (name, shape, dtype) needed to attach the array from another process
+    """
+
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec):
+
+    # Attach an array shared by share_array without copying it
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def initialize_worker(simulation_parameters, shared_specs):
+
+    """
+    Builds the Simulation each worker runs its repetitions on. With shared_specs the environment and the arrays of the
+    distance engine are attached from shared memory, otherwise the worker generates its own environment.
+    """
+
+    from Simulation import Simulation
+
+    global _worker_simulation
+
+    FLG_env = distances = None
+    if shared_specs is not None:
+        arrays = {}
+        for key, spec in shared_specs.items():
+            block, arrays[key] = attach_array(spec)
+            _worker_shared_memory.append(block) # Keep the blocks alive as long as the worker
+        FLG_env = Shared_FLG_environment(arrays['node_demand'], arrays['potential_facilities_mask'], arrays.get('node_capacity'))
+        distance_arrays = {key[len('distance_'):]: array for key, array in arrays.items() if key.startswith('distance_')}
+        distances = DISTANCE_BACKENDS[simulation_parameters['distance_backend']].from_arrays(distance_arrays)
+
+    _worker_simulation = Simulation(**simulation_parameters, FLG_env=FLG_env, distances=distances)
+
+
+def run_worker_repetition(task):
+
+    # Run one repetition in a worker process
+    seed_sequence, fresh_environment = task
+    return _worker_simulation.run_repetition(seed_sequence, fresh_environment)
+
+
+def iterate_repetitions(simulation, seed_sequences, n_workers=None, fresh_environments=False):
+
+    """
+    Runs one repetition of the simulation per seed sequence over a process pool, yielding each result as soon as it is
+    available.
+
+    Args:
+        simulation (Simulation): The simulation whose parameters (and environment, if shared) the workers use
+        seed_sequences (list): One np.random.SeedSequence per repetition
+        n_workers (int): Number of worker processes (one per core if None)
+        fresh_environments (bool): True to generate a new environment for every repetition, False to share the
+                                   simulation's environment through shared memory
+
+    Yields:
+        result (tuple): (iterations, trajectory) of every repetition, in the order of seed_sequences
+    """
+
+    n_workers = n_workers or os.cpu_count()
+    simulation_parameters = {
+        'n_nodes': simulation.n_nodes,
+        'n_potential_facilities': simulation.n_potential_facilities,
+        'n_brd_players': simulation.n_brd_players,
+        'max_iterations': simulation.max_iterations,
+        'seed': simulation.seed,
+        'demand_distribution': simulation.demand_distribution,
+        'weight_distribution': simulation.weight_distribution,
+        'best_response_mode': simulation.best_response_mode,
+        'use_facility_ranking': simulation.use_facility_ranking,
+        'recording_level': simulation.recording_level,
+        'recording_interval': simulation.recording_interval,
+        'distance_backend': simulation.distance_backend,
+        'graph_type': simulation.graph_type,
+        'edge_list_path': simulation.edge_list_path,
+        'scheduler': simulation.scheduler,
+        'convergence_threshold': simulation.convergence_threshold,
+        'capacitated_facilities': simulation.capacitated_facilities,
+        'facility_capacity': simulation.facility_capacity,
+        'profile_cache_size': simulation.profile_cache_size,
+        'cycle_revisits': simulation.cycle_revisits,
+        'instrumentation': simulation.instrument,
+        'trace': simulation.trace,
+        'environment_cache': simulation.environment_cache,
+    }
+
+    blocks = []
+    shared_specs = None
+    if not fresh_environments:
+        shared_specs = {}
+        shared_arrays = {
+            **{f"distance_{name}": array for name, array in simulation.distances.to_arrays().items()},
+            'node_demand': np.asarray(simulation.FLG_env.node_demand),
+            'potential_facilities_mask': np.asarray(simulation.FLG_env.potential_facilities_mask),
+        }
+        if simulation.FLG_env.node_capacity is not None:
+            shared_arrays['node_capacity'] = np.asarray(simulation.FLG_env.node_capacity)
+        for key, array in shared_arrays.items():
+            block, shared_specs[key] = share_array(array)
+            blocks.append(block)
+
+    try:
+        tasks = [(seed_sequence, fresh_environments) for seed_sequence in seed_sequences]
+        chunksize = max(1, len(tasks) // (4 * n_workers))
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=initialize_worker, initargs=(simulation_parameters, shared_specs)) as executor:
+            yield from executor.map(run_worker_repetition, tasks, chunksize=chunksize)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
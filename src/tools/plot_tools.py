@@ -0,0 +1,230 @@
+from tools.result_tools import Running_Statistics
+
+import os
+import numpy as np
+
+def import_pyplot():
+
+    # matplotlib is only imported when something is plotted, with the non-interactive Agg backend unless another one
+    # was chosen through MPLBACKEND
+    import matplotlib
+    if 'MPLBACKEND' not in os.environ:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def lttb(x, y, n_out):
+
+    """
+    Largest-Triangle-Three-Buckets downsampling: keeps the first and last points and, from each of n_out - 2 buckets in
+    between, the point forming the largest triangle with the point kept before it and the mean of the next bucket.
+
+    Args:
+        x (np.ndarray): Increasing x values
+        y (np.ndarray): y values
+        n_out (int): Number of points kept
+
+    Returns:
+        indices (np.ndarray): Increasing indices of the points kept
+    """
+
+    n = x.shape[0]
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x, y = x.astype(np.float64), y.astype(np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp) # Buckets of the points between the first and the last
+    indices = np.empty(n_out, dtype=np.intp)
+    indices[0], indices[-1] = 0, n - 1
+
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < n_out - 1 else n
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        previous = indices[bucket]
+
+        # Twice the area of the triangle (previous point, candidate, mean of the next bucket)
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        indices[bucket + 1] = start + np.argmax(area)
+
+    return indices
+
+
+def min_max_decimation(y, n_out):
+
+    """
+    Keeps the minimum and the maximum of each of n_out / 2 equal buckets, so spikes survive the downsampling.
+
+    Args:
+        y (np.ndarray): y values
+        n_out (int): Number of points kept
+
+    Returns:
+        indices (np.ndarray): Increasing indices of the points kept
+    """
+
+    n = y.shape[0]
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(n)
+
+    # Pad the series to a whole number of buckets with values that are never picked
+    bucket_size = -(-n // n_buckets)
+    padding = n_buckets * bucket_size - n
+    low = np.pad(y.astype(np.float64), (0, padding), constant_values=np.inf).reshape(n_buckets, bucket_size)
+    high = np.pad(y.astype(np.float64), (0, padding), constant_values=-np.inf).reshape(n_buckets, bucket_size)
+
+    offsets = np.arange(n_buckets) * bucket_size
+    indices = np.concatenate((offsets + np.argmin(low, axis=1), offsets + np.argmax(high, axis=1)))
+    return np.unique(indices[indices < n])
+
+
+class Plotter():
+
+    DECIMATIONS = ('lttb', 'min_max', 'none')
+
+    def __init__(self, output_dir='output/plots', max_points=2000, decimation='lttb', dpi=100):
+
+        """
+        Renders the results of the simulations to image files, downsampling long series to a fixed point budget.
+
+        Args:
+            output_dir (str): Directory where the plots are saved
+            max_points (int): Points drawn at most per series
+            decimation (str): 'lttb' (Largest-Triangle-Three-Buckets), 'min_max' (extremes of each bucket) or 'none'
+            dpi (int): Resolution of the saved images
+        """
+
+        if decimation not in self.DECIMATIONS:
+            raise ValueError("Unsupported decimation.")
+
+        self.output_dir = output_dir
+        self.max_points = max_points
+        self.decimation = decimation
+        self.dpi = dpi
+
+
+    def decimate(self, x, y):
+
+        # Downsample a series to max_points with the chosen decimation
+        x, y = np.asarray(x), np.asarray(y)
+        if self.decimation == 'lttb':
+            indices = lttb(x, y, self.max_points)
+        elif self.decimation == 'min_max':
+            indices = min_max_decimation(y, self.max_points)
+        else:
+            return x, y
+        return x[indices], y[indices]
+
+
+    def save(self, figure, file_name):
+
+        # Save a figure in the output directory and release it
+        os.makedirs(self.output_dir, exist_ok=True)
+        file_path = os.path.join(self.output_dir, file_name)
+        figure.savefig(file_path, dpi=self.dpi)
+        import_pyplot().close(figure)
+        return file_path
+
+
+    def plot_simulation(self, trajectory, file_name='simulation.png'):
+
+        """
+        Plots the potential function, the facility positions and the utilities of a run over its iterations.
+
+        Args:
+            trajectory (Trajectory_Recorder): The recorded development of the run
+            file_name (str): Name of the image in the output directory
+
+        Returns:
+            file_path (str): Where the plot was saved
+        """
+
+        plt = import_pyplot()
+        figure, (potential_axis, positions_axis, utilities_axis) = plt.subplots(3, 1, figsize=(10, 12))
+
+        # Plot development of the Potential Function Over Time
+        potential_axis.plot(*self.decimate(trajectory.iterations, trajectory.potential))
+        potential_axis.set_title("Potential Function Over Time")
+        potential_axis.set_xlabel("Iteration")
+        potential_axis.set_ylabel("Potential Function Value")
+        potential_axis.grid(True)
+
+        # Plot development of the Facility Positions Over Time, positions hold until the next recorded iteration
+        for pid in range(trajectory.n_players):
+            positions_axis.plot(*self.decimate(trajectory.iterations, trajectory.positions[:, pid]), label=f'Player {pid}', drawstyle='steps-post')
+        positions_axis.set_title("Facility Positions Over Time")
+        positions_axis.set_xlabel("Iteration")
+        positions_axis.set_ylabel("Facility ID")
+        positions_axis.legend()
+        positions_axis.grid(True)
+
+        # Plot development of the Utility Over Time
+        for pid in range(trajectory.n_players):
+            utilities_axis.plot(*self.decimate(trajectory.iterations, trajectory.utilities[:, pid]), label=f'Player {pid}')
+        utilities_axis.set_title("Utility Over Time")
+        utilities_axis.set_xlabel("Iteration")
+        utilities_axis.set_ylabel("Utility")
+        utilities_axis.legend()
+        utilities_axis.grid(True)
+
+        figure.tight_layout()
+        return self.save(figure, file_name)
+
+
+    def aggregate_potential(self, runs, max_iteration):
+
+        """
+        Streams the potential of many runs into its mean and variance over a grid of at most max_points iterations. Each
+        run holds its last recorded value between records and after it ends, so runs of any length or recording
+        level are comparable.
+
+        Args:
+            runs (iterable): (iterations, potential) arrays of every run, read one at a time
+            max_iteration (int): Last iteration of the longest run
+
+        Returns:
+            grid (np.ndarray): The iterations the statistics are computed at
+            statistics (Running_Statistics): Mean and variance of the potential at every grid iteration
+        """
+
+        grid = np.unique(np.linspace(1, max(max_iteration, 1), self.max_points).round().astype(np.int64))
+        statistics = Running_Statistics()
+        for iterations, potential in runs:
+            if len(iterations) == 0:
+                continue
+            rows = np.clip(np.searchsorted(iterations, grid, side='right') - 1, 0, None)
+            statistics.update(np.asarray(potential, dtype=np.float64)[rows])
+        return grid, statistics
+
+
+    def plot_aggregate(self, grid, statistics, file_name='aggregate.png'):
+
+        """
+        Plots the mean potential function over the iterations with a band of one standard deviation around it.
+
+        Args:
+            grid (np.ndarray): The iterations of the statistics
+            statistics (Running_Statistics): Mean and variance at every grid iteration, see aggregate_potential
+            file_name (str): Name of the image in the output directory
+
+        Returns:
+            file_path (str): Where the plot was saved
+        """
+
+        plt = import_pyplot()
+        figure, axis = plt.subplots(figsize=(10, 5))
+
+        mean = np.broadcast_to(statistics.mean, grid.shape)
+        deviation = np.sqrt(np.broadcast_to(statistics.variance, grid.shape))
+        axis.plot(grid, mean, label='Mean')
+        axis.fill_between(grid, mean - deviation, mean + deviation, alpha=0.3, label='± 1 std')
+        axis.set_title(f"Potential Function Over Time ({statistics.count} runs)")
+        axis.set_xlabel("Iteration")
+        axis.set_ylabel("Potential Function Value")
+        axis.legend()
+        axis.grid(True)
+
+        figure.tight_layout()
+        return self.save(figure, file_name)
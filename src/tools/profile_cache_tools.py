@@ -0,0 +1,131 @@
+from collections import OrderedDict
+
+import numpy as np
+
+class Profile_Cache():
+
+    def __init__(self, max_entries=4096, seed=0):
+
+        """
+        Bounded memo of the Voronoi assignment of occupied-facility profiles. A profile is the canonical (sorted) tuple
+        of the occupied facilities, whoever occupies them, and its entry holds the demand and cost every facility of it
+        captures. The least recently used entry is evicted once max_entries are stored. Random tie-breaks of a profile
+        are drawn from a generator seeded by the profile itself, so a cached entry is exactly what recomputing it gives.
+
+        The profiles the game actually moves through are remembered the same way, so returning to an earlier profile
+        (a cycle of the dynamics) is detected with one lookup per move.
+
+        Args:
+            max_entries (int): Profiles stored at most, in the memo and in the visited profiles each
+            seed (int): Entropy of the per-profile tie-breaking generators
+        """
+
+        if max_entries < 1:
+            raise ValueError("The profile cache needs at least one entry.")
+
+        self.max_entries = max_entries
+        self.seed = seed
+        self.entries = OrderedDict() # profile -> (demand, cost) of its facilities, in profile order
+        self.visits = OrderedDict() # profile -> (move after which the game was last in it, times the game returned to it)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.moves = 0
+        self.revisits = 0
+        self.last_cycle_length = None
+        self.last_profile_revisits = 0 # Times the game returned to the profile of the last recorded visit
+
+
+    @staticmethod
+    def key(facilities):
+
+        # Canonical profile of a set of occupied facilities
+        return tuple(sorted(int(facility) for facility in facilities))
+
+
+    def tie_break_rng(self, profile):
+
+        # Generator of the random tie-breaks of a profile, the same every time the profile is assigned
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=profile))
+
+
+    def get(self, profile):
+
+        """
+        Looks a profile up, marking it as the most recently used.
+
+        Returns:
+            entry (tuple): (demand, cost) arrays of the facilities of the profile in profile order, None on a miss
+        """
+
+        entry = self.entries.get(profile)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(profile)
+        return entry
+
+
+    def put(self, profile, demand, cost):
+
+        # Store the totals of a profile, evicting the least recently used one when full
+        self.entries[profile] = (demand, cost)
+        self.entries.move_to_end(profile)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+    def record_visit(self, profile):
+
+        """
+        Records the profile the game is in after a move.
+
+        Returns:
+            cycle_length (int): Moves since the game was last in this profile, None if it was not seen before
+        """
+
+        self.moves += 1
+        previous, revisits = self.visits.pop(profile, (None, -1))
+        self.last_profile_revisits = revisits + 1
+        self.visits[profile] = (self.moves, self.last_profile_revisits)
+        if len(self.visits) > self.max_entries:
+            self.visits.popitem(last=False)
+
+        if previous is None:
+            return None
+        self.revisits += 1
+        self.last_cycle_length = self.moves - previous
+        return self.last_cycle_length
+
+
+    def clear(self, current_profile=None):
+
+        """
+        Forgets every stored profile, e.g. after the distances or the demand changed (the statistics are kept).
+
+        Args:
+            current_profile (tuple): The profile the game is in now, the start of the next visits
+        """
+
+        self.entries.clear()
+        self.visits.clear()
+        if current_profile is not None:
+            self.visits[current_profile] = (self.moves, 0)
+
+
+    def statistics(self):
+
+        # Hit/miss counts of the memo and the revisits of the game
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'moves': self.moves,
+            'revisits': self.revisits,
+            'last_cycle_length': self.last_cycle_length,
+        }
@@ -0,0 +1,207 @@
+import json
+import os
+import numpy as np
+
+class Running_Statistics():
+
+    def __init__(self):
+
+        # Welford's online mean and variance
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+
+    def update(self, value):
+
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+
+    @property
+    def variance(self):
+
+        # Sample variance, 0 with less than two values
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.mean, 'variance': self.variance}
+
+
+class Result_Sink():
+
+    FIELDS = {
+        'iterations': np.int64,
+        'potential': np.float64,
+        'positions': np.int64,
+        'utilities': np.float64,
+    }
+
+    def __init__(self, results_dir, n_players, shard_rows=1 << 20, histogram_bin_width=10):
+
+        """
+        Streams finished runs to append-only binary shards on disk, keeping only running aggregates in memory.
+
+        Args:
+            results_dir (str): Directory where the shards and their index are written
+            n_players (int): Number of players in the game
+            shard_rows (int): Number of recorded iterations a shard holds before a new one is started
+            histogram_bin_width (int): Width, in iterations, of the bins of the convergence-time histogram
+        """
+
+        self.results_dir = results_dir
+        self.n_players = n_players
+        self.shard_rows = shard_rows
+        self.histogram_bin_width = histogram_bin_width
+
+        os.makedirs(self.results_dir, exist_ok=True)
+        if os.path.exists(os.path.join(self.results_dir, 'index.jsonl')):
+            raise ValueError(f"Results already exist in {self.results_dir}.")
+
+        self.shard = 0
+        self.shard_offset = 0
+        self.n_runs = 0
+
+        # Running aggregates
+        self.iterations_statistics = Running_Statistics()
+        self.final_potential_statistics = Running_Statistics()
+        self.convergence_histogram = np.zeros(0, dtype=np.int64)
+
+        self.index_file = open(os.path.join(self.results_dir, 'index.jsonl'), 'a')
+        with open(os.path.join(self.results_dir, 'metadata.json'), 'w') as f:
+            json.dump({'n_players': n_players, 'fields': {field: np.dtype(dtype).str for field, dtype in self.FIELDS.items()}}, f)
+
+
+    def shard_path(self, field, shard):
+        return os.path.join(self.results_dir, f"{field}_{shard:05d}.bin")
+
+
+    def add_run(self, iterations, trajectory):
+
+        """
+        Appends a finished run to the current shard and updates the running aggregates.
+
+        Args:
+            iterations (int): How many iterations the run took
+            trajectory (Trajectory_Recorder): The recorded development of the run
+        """
+
+        length = trajectory.size
+        if self.shard_offset > 0 and self.shard_offset + length > self.shard_rows:
+            self.shard += 1
+            self.shard_offset = 0
+
+        # Append the recorded rows of every field to the shard files
+        for field, dtype in self.FIELDS.items():
+            with open(self.shard_path(field, self.shard), 'ab') as f:
+                np.ascontiguousarray(getattr(trajectory, field), dtype=dtype).tofile(f)
+
+        final_potential = float(trajectory.final_potential())
+        entry = {
+            'run': self.n_runs,
+            'shard': self.shard,
+            'offset': self.shard_offset,
+            'length': length,
+            'iterations': int(iterations),
+            'final_potential': final_potential,
+        }
+        if trajectory.converged is not None:
+            entry['converged'] = trajectory.converged
+            entry['cycle_length'] = trajectory.cycle_length
+        if trajectory.profile is not None:
+            entry['profile'] = trajectory.profile # Instrumentation summary of the run
+        self.index_file.write(json.dumps(entry) + '\n')
+        self.index_file.flush()
+
+        self.shard_offset += length
+        self.n_runs += 1
+
+        self.iterations_statistics.update(iterations)
+        self.final_potential_statistics.update(final_potential)
+        histogram_bin = iterations // self.histogram_bin_width
+        if histogram_bin >= self.convergence_histogram.size:
+            self.convergence_histogram = np.pad(self.convergence_histogram, (0, histogram_bin + 1 - self.convergence_histogram.size))
+        self.convergence_histogram[histogram_bin] += 1
+
+
+    def summary(self):
+
+        """
+        Returns:
+            summary (dict): The running aggregates of all the runs added so far
+        """
+
+        return {
+            'n_runs': self.n_runs,
+            'iterations': self.iterations_statistics.summary(),
+            'final_potential': self.final_potential_statistics.summary(),
+            'convergence_histogram': {'bin_width': self.histogram_bin_width, 'counts': self.convergence_histogram.tolist()},
+        }
+
+
+    def close(self):
+
+        # Write the aggregates next to the shards and close the index
+        with open(os.path.join(self.results_dir, 'summary.json'), 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+        self.index_file.close()
+
+
+class Result_Reader():
+
+    def __init__(self, results_dir):
+
+        """
+        Reads the runs written by a Result_Sink through memory-mapped shards.
+
+        Args:
+            results_dir (str): Directory where the shards and their index were written
+        """
+
+        self.results_dir = results_dir
+
+        with open(os.path.join(results_dir, 'metadata.json'), 'r') as f:
+            metadata = json.load(f)
+        self.n_players = metadata['n_players']
+        self.fields = {field: np.dtype(dtype) for field, dtype in metadata['fields'].items()}
+
+        with open(os.path.join(results_dir, 'index.jsonl'), 'r') as f:
+            self.index = [json.loads(line) for line in f if line.strip()]
+
+
+    def open_shard(self, field, shard):
+
+        # Memory-map a whole shard of one field
+        path = os.path.join(self.results_dir, f"{field}_{shard:05d}.bin")
+        shard_data = np.memmap(path, dtype=self.fields[field], mode='r')
+        if field in ('positions', 'utilities'):
+            shard_data = shard_data.reshape(-1, self.n_players)
+        return shard_data
+
+
+    def iterate_runs(self, fields=('iterations', 'potential')):
+
+        """
+        Yields the runs one by one, each field being a memory-mapped view of its shard.
+
+        Args:
+            fields (tuple): The fields to read
+
+        Yields:
+            entry (dict): The index entry of the run
+            run_data (dict): The memory-mapped data of each requested field
+        """
+
+        open_shard, shards = None, {}
+        for entry in self.index:
+
+            # Only the shard currently being read is mapped
+            if entry['shard'] != open_shard:
+                open_shard = entry['shard']
+                shards = {field: self.open_shard(field, open_shard) for field in fields}
+
+            run_slice = slice(entry['offset'], entry['offset'] + entry['length'])
+            yield entry, {field: shards[field][run_slice] for field in fields}
@@ -0,0 +1,117 @@
+import numpy as np
+
+class Turn_Scheduler():
+
+    def __init__(self, n_players, rng):
+
+        """
+        Decides which player takes the next turn of the BRD process. Every player starts dirty (its best response may
+        differ from its position) and becomes clean once it checks it has no improving move; after a move the other
+        players become dirty again. The process has converged once every player is clean.
+
+        Args:
+            n_players (int): Number of players in the game
+            rng (np.random.Generator): Generator used to pick the players
+        """
+
+        self.n_players = n_players
+        self.rng = rng
+        self.dirty = np.ones(n_players, dtype=bool)
+
+
+    def converged(self):
+        return not self.dirty.any()
+
+
+    def play_turn(self, BRD_setup, player_id):
+
+        # Let one player play its best response and update the dirty flags
+        moved = BRD_setup.find_best_response(player_id)
+        if moved:
+            self.dirty[:] = True # The move changes the game the other players face
+        self.dirty[player_id] = False
+        return moved
+
+
+    def step(self, BRD_setup):
+
+        """
+        Plays one iteration of the BRD process.
+
+        Args:
+            BRD_setup (BRD): The game being played
+
+        Returns:
+            bool: True if a player moved
+        """
+
+        raise NotImplementedError
+
+
+class Random_Scheduler(Turn_Scheduler):
+
+    def step(self, BRD_setup):
+
+        # Original dynamics: any player, clean or not, is picked at random and every player is rechecked after a move
+        player_in_turn = self.rng.choice(tuple(range(self.n_players)))
+        moved = BRD_setup.find_best_response(player_in_turn)
+        if moved:
+            self.dirty[:] = True
+        else:
+            self.dirty[player_in_turn] = False
+        return moved
+
+
+class Dirty_Random_Scheduler(Turn_Scheduler):
+
+    def step(self, BRD_setup):
+
+        # Only players whose best response may have changed are picked
+        return self.play_turn(BRD_setup, self.rng.choice(np.flatnonzero(self.dirty)))
+
+
+class Round_Robin_Scheduler(Turn_Scheduler):
+
+    def __init__(self, n_players, rng):
+        super().__init__(n_players, rng)
+        self.next_player = 0
+
+
+    def step(self, BRD_setup):
+
+        # Players take turns in order, skipping the clean ones
+        dirty_players = np.flatnonzero(self.dirty)
+        position = np.searchsorted(dirty_players, self.next_player)
+        player_in_turn = dirty_players[position % dirty_players.size]
+        self.next_player = (player_in_turn + 1) % self.n_players
+        return self.play_turn(BRD_setup, player_in_turn)
+
+
+class Max_Gain_Scheduler(Turn_Scheduler):
+
+    def step(self, BRD_setup):
+
+        # Every dirty player evaluates its best response and only the one with the largest improvement moves
+        dirty_players = np.flatnonzero(self.dirty)
+        responses = [BRD_setup.evaluate_best_response(player_id) for player_id in dirty_players]
+        gains = np.array([gain for _, gain in responses])
+        best = np.argmax(gains)
+
+        if gains[best] > BRD_setup.convergence_threshold:
+            BRD_setup.move_player(dirty_players[best], responses[best][0])
+            self.dirty[:] = True
+            self.dirty[dirty_players[best]] = False
+            return True
+
+        # No dirty player can improve enough, so all of them are clean
+        self.dirty[dirty_players] = False
+        return False
+
+
+# Schedulers by the name used in the configuration
+SCHEDULERS = {
+    'random': Random_Scheduler,
+    'random_dirty': Dirty_Random_Scheduler,
+    'round_robin': Round_Robin_Scheduler,
+    'max_gain': Max_Gain_Scheduler,
+}
@@ -0,0 +1,215 @@
+import numpy as np
+
+class Trajectory_Recorder():
+
+    RECORDING_LEVELS = ('full', 'every_k', 'moves', 'final')
+
+    def __init__(self, n_players, recording_level='full', recording_interval=1, initial_capacity=1024):
+
+        """
+        Records the development of a BRD run in preallocated arrays that grow geometrically.
+
+        Args:
+            n_players (int): Number of players in the game
+            recording_level (str): 'full' records every iteration, 'every_k' every recording_interval-th iteration,
+                                   'moves' only the iterations where a player moved, 'final' only the last iteration
+            recording_interval (int): Interval used by the 'every_k' level
+            initial_capacity (int): Number of iterations the arrays can hold before growing
+        """
+
+        if recording_level not in self.RECORDING_LEVELS:
+            raise ValueError("Unsupported recording level.")
+        if not isinstance(recording_interval, int) or recording_interval < 1:
+            raise ValueError("The recording interval must be a positive integer.")
+
+        self.n_players = n_players
+        self.recording_level = recording_level
+        self.recording_interval = recording_interval
+
+        capacity = 1 if recording_level == 'final' else max(1, initial_capacity)
+        self.size = 0
+        self.profile = None # Instrumentation summary of the run, if it was instrumented
+        self.converged = None # True if the run ended with no player able to improve, see set_outcome
+        self.cycle_length = None # Moves of the cycle the run was stopped in, None if it was not stopped by a cycle
+        self._iterations = np.empty(capacity, dtype=np.int64)
+        self._positions = np.empty((capacity, n_players), dtype=np.int64)
+        self._utilities = np.empty((capacity, n_players), dtype=np.float64)
+        self._potential = np.empty(capacity, dtype=np.float64)
+
+
+    @property
+    def iterations(self):
+        return self._iterations[:self.size]
+
+    @property
+    def positions(self):
+        return self._positions[:self.size]
+
+    @property
+    def utilities(self):
+        return self._utilities[:self.size]
+
+    @property
+    def potential(self):
+        return self._potential[:self.size]
+
+
+    def record(self, iteration, BRD_setup, moved):
+
+        """
+        Records the state after an iteration if the recording level asks for it. The positions, utilities and potential
+        are only gathered from the game when they are stored.
+
+        Args:
+            iteration (int): The iteration that just finished (starting at 1)
+            BRD_setup (BRD): The game being played
+            moved (bool): If the player in turn moved during this iteration
+        """
+
+        if self.keeps(iteration, moved):
+            positions, utilities = self.player_arrays(BRD_setup.players)
+            self.append(iteration, positions, utilities, BRD_setup.calculate_potential_function())
+
+
+    def record_state(self, iteration, positions, utilities, potential):
+
+        """
+        Stores the state after an iteration the caller already checked the recording level keeps (see keeps), with the
+        facility positions and utilities of the players given as arrays.
+
+        Args:
+            positions (array-like): The facility position of every player
+            utilities (array-like): The utility of every player
+        """
+
+        self.append(iteration, positions, utilities, potential)
+
+
+    def keeps(self, iteration, moved):
+
+        """
+        Tells if the recording level stores the state after an iteration. The last state of a run is stored by
+        finalize, whatever the level.
+
+        Args:
+            iteration (int): The iteration that just finished (starting at 1)
+            moved (bool): If the player in turn moved during this iteration
+
+        Returns:
+            keeps (bool): True if the state after the iteration is recorded
+        """
+
+        if self.recording_level == 'full':
+            return True
+        if self.recording_level == 'every_k':
+            return iteration % self.recording_interval == 0
+        if self.recording_level == 'moves':
+            return moved
+        return False
+
+
+    def finalize(self, iteration, BRD_setup):
+
+        """
+        Makes sure the last iteration of the run is recorded, whatever the recording level, also when the run ended
+        without playing any iteration (the initial state is then recorded as iteration 0).
+
+        Args:
+            iteration (int): The last iteration of the run
+            BRD_setup (BRD): The game being played
+        """
+
+        if not self.is_recorded(iteration):
+            positions, utilities = self.player_arrays(BRD_setup.players)
+            self.finalize_state(iteration, positions, utilities, BRD_setup.calculate_potential_function())
+
+
+    def finalize_state(self, iteration, positions, utilities, potential):
+
+        # Same as finalize, with the facility positions and utilities of the players given as arrays
+        if not self.is_recorded(iteration):
+            if self.recording_level == 'final':
+                self.size = 0
+            self.append(iteration, positions, utilities, potential)
+
+
+    def is_recorded(self, iteration):
+
+        # True if the last recorded row is the given iteration
+        return self.size > 0 and self._iterations[self.size - 1] == iteration
+
+
+    def set_outcome(self, converged, cycle_length=None):
+
+        """
+        Records how the run ended.
+
+        Args:
+            converged (bool): True if no player could improve at the end, False if the run stopped at max_iterations or in a cycle
+            cycle_length (int): Moves between the two visits of the profile the run stopped at, None if it did not stop in a cycle
+        """
+
+        self.converged = bool(converged)
+        self.cycle_length = None if cycle_length is None else int(cycle_length)
+
+
+    def player_arrays(self, players):
+
+        # Facility positions and utilities of the BRD players, indexed by player id
+        positions = np.empty(self.n_players, dtype=np.int64)
+        utilities = np.empty(self.n_players, dtype=np.float64)
+        for player_id, player_data in players.items():
+            positions[player_id] = player_data['facility_position']
+            utilities[player_id] = player_data['Utility']
+        return positions, utilities
+
+
+    def append(self, iteration, positions, utilities, potential):
+
+        # Grow the arrays geometrically when they are full
+        if self.size == self._iterations.shape[0]:
+            self.grow()
+
+        row = self.size
+        self._iterations[row] = iteration
+        self._positions[row] = positions
+        self._utilities[row] = utilities
+        self._potential[row] = potential
+        self.size += 1
+
+
+    def grow(self):
+
+        capacity = 2 * self._iterations.shape[0]
+        self._iterations = np.resize(self._iterations, capacity)
+        self._positions = np.resize(self._positions, (capacity, self.n_players))
+        self._utilities = np.resize(self._utilities, (capacity, self.n_players))
+        self._potential = np.resize(self._potential, capacity)
+
+
+    def final_players(self):
+
+        """
+        Returns:
+            players (dict): The last recorded facility position and utility of every player
+        """
+
+        self.check_recorded()
+        return {
+            player_id: {'facility_position': self._positions[self.size - 1, player_id], 'Utility': self._utilities[self.size - 1, player_id]}
+            for player_id in range(self.n_players)
+        }
+
+
+    def final_potential(self):
+
+        # Last recorded value of the potential function
+        self.check_recorded()
+        return self._potential[self.size - 1]
+
+
+    def check_recorded(self):
+
+        # The buffers are allocated uninitialized, so reading the last row of an empty trajectory would return garbage
+        if self.size == 0:
+            raise ValueError("The trajectory has no recorded iteration, call finalize at the end of the run.")